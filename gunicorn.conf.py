@@ -0,0 +1,74 @@
+"""
+Gunicorn settings for production, picked up automatically when gunicorn is
+started from this directory:
+
+    gunicorn travel_project.wsgi
+
+The application is preloaded in the master, so settings, django.setup()
+and the warm-up in travel_booking.startup run once and the workers fork
+with them already in memory. Every setting can be overridden from the
+environment (or .env) without editing this file.
+"""
+import os
+
+from decouple import config
+
+
+def _cores():
+    try:
+        return len(os.sched_getaffinity(0))  # respects CPU pinning in containers
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+bind = config('GUNICORN_BIND', default='0.0.0.0:8000')
+
+# Searches are CPU-bound Python, so parallelism comes from processes; a few
+# threads per worker cover time spent waiting on the database.
+workers = config('WEB_CONCURRENCY', default=2 * _cores() + 1, cast=int)
+worker_class = 'gthread'
+threads = config('GUNICORN_THREADS', default=2, cast=int)
+
+preload_app = config('GUNICORN_PRELOAD', default=True, cast=bool)
+
+# Recycle workers to bound memory growth; the jitter keeps them from all
+# restarting at once.
+max_requests = config('GUNICORN_MAX_REQUESTS', default=1000, cast=int)
+max_requests_jitter = config('GUNICORN_MAX_REQUESTS_JITTER', default=100, cast=int)
+
+timeout = config('GUNICORN_TIMEOUT', default=30, cast=int)
+graceful_timeout = config('GUNICORN_GRACEFUL_TIMEOUT', default=30, cast=int)
+keepalive = config('GUNICORN_KEEPALIVE', default=5, cast=int)
+
+accesslog = config('GUNICORN_ACCESS_LOG', default='-')
+errorlog = '-'
+
+
+def when_ready(server):
+    # Runs in the master after the preloaded app is imported
+    if server.cfg.preload_app:
+        from travel_booking.startup import warm_up
+        warm_up()
+
+
+def pre_fork(server, worker):
+    # A database socket inherited by several processes gets corrupted by the
+    # first one to use or close it; make sure the master holds none.
+    if server.cfg.preload_app:
+        from django.db import connections
+        connections.close_all()
+
+
+def post_worker_init(worker):
+    from travel_booking.startup import start_caches, warm_up
+    if not worker.cfg.preload_app:
+        warm_up()
+    # Loaded per worker, not in the master: a recycled worker would inherit the copy from boot
+    start_caches()
+
+
+def worker_exit(server, worker):
+    # Recycled (max_requests) and stopped workers would otherwise drop the
+    # searches counted since the last flush
+    from travel_booking.popularity import search_tracker
+    search_tracker.close()
@@ -1,14 +1,30 @@
 from django.contrib import admin
-from .models import UserProfile, TravelOption, Booking
+from .models import (
+    UserProfile, TravelOption, Booking, PriceTier, ArchivedTravelOption, ArchivedBooking,
+    BookingEvent, EventCheckpoint, WaitlistEntry, RouteActivity, TrendingRoute,
+)
+from .pricing import build_price_tiers
+from .events import record_booking_event
+from .waitlist import promote_waitlist
 
 # Register your models here.
 
 @admin.register(UserProfile)
 class UserProfileAdmin(admin.ModelAdmin):
-    list_display = ('user', 'phone_number', 'created_at')
+    list_display = ('user', 'phone_number', 'time_zone', 'created_at')
     search_fields = ('user__username', 'user__email', 'phone_number')
     list_filter = ('created_at',)
 
+class PriceTierInline(admin.TabularInline):
+    model = PriceTier
+    fields = ('max_available_seats', 'price')
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
 @admin.register(TravelOption)
 class TravelOptionAdmin(admin.ModelAdmin):
     list_display = ('travel_id', 'travel_type', 'source', 'destination', 
@@ -18,11 +34,26 @@ class TravelOptionAdmin(admin.ModelAdmin):
     date_hierarchy = 'departure_datetime'
     ordering = ('departure_datetime',)
     
+    inlines = [PriceTierInline]
+    
     def is_available(self, obj):
         return obj.is_available
     is_available.boolean = True
     is_available.short_description = 'Available'
 
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        # Tiers are derived from the base price and capacity
+        if change and {'price', 'total_seats'} & set(form.changed_data):
+            build_price_tiers([obj])
+        if change and 'available_seats' in form.changed_data:
+            delta = obj.available_seats - form.initial['available_seats']
+            record_booking_event('seats_changed', obj, seats_delta=delta, source='admin', changed_by=request.user.pk)
+            if delta > 0:
+                # The admin saves in a transaction, and the UPDATE above holds the row lock
+                if promote_waitlist(obj):
+                    obj.save(update_fields=['available_seats', 'updated_at'])
+
 @admin.register(Booking)
 class BookingAdmin(admin.ModelAdmin):
     list_display = ('booking_id', 'user', 'travel_option', 'number_of_seats', 
@@ -35,4 +66,56 @@ class BookingAdmin(admin.ModelAdmin):
     def get_readonly_fields(self, request, obj=None):
         if obj:  # editing an existing object
             return self.readonly_fields + ('user', 'travel_option', 'number_of_seats')
-        return self.readonly_fields
\ No newline at end of file
+        return self.readonly_fields
+
+@admin.register(ArchivedTravelOption)
+class ArchivedTravelOptionAdmin(admin.ModelAdmin):
+    list_display = ('travel_id', 'travel_type', 'source', 'destination',
+                   'departure_datetime', 'operator', 'archived_at')
+    list_filter = ('travel_type',)
+    search_fields = ('source', 'destination', 'operator')
+    date_hierarchy = 'departure_datetime'
+
+@admin.register(ArchivedBooking)
+class ArchivedBookingAdmin(admin.ModelAdmin):
+    list_display = ('booking_id', 'user', 'travel_option', 'number_of_seats',
+                   'total_price', 'status', 'booking_date')
+    list_filter = ('status',)
+    search_fields = ('user__username', 'user__email', 'booking_id')
+
+@admin.register(BookingEvent)
+class BookingEventAdmin(admin.ModelAdmin):
+    list_display = ('event_id', 'event_type', 'travel_id', 'booking_id', 'seats_delta',
+                   'available_seats', 'created_at')
+    list_filter = ('event_type', 'created_at')
+    search_fields = ('travel_id', 'booking_id')
+
+    # The feed is append-only
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+@admin.register(EventCheckpoint)
+class EventCheckpointAdmin(admin.ModelAdmin):
+    list_display = ('consumer', 'last_event_id', 'updated_at')
+
+@admin.register(WaitlistEntry)
+class WaitlistEntryAdmin(admin.ModelAdmin):
+    list_display = ('id', 'travel_option', 'user', 'number_of_seats', 'created_at')
+    search_fields = ('user__username', 'user__email', 'travel_option__travel_id')
+    raw_id_fields = ('travel_option', 'user')
+
+@admin.register(RouteActivity)
+class RouteActivityAdmin(admin.ModelAdmin):
+    list_display = ('bucket', 'source', 'destination', 'searches', 'bookings', 'seats')
+    list_filter = ('bucket',)
+    search_fields = ('source', 'destination')
+
+@admin.register(TrendingRoute)
+class TrendingRouteAdmin(admin.ModelAdmin):
+    list_display = ('rank', 'source', 'destination', 'score', 'searches', 'bookings', 'computed_at')
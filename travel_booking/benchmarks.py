@@ -0,0 +1,316 @@
+"""
+Benchmarks run with `python manage.py benchmark <name>`.
+
+They measure whatever is in the configured database, so seed it first with
+`python manage.py seed_travel_data`. Each benchmark receives the command's
+stdout and options and writes its own report.
+"""
+import random
+import statistics
+import time
+from datetime import timedelta
+
+from django.db.models import Count
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from .models import TravelOption
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    """Register a benchmark function under `name`"""
+    def register(func):
+        BENCHMARKS[name] = func
+        return func
+    return register
+
+
+def time_calls(func, repeat):
+    """Run func() `repeat` times and return the durations in milliseconds"""
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+
+def summarize(samples):
+    ordered = sorted(samples)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    return f'median {statistics.median(ordered):8.2f} ms   p95 {p95:8.2f} ms   min {ordered[0]:8.2f} ms'
+
+
+def busiest_routes(limit=5):
+    """(source, destination) pairs with the most departures"""
+    return list(
+        TravelOption.objects.values_list('source', 'destination')
+        .annotate(n=Count('pk')).order_by('-n')[:limit]
+        .values_list('source', 'destination')
+    )
+
+
+@benchmark('search_pricing')
+def bench_search_pricing(stdout, options):
+    """Home page search query with dynamic pricing off and on"""
+    from .search import search_travel_options
+
+    routes = busiest_routes() or [('', '')]
+    searches = [{'source': s, 'destination': d} for s, d in routes] + [{}]
+
+    def run_searches():
+        for params in searches:
+            queryset = search_travel_options(**params)
+            list(queryset[:10])
+            queryset.count()
+
+    for enabled in (False, True):
+        with override_settings(DYNAMIC_PRICING=enabled):
+            run_searches()  # warm up
+            samples = time_calls(run_searches, options['repeat'])
+        label = 'pricing on ' if enabled else 'pricing off'
+        stdout.write(f'{label}  {len(searches)} searches/iteration  {summarize(samples)}')
+
+
+@benchmark('route_planner')
+def bench_route_planner(stdout, options, size=1_000_000):
+    """Connection search over a synthetic 1M-departure catalogue"""
+    from .routing import RoutePlanner, Leg
+    from .seeding import CITIES
+
+    rng = random.Random(0)
+    cities = [city[0] for city in CITIES]
+    weights = [city[3] for city in CITIES]
+    now = int(time.time())
+    legs = []
+    for travel_id in range(size):
+        source, destination = rng.choices(cities, weights, k=2)
+        if source == destination:
+            continue
+        departure = now + rng.randrange(3600, 90 * 86400, 300)
+        legs.append(Leg(departure, departure + rng.randrange(3600, 20 * 3600, 300), travel_id,
+                        rng.randrange(50000, 900000), rng.randrange(0, 50), source, destination, 'bus', 'Bench'))
+
+    planner = RoutePlanner()
+    started = time.perf_counter()
+    planner.load(legs)
+    stdout.write(f'graph build    {len(planner.legs)} legs in {time.perf_counter() - started:.2f}s')
+
+    searches = [
+        (*rng.sample(cities, 2), timezone.now() + timedelta(days=rng.randrange(1, 60)))
+        for _ in range(options['repeat'])
+    ]
+    for sort in ('arrival', 'price'):
+        samples = []
+        for source, destination, departure_from in searches:
+            started = time.perf_counter()
+            planner.search(source, destination, departure_from, sort=sort, limit=5)
+            samples.append((time.perf_counter() - started) * 1000)
+        stdout.write(f'sort={sort:8} {summarize(samples)}')
+
+
+@benchmark('search_pool')
+def bench_search_pool(stdout, options, size=1_000_000):
+    """Search throughput of the worker pool from 1 to N processes on a synthetic 1M catalogue"""
+    import os
+    from concurrent.futures import ThreadPoolExecutor
+    from .search_pool import CatalogueColumns, SearchWorkerPool
+    from .seeding import CITIES
+
+    rng = random.Random(0)
+    cities = [city[0] for city in CITIES]
+    weights = [city[3] for city in CITIES]
+    types = ['flight', 'train', 'bus']
+    now = int(time.time())
+    rows = []
+    for travel_id in range(size):
+        source, destination = rng.choices(cities, weights, k=2)
+        rows.append((travel_id, source, destination, rng.choice(types), now + rng.randrange(3600, 90 * 86400, 300),
+                     rng.randrange(50000, 900000), rng.randrange(1, 50)))
+    started = time.perf_counter()
+    catalogue = CatalogueColumns.from_rows(rows)
+    del rows
+    stdout.write(f'columns        {len(catalogue)} rows, {len(catalogue.routes)} routes '
+                 f'in {time.perf_counter() - started:.2f}s')
+
+    # Broad searches (one end of the route open) are the expensive ones
+    searches = []
+    for _ in range(max(options['repeat'], 8)):
+        city = rng.choice(cities)
+        searches.append({
+            'source': city if rng.random() < 0.5 else '',
+            'destination': '' if rng.random() < 0.5 else rng.choice(cities),
+            'sort': rng.choice(['departure', 'price']),
+        })
+
+    cores = os.cpu_count() or 1
+    stdout.write(f'cpu cores      {cores}')
+    for processes in sorted({1, 2, 4, 8, cores} & set(range(1, max(cores, 2) + 1))):
+        pool = SearchWorkerPool(processes)
+        try:
+            pool.publish(catalogue)
+            for params in searches[:processes]:
+                pool.search(**params)  # warm up: every worker attaches the columns
+            # Concurrent request threads, as in a threaded app server
+            with ThreadPoolExecutor(max_workers=processes * 2) as clients:
+                started = time.perf_counter()
+                samples = list(clients.map(lambda params: time_calls(lambda: pool.search(**params), 1)[0], searches))
+                elapsed = time.perf_counter() - started
+        finally:
+            pool.close()
+        stdout.write(f'{processes:2} processes   {len(searches) / elapsed:8.1f} searches/s   {summarize(samples)}')
+
+
+@benchmark('snapshot')
+def bench_snapshot(stdout, options, sample_size=20000):
+    """Memory per departure and filter latency of the departure snapshot against the ORM"""
+    import tracemalloc
+    from .search import search_travel_options
+    from .snapshot import DepartureSnapshot
+    from .pricing import with_current_fare
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    snapshot = DepartureSnapshot()
+    snapshot.load()
+    elapsed = time.perf_counter() - started
+    snapshot_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    if not len(snapshot):
+        stdout.write('No upcoming departures; seed the database first.')
+        return
+    stdout.write(f'snapshot load  {len(snapshot)} departures in {elapsed:.2f}s')
+
+    tracemalloc.start()
+    instances = list(with_current_fare(TravelOption.objects.filter(departure_datetime__gt=timezone.now()))
+                     [:sample_size])
+    instance_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    stdout.write(f'memory         snapshot {snapshot_bytes / len(snapshot):7.0f} B/departure   '
+                 f'model instances {instance_bytes / len(instances):7.0f} B/departure')
+    del instances
+
+    routes = busiest_routes()
+    searches = [{}, {'travel_type': 'train'}] + [{'source': s} for s, _ in routes[:2]] + \
+        [{'source': s, 'destination': d} for s, d in routes]
+    for label, run in (
+        ('orm', lambda params: search_travel_options(**params)),
+        ('snapshot', lambda params: snapshot.search(**params)),
+    ):
+        def run_searches():
+            for params in searches:
+                results = run(params)
+                list(results[:10])
+                results.count()
+
+        run_searches()  # warm up
+        samples = time_calls(run_searches, options['repeat'])
+        stdout.write(f'{label:9}  {len(searches)} searches/iteration  {summarize(samples)}')
+
+
+@benchmark('search_sort')
+def bench_search_sort(stdout, options, matching=100_000):
+    """First page of a ~100k-row search under each sort order, ORM against the snapshot"""
+    from .search import SORT_OPTIONS, search_travel_options
+    from .snapshot import DepartureSnapshot
+
+    upcoming = TravelOption.objects.filter(departure_datetime__gt=timezone.now(), available_seats__gt=0)
+    total = upcoming.count()
+    if not total:
+        stdout.write('No upcoming departures; seed the database first.')
+        return
+    # Narrow by the latest departure that still leaves ~`matching` rows
+    cutoff = upcoming.order_by('departure_datetime').values_list('departure_datetime', flat=True)[
+        min(matching, total) - 1]
+    stdout.write(f'matching rows  {upcoming.filter(departure_datetime__lte=cutoff).count()} of {total}')
+
+    snapshot = DepartureSnapshot()
+    snapshot.load()
+    for sort in SORT_OPTIONS:
+        for label, run in (
+            ('orm', lambda: search_travel_options(sort=sort).filter(departure_datetime__lte=cutoff)),
+            ('snapshot', lambda: snapshot.search(end=cutoff + timedelta(seconds=1), sort=sort)),
+        ):
+            def first_page():
+                results = run()
+                list(results[:10])
+                results.count()
+
+            first_page()  # warm up
+            stdout.write(f'sort={sort:10} {label:9} {summarize(time_calls(first_page, options["repeat"]))}')
+
+
+@benchmark('batch_booking')
+def bench_batch_booking(stdout, options, items=20, seats=2):
+    """One batch booking request against the same bookings made by sequential book_travel posts"""
+    import json
+    from django.contrib.auth.models import User
+    from django.db import transaction
+    from django.test import Client
+    from django.urls import reverse
+
+    travel_ids = list(TravelOption.objects.filter(
+        departure_datetime__gt=timezone.now() + timedelta(days=1), available_seats__gte=seats,
+    ).order_by('?').values_list('travel_id', flat=True)[:items])
+    if len(travel_ids) < items:
+        stdout.write('Not enough upcoming departures; seed the database first.')
+        return
+    names = [f'Passenger {chr(65 + i)}' for i in range(seats)]
+    payload = json.dumps({'items': [
+        {'travel_id': travel_id, 'seats': seats, 'passenger_names': names} for travel_id in travel_ids
+    ]})
+
+    def sequential(client):
+        for travel_id in travel_ids:
+            response = client.post(reverse('book_travel', args=[travel_id]), {
+                'number_of_seats': seats, 'passenger_names': '\n'.join(names), 'terms': 'on',
+            })
+            assert response.status_code == 302, response.status_code
+
+    def batch(client):
+        response = client.post(reverse('book_batch'), payload, content_type='application/json')
+        assert response.status_code == 201, response.content
+
+    with override_settings(ALLOWED_HOSTS=['testserver']):
+        for label, run in (('sequential', sequential), ('batch', batch)):
+            samples = []
+            for _ in range(options['repeat']):
+                # Every iteration is rolled back so the dataset stays unchanged
+                with transaction.atomic():
+                    user = User.objects.create_user(username='bench-batch-booking')
+                    client = Client()
+                    client.force_login(user)
+                    samples.extend(time_calls(lambda: run(client), 1))
+                    transaction.set_rollback(True)
+            stdout.write(f'{label:10} {items} departures x {seats} seats  {summarize(samples)}')
+
+
+@benchmark('date_search')
+def bench_date_search(stdout, options, days_ahead=14):
+    """Departure-date search: per-row __date conversion against the local-day UTC range"""
+    from .query_plans import explain_queryset
+    from .search import local_day_range
+
+    day = timezone.localdate() + timedelta(days=days_ahead)
+    start, end = local_day_range(day.isoformat())
+    upcoming = TravelOption.objects.filter(departure_datetime__gt=timezone.now(), available_seats__gt=0)
+    variants = [
+        ('__date', upcoming.filter(departure_datetime__date=day)),
+        ('range', upcoming.filter(departure_datetime__gte=start, departure_datetime__lt=end)),
+    ]
+    stdout.write(f'{day} in {timezone.get_current_timezone_name()}: [{start:%Y-%m-%d %H:%M}, {end:%Y-%m-%d %H:%M}) UTC, '
+                 f'{variants[1][1].count()} departures')
+    for label, queryset in variants:
+        page = queryset.order_by('departure_datetime')[:10]
+        plan = explain_queryset(page)
+        stdout.write(f'{label:7} plan')
+        for line in plan.raw.splitlines():
+            stdout.write(f'          {line}')
+
+        def first_page():
+            list(page)
+            queryset.count()
+
+        stdout.write(f'{label:7} {summarize(time_calls(first_page, options["repeat"]))}')
@@ -0,0 +1,31 @@
+from django.core.cache import cache
+from django.db import transaction
+
+# Rendered travel_detail pages are only cached for anonymous users, whose
+# page differs by nothing but the departure itself.
+TRAVEL_DETAIL_CACHE_TIMEOUT = 300  # 5 minutes
+
+# Cache-Control max-age handed to anonymous clients and shared caches.
+TRAVEL_DETAIL_PUBLIC_MAX_AGE = 60
+
+
+def travel_detail_cache_key(travel_id):
+    return f'travel_detail:{travel_id}'
+
+
+def get_cached_travel_detail(travel_id, etag):
+    """Return the cached page content if it was rendered for this etag"""
+    cached = cache.get(travel_detail_cache_key(travel_id))
+    if cached and cached[0] == etag:
+        return cached[1]
+    return None
+
+
+def set_cached_travel_detail(travel_id, etag, content):
+    cache.set(travel_detail_cache_key(travel_id), (etag, content), TRAVEL_DETAIL_CACHE_TIMEOUT)
+
+
+def invalidate_travel_detail(*travel_ids):
+    """Drop cached detail pages once the surrounding transaction commits"""
+    keys = [travel_detail_cache_key(travel_id) for travel_id in travel_ids]
+    transaction.on_commit(lambda: cache.delete_many(keys))
@@ -0,0 +1,217 @@
+"""
+Booking change feed.
+
+Every booking, cancellation and manual seat change appends a BookingEvent
+in the same transaction, so the feed never disagrees with the tables.
+Consumers read events in id order and keep their position in an
+EventCheckpoint row, which lets caches and replicas apply changes instead of
+rescanning Booking and TravelOption.
+
+Ids are allocated at insert but become visible at commit, so a slow
+transaction can commit an id below one a reader has already passed. Most
+gaps never fill, though: rolled-back transactions, MySQL's
+auto_increment_increment and TiDB's per-server id caches all leave ids
+unused for good. Readers therefore do not wait at a gap. They deliver what
+has committed, remember the missing ids, and deliver any that commit
+later. A gap is forgotten once it has been open for GAP_TIMEOUT, so that
+must exceed the longest a transaction can stay open after recording an
+event. Nothing in the application enforces that: gunicorn's gthread
+workers do not time out individual requests, so it relies on requests and
+batch commands (which commit per chunk) finishing well within it. The gaps
+are saved with the checkpoint.
+
+An event can thus arrive after one with a higher id, but never after a
+later event for the same travel option: each is recorded under that
+option's row lock, so their ids and commits come in the same order.
+"""
+import time
+from bisect import bisect_right
+from datetime import timedelta
+
+from .models import BookingEvent, EventCheckpoint
+
+GAP_TIMEOUT = timedelta(minutes=10)
+
+
+def build_booking_event(event_type, travel_option, booking=None, seats_delta=0, **payload):
+    """Unsaved event for a change to travel_option (and booking), for bulk_create"""
+    return BookingEvent(
+        event_type=event_type,
+        travel_id=travel_option.pk,
+        booking_id=booking.pk if booking else None,
+        user_id=booking.user_id if booking else None,
+        seats_delta=seats_delta,
+        available_seats=travel_option.available_seats,
+        payload=payload,
+    )
+
+
+def record_booking_event(event_type, travel_option, booking=None, seats_delta=0, **payload):
+    """Append an event for a change to travel_option (and booking); call inside the change's transaction"""
+    event = build_booking_event(event_type, travel_option, booking, seats_delta, **payload)
+    event.save()
+    return event
+
+
+def _gap_index(gaps, event_id):
+    """Position of the [first, last, seen] range in sorted gaps that holds event_id, or None"""
+    position = bisect_right(gaps, event_id, key=lambda gap: gap[0]) - 1
+    return position if position >= 0 and gaps[position][1] >= event_id else None
+
+
+def _fill(gaps, event_id):
+    """Remove event_id from the gap holding it"""
+    position = _gap_index(gaps, event_id)
+    if position is None:
+        return
+    first, last, seen = gaps.pop(position)
+    gaps[position:position] = [gap for gap in ([first, event_id - 1, seen], [event_id + 1, last, seen])
+                               if gap[0] <= gap[1]]
+
+
+class EventReader:
+    """Reads the feed past id gaps and delivers events that commit into them later
+
+    state_after() gives the (after, gaps) to save once the caller has
+    applied an event, so a later reader neither repeats nor misses events.
+    """
+
+    def __init__(self, after=0, gaps=(), batch_size=500, gap_timeout=GAP_TIMEOUT):
+        self.after = after
+        self.gaps = sorted([list(gap) for gap in gaps])
+        self.batch_size = batch_size
+        self.gap_timeout = gap_timeout.total_seconds()
+        self.saved = (after, [list(gap) for gap in self.gaps])
+        self.log = []  # (event_id, gap it opened or None) delivered since self.saved
+        self.new = 0  # events past `after` in the last fetch
+
+    def fetch(self):
+        """Events that committed into known gaps, then up to batch_size new ones in id order"""
+        now = time.time()
+        self.gaps = [gap for gap in self.gaps if now - gap[2] < self.gap_timeout]
+        late = []
+        if self.gaps:
+            committed = BookingEvent.objects.filter(
+                event_id__gte=self.gaps[0][0], event_id__lte=self.gaps[-1][1]
+            ).values_list('event_id', flat=True)
+            filled = [event_id for event_id in committed if _gap_index(self.gaps, event_id) is not None]
+            if filled:
+                late = list(BookingEvent.objects.filter(event_id__in=filled).order_by('event_id'))
+                for event in late:
+                    _fill(self.gaps, event.event_id)
+                    self.log.append((event.event_id, None))
+
+        events = list(BookingEvent.objects.filter(event_id__gt=self.after).order_by('event_id')[:self.batch_size])
+        for event in events:
+            gap = None
+            if event.event_id > self.after + 1:
+                gap = [self.after + 1, event.event_id - 1, now]
+                self.gaps.append(gap)
+            self.log.append((event.event_id, gap))
+            self.after = event.event_id
+        self.new = len(events)
+        return late + events
+
+    def state_after(self, event_id):
+        """(after, gaps) once everything delivered up to event_id is applied, or None if it is not pending"""
+        ids = [logged for logged, _ in self.log]
+        if event_id not in ids:
+            return None
+        position = ids.index(event_id) + 1
+        after, gaps = self.saved
+        gaps = [list(gap) for gap in gaps]
+        for logged, gap in self.log[:position]:
+            if logged > after:
+                after = logged
+                if gap is not None:
+                    gaps.append(list(gap))
+            else:
+                _fill(gaps, logged)  # committed late into a gap
+        now = time.time()
+        gaps = [gap for gap in gaps if now - gap[2] < self.gap_timeout]
+        self.saved = (after, gaps)
+        del self.log[:position]
+        return after, [list(gap) for gap in gaps]
+
+    def events(self):
+        """Everything committed so far, fetched in batches"""
+        while True:
+            batch = self.fetch()
+            yield from batch
+            if self.new < self.batch_size:
+                return
+
+    def follow(self, poll_interval=1.0, stop=None):
+        """Yield events forever, polling when caught up"""
+        while stop is None or not stop():
+            yield from self.fetch()
+            if self.new < self.batch_size:
+                time.sleep(poll_interval)
+
+
+def iter_booking_events(after=0, batch_size=500, gap_timeout=GAP_TIMEOUT):
+    """Committed events with event_id > after, in id order, fetched in batches"""
+    return EventReader(after, (), batch_size, gap_timeout).events()
+
+
+class BookingEventConsumer:
+    """Checkpointed reader of the booking event feed for one named consumer
+
+        consumer = BookingEventConsumer('search-snapshot')
+        for event in consumer.events():
+            apply(event)
+            consumer.checkpoint(event.event_id)
+    """
+
+    def __init__(self, name, batch_size=500, gap_timeout=GAP_TIMEOUT):
+        self.name = name
+        self.batch_size = batch_size
+        self.gap_timeout = gap_timeout
+        self.reader = None
+
+    @property
+    def position(self):
+        """Id of the last event this consumer checkpointed"""
+        return EventCheckpoint.objects.filter(consumer=self.name).values_list(
+            'last_event_id', flat=True).first() or 0
+
+    def _reader(self):
+        after, gaps = EventCheckpoint.objects.filter(consumer=self.name).values_list(
+            'last_event_id', 'gaps').first() or (0, [])
+        self.reader = EventReader(after, gaps, self.batch_size, self.gap_timeout)
+        return self.reader
+
+    def checkpoint(self, event_id):
+        """Save the position after event_id, which the caller has applied along with everything before it"""
+        state = self.reader.state_after(event_id) if self.reader else None
+        if state is None:
+            if self.reader and event_id <= self.reader.saved[0]:
+                return  # already saved
+            state = (event_id, [])
+        after, gaps = state
+        EventCheckpoint.objects.update_or_create(consumer=self.name,
+                                                 defaults={'last_event_id': after, 'gaps': gaps})
+
+    def reset(self, event_id=0):
+        """Move the checkpoint, e.g. to 0 to replay the feed"""
+        self.reader = None
+        self.checkpoint(event_id)
+
+    def events(self):
+        """Events after the checkpoint; the caller checkpoints what it has applied"""
+        return self._reader().events()
+
+    def follow(self, poll_interval=1.0, stop=None):
+        """Yield events forever, checkpointing each batch once the caller asks for the next one
+
+        Delivery is at least once: an event is checkpointed only after the
+        consumer came back for more, so a crash replays the unfinished batch.
+        """
+        reader = self._reader()
+        while stop is None or not stop():
+            batch = reader.fetch()
+            yield from batch
+            if batch:
+                self.checkpoint(batch[-1].event_id)
+            if reader.new < self.batch_size:
+                time.sleep(poll_interval)
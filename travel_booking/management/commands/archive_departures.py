@@ -0,0 +1,91 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from travel_booking.models import TravelOption, Booking, ArchivedTravelOption, ArchivedBooking
+
+TRAVEL_OPTION_FIELDS = [
+    'travel_id', 'travel_type', 'source', 'destination', 'departure_datetime',
+    'arrival_datetime', 'price', 'available_seats', 'total_seats', 'operator',
+    'created_at', 'updated_at',
+]
+
+BOOKING_FIELDS = [
+    'booking_id', 'user_id', 'travel_option_id', 'number_of_seats', 'total_price',
+    'booking_date', 'status', 'passenger_details', 'created_at', 'updated_at',
+]
+
+
+class Command(BaseCommand):
+    help = 'Move departed travel options and their bookings into the archive tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=30,
+                            help='Archive departures older than this many days (default: 30)')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Travel options moved per transaction (default: 1000)')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only report what would be archived')
+
+    def handle(self, *args, **options):
+        if options['days'] < 0:
+            raise CommandError('--days cannot be negative.')
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1.')
+
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        expired = TravelOption.objects.filter(departure_datetime__lt=cutoff)
+        options_before = TravelOption.objects.count()
+        bookings_before = Booking.objects.count()
+
+        if options['dry_run']:
+            self.stdout.write(
+                f'Would archive {expired.count()} travel options and '
+                f'{Booking.objects.filter(travel_option__in=expired).count()} bookings '
+                f'departed before {cutoff:%Y-%m-%d %H:%M}.'
+            )
+            return
+
+        moved_options = moved_bookings = 0
+        while True:
+            option_count, booking_count = self.archive_batch(expired, options['batch_size'])
+            if not option_count:
+                break
+            moved_options += option_count
+            moved_bookings += booking_count
+            self.stdout.write(f'Archived {moved_options} travel options, {moved_bookings} bookings...')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Archived {moved_options} travel options and {moved_bookings} bookings '
+            f'departed before {cutoff:%Y-%m-%d %H:%M}.'
+        ))
+        self.report('travel options', options_before, TravelOption.objects.count())
+        self.report('bookings', bookings_before, Booking.objects.count())
+
+    def archive_batch(self, expired, batch_size):
+        """Copy one batch into the archive tables and delete it from the hot tables"""
+        with transaction.atomic():
+            travel_ids = list(
+                expired.order_by('travel_id').values_list('travel_id', flat=True)[:batch_size]
+            )
+            if not travel_ids:
+                return 0, 0
+
+            ArchivedTravelOption.objects.bulk_create([
+                ArchivedTravelOption(**row)
+                for row in TravelOption.objects.filter(travel_id__in=travel_ids).values(*TRAVEL_OPTION_FIELDS)
+            ])
+            bookings = Booking.objects.filter(travel_option_id__in=travel_ids)
+            ArchivedBooking.objects.bulk_create([
+                ArchivedBooking(**row) for row in bookings.values(*BOOKING_FIELDS)
+            ])
+
+            booking_count = bookings.delete()[1].get(Booking._meta.label, 0)
+            TravelOption.objects.filter(travel_id__in=travel_ids).delete()
+        return len(travel_ids), booking_count
+
+    def report(self, label, before, after):
+        reduction = (before - after) / before * 100 if before else 0
+        self.stdout.write(f'Hot {label}: {before} -> {after} rows ({reduction:.1f}% smaller)')
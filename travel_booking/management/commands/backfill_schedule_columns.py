@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from travel_booking.models import TravelOption
+
+
+class Command(BaseCommand):
+    help = 'Fill in duration_minutes and departure_minute for travel options saved before those columns existed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000,
+                            help='Travel options per transaction (default: 2000)')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        if chunk_size < 1:
+            raise CommandError('--chunk-size must be at least 1.')
+        fields = ['duration_minutes', 'departure_minute']
+        checked = updated = 0
+        last_id = 0
+        while True:
+            # Keyset pagination on the primary key, so each chunk is an index range
+            chunk = list(
+                TravelOption.objects.filter(travel_id__gt=last_id).order_by('travel_id')
+                .only('travel_id', 'departure_datetime', 'arrival_datetime', *fields)[:chunk_size]
+            )
+            if not chunk:
+                break
+            last_id = chunk[-1].travel_id
+            changed = []
+            for option in chunk:
+                stored = (option.duration_minutes, option.departure_minute)
+                option.set_schedule_columns()
+                if (option.duration_minutes, option.departure_minute) != stored:
+                    changed.append(option)
+            if changed:
+                # Derived columns only: caches read the schedule itself, so updated_at is left alone
+                with transaction.atomic():
+                    TravelOption.objects.bulk_update(changed, fields)
+            checked += len(chunk)
+            updated += len(changed)
+        self.stdout.write(self.style.SUCCESS(f'Checked {checked} travel options, updated {updated}.'))
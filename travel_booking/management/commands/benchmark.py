@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from travel_booking.benchmarks import BENCHMARKS
+
+
+class Command(BaseCommand):
+    help = 'Run performance benchmarks against the configured database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*',
+                            help='Benchmarks to run (default: list available benchmarks)')
+        parser.add_argument('--repeat', type=int, default=20,
+                            help='Timed iterations per measurement (default: 20)')
+
+    def handle(self, *args, **options):
+        if not options['names']:
+            for name, func in sorted(BENCHMARKS.items()):
+                self.stdout.write(f'{name:20} {func.__doc__}')
+            return
+        unknown = [name for name in options['names'] if name not in BENCHMARKS]
+        if unknown:
+            raise CommandError(f"Unknown benchmark(s): {', '.join(unknown)}")
+        if options['repeat'] < 1:
+            raise CommandError('--repeat must be at least 1.')
+
+        for name in options['names']:
+            self.stdout.write(self.style.MIGRATE_HEADING(f'{name}: {BENCHMARKS[name].__doc__}'))
+            BENCHMARKS[name](self.stdout, options)
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from travel_booking.models import TravelOption
+from travel_booking.pricing import rebuild_price_tiers
+
+
+class Command(BaseCommand):
+    help = 'Precompute load-based price tiers for travel options'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='Include departures that have already left')
+        parser.add_argument('--chunk-size', type=int, default=2000,
+                            help='Travel options per transaction (default: 2000)')
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be at least 1.')
+        queryset = TravelOption.objects.all()
+        if not options['all']:
+            queryset = queryset.filter(departure_datetime__gt=timezone.now())
+        count = rebuild_price_tiers(queryset, chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f'Built price tiers for {count} travel options.'))
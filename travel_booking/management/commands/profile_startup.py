@@ -0,0 +1,69 @@
+import json
+import os
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+CHILD = 'import sys; from travel_booking.startup import time_first_request; time_first_request(sys.argv[1], sys.argv[2] == "warm")'
+
+
+def parse_importtime(stderr):
+    """{module: (self_us, cumulative_us)} from python -X importtime output"""
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        modules[name.strip()] = (int(self_us), int(cumulative_us))
+    return modules
+
+
+class Command(BaseCommand):
+    help = 'Measure cold start: import time per module and the time until the first request is served'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default='/',
+                            help='Request path for the first request (default: /)')
+        parser.add_argument('--top', type=int, default=20,
+                            help='Modules listed by import time (default: 20)')
+        parser.add_argument('--sort', choices=['cumulative', 'self'], default='cumulative',
+                            help='Rank modules by cumulative or own import time (default: cumulative)')
+        parser.add_argument('--warm', action='store_true',
+                            help='Run the pre-fork warm-up before the first request, as gunicorn does')
+        parser.add_argument('--budget', type=float,
+                            help='Fail if the first response takes longer than this many milliseconds')
+
+    def handle(self, *args, **options):
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=settings.SETTINGS_MODULE)
+        started = time.time()
+        child = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', CHILD, options['path'], 'warm' if options['warm'] else ''],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+        )
+        if child.returncode:
+            raise CommandError(f'Start-up run failed:\n{child.stderr[-2000:]}')
+        timings = json.loads(child.stdout)
+        modules = parse_importtime(child.stderr)
+
+        column = 1 if options['sort'] == 'cumulative' else 0
+        self.stdout.write(self.style.MIGRATE_HEADING(f'Slowest imports ({options["sort"]}, ms)'))
+        for name, times in sorted(modules.items(), key=lambda item: -item[1][column])[:options['top']]:
+            self.stdout.write(f'  {times[column] / 1000:8.1f}  {name}')
+        for package in ('django', 'travel_booking', 'travel_project'):
+            own = sum(self_us for name, (self_us, _) in modules.items()
+                      if name == package or name.startswith(package + '.'))
+            self.stdout.write(f'  {own / 1000:8.1f}  {package}.* (own time, all modules)')
+
+        self.stdout.write(self.style.MIGRATE_HEADING(f'Cold start for {options["path"]} ({timings["status"]})'))
+        for label, key in [('Settings', 'settings'), ('django.setup() + WSGI handler', 'setup'),
+                           ('Warm-up', 'warm_up'), ('First request', 'first_request'),
+                           ('Second request', 'second_request')]:
+            self.stdout.write(f'  {label:32}{timings[key] * 1000:8.1f} ms')
+        first_response = (timings['first_served_at'] - started) * 1000
+        self.stdout.write(f'  {"Process start to first response":32}{first_response:8.1f} ms')
+
+        if options['budget'] is not None and first_response > options['budget']:
+            raise CommandError(f'First response after {first_response:.0f} ms, over the {options["budget"]:.0f} ms budget.')
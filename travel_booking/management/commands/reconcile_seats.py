@@ -0,0 +1,83 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Case, F, Max, Min, Q, Sum, Value, When
+from django.db.models.functions import Coalesce
+
+from travel_booking.events import record_booking_event
+from travel_booking.models import TravelOption
+from travel_booking.waitlist import promote_waitlist
+
+
+def seat_drift(queryset):
+    """(travel_id, available_seats, expected) for rows whose available_seats disagrees with their bookings
+
+    One grouped aggregate: total_seats minus confirmed booked seats per
+    departure, with the comparison in HAVING so only drifted rows come back.
+    """
+    return queryset.order_by().annotate(
+        booked=Coalesce(Sum('bookings__number_of_seats', filter=Q(bookings__status='confirmed')), Value(0)),
+    ).annotate(
+        # Overbooked departures have no seats left; never subtract below zero
+        # (total_seats is unsigned on MySQL)
+        expected=Case(When(booked__gte=F('total_seats'), then=Value(0)), default=F('total_seats') - F('booked')),
+    ).exclude(available_seats=F('expected')).values_list('travel_id', 'available_seats', 'expected')
+
+
+class Command(BaseCommand):
+    help = 'Check available_seats against total_seats minus confirmed bookings, and optionally repair drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=10000,
+                            help='Travel id range checked per query (default: 10000)')
+        parser.add_argument('--repair', action='store_true',
+                            help='Set drifted available_seats to the booked count and record seat-change events')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        if chunk_size < 1:
+            raise CommandError('--chunk-size must be at least 1.')
+
+        bounds = TravelOption.objects.aggregate(low=Min('travel_id'), high=Max('travel_id'))
+        if bounds['low'] is None:
+            self.stdout.write('No travel options to check.')
+            return
+
+        drifted = repaired = 0
+        for low in range(bounds['low'], bounds['high'] + 1, chunk_size):
+            chunk = TravelOption.objects.filter(travel_id__gte=low, travel_id__lt=low + chunk_size)
+            rows = list(seat_drift(chunk))
+            for travel_id, available, expected in rows:
+                self.stdout.write(f'#{travel_id}: available_seats {available}, bookings leave {expected}')
+            drifted += len(rows)
+            if options['repair'] and rows:
+                repaired += self.repair([travel_id for travel_id, _, _ in rows])
+
+        if not drifted:
+            self.stdout.write(self.style.SUCCESS('All seat counts match their bookings.'))
+        elif options['repair']:
+            self.stdout.write(self.style.SUCCESS(f'Repaired {repaired} of {drifted} drifted travel options.'))
+        else:
+            self.stdout.write(self.style.WARNING(
+                f'{drifted} travel options drifted. Run with --repair to fix them.'
+            ))
+
+    def repair(self, travel_ids):
+        """Fix the given departures under their row locks; returns how many changed"""
+        repaired = 0
+        with transaction.atomic():
+            options = {
+                option.travel_id: option
+                for option in TravelOption.objects.select_for_update().filter(travel_id__in=travel_ids)
+                .order_by('travel_id')
+            }
+            # Recheck under the locks: bookings may have moved since the scan
+            for travel_id, available, expected in seat_drift(TravelOption.objects.filter(travel_id__in=options)):
+                option = options[travel_id]
+                option.available_seats = expected
+                record_booking_event('seats_changed', option, seats_delta=expected - available,
+                                     source='reconcile_seats')
+                if expected > available:
+                    promote_waitlist(option)
+                option.save(update_fields=['available_seats', 'updated_at'])
+                repaired += 1
+        return repaired
@@ -0,0 +1,38 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+
+from travel_booking.popularity import (
+    WINDOW, HALF_LIFE, TRENDING_SIZE, RETENTION,
+    roll_up_booking_events, refresh_popularity, prune_route_activity,
+)
+
+
+class Command(BaseCommand):
+    help = 'Roll new bookings into the route activity buckets and recompute trending routes and city popularity'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--window-days', type=float, default=WINDOW.days,
+                            help='Activity considered for trending (default: %(default)s days)')
+        parser.add_argument('--half-life-hours', type=float, default=HALF_LIFE.total_seconds() / 3600,
+                            help='Age at which activity counts half (default: %(default)s hours)')
+        parser.add_argument('--size', type=int, default=TRENDING_SIZE,
+                            help='Number of trending routes to keep (default: %(default)s)')
+        parser.add_argument('--retention-days', type=float, default=RETENTION.days,
+                            help='Delete activity buckets older than this (default: %(default)s days)')
+
+    def handle(self, *args, **options):
+        if options['half_life_hours'] <= 0:
+            raise CommandError('--half-life-hours must be positive.')
+        if options['size'] < 1:
+            raise CommandError('--size must be at least 1.')
+        events = roll_up_booking_events()
+        pruned = prune_route_activity(retention=timedelta(days=options['retention_days']))
+        trending = refresh_popularity(
+            window=timedelta(days=options['window_days']),
+            half_life=timedelta(hours=options['half_life_hours']),
+            size=options['size'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Rolled up {events} booking events, pruned {pruned} buckets, {trending} trending routes.'
+        ))
@@ -0,0 +1,83 @@
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from travel_booking.traffic import Replayer, percentile, read_trace, skip_reason
+
+
+class Command(BaseCommand):
+    help = 'Replay a captured traffic trace against a running server and report latency per URL name'
+
+    def add_arguments(self, parser):
+        parser.add_argument('trace', help='JSONL file written by TrafficCaptureMiddleware')
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000',
+                            help='Server to replay against (default: http://127.0.0.1:8000)')
+        parser.add_argument('--speed', type=float, default=1.0,
+                            help='Replay speed as a multiple of the recorded pace; 0 sends as fast as possible '
+                                 '(default: 1)')
+        parser.add_argument('--workers', type=int, default=8,
+                            help='Concurrent connections (default: 8)')
+        parser.add_argument('--limit', type=int,
+                            help='Replay only the first N replayable requests')
+        parser.add_argument('--session-cookie', default='',
+                            help='Cookie header (e.g. "sessionid=...") to replay signed-in requests with; '
+                                 'without it they are skipped')
+        parser.add_argument('--allow-writes', action='store_true',
+                            help='Also replay booking, waitlist and cancellation POSTs. They make real bookings: '
+                                 'only use this against a server on a disposable copy of the database')
+        parser.add_argument('--replay-token', default=getattr(settings, 'TRAFFIC_REPLAY_TOKEN', ''),
+                            help="The server's TRAFFIC_REPLAY_TOKEN, so it leaves the replay out of its own "
+                                 'trace (default: this project\'s setting)')
+
+    def handle(self, *args, **options):
+        if options['speed'] < 0:
+            raise CommandError('--speed cannot be negative.')
+        if options['workers'] < 1:
+            raise CommandError('--workers must be at least 1.')
+        try:
+            entries = read_trace(options['trace'])
+        except (OSError, ValueError) as exc:
+            raise CommandError(f'Cannot read trace: {exc}')
+
+        with_session = bool(options['session_cookie'])
+        reasons = [skip_reason(entry, with_session, options['allow_writes']) for entry in entries]
+        selected = [entry for entry, reason in zip(entries, reasons) if reason is None]
+        skipped = Counter(reason for reason in reasons if reason is not None)
+        if options['limit'] is not None:
+            selected = selected[:options['limit']]
+        if not selected:
+            raise CommandError('The trace has no requests that can be replayed.')
+
+        recorded = selected[-1]['ts'] - selected[0]['ts']
+        pace = f'{options["speed"]:g}x' if options['speed'] else 'full speed'
+        self.stdout.write(f'Replaying {len(selected)} requests recorded over {recorded:.1f}s at {pace} '
+                          f'with {options["workers"]} workers against {options["base_url"]}')
+        if options['allow_writes']:
+            self.stdout.write(self.style.WARNING('Writes allowed: replayed POSTs book and cancel for real on '
+                                                 f'{options["base_url"]}'))
+        if skipped:
+            self.stdout.write('Skipped: ' + ', '.join(f'{count} {reason}' for reason, count in sorted(skipped.items())))
+
+        replayer = Replayer(options['base_url'], workers=options['workers'], speed=options['speed'],
+                            cookie=options['session_cookie'], replay_token=options['replay_token'])
+        started = time.perf_counter()
+        results = replayer.run(selected)
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f'{"URL name":24}{"requests":>9}{"errors":>8}{"p50 ms":>10}{"p90 ms":>10}{"p99 ms":>10}{"max ms":>10}'
+        ))
+        everything = []
+        for name, samples in sorted(results.items(), key=lambda item: -len(item[1])):
+            self.stdout.write(self._row(name, samples))
+            everything.extend(samples)
+        self.stdout.write(self._row('all', everything))
+        self.stdout.write(f'{len(everything)} requests in {elapsed:.1f}s ({len(everything) / elapsed:.1f} req/s)')
+
+    def _row(self, name, samples):
+        latencies = sorted(latency for _, latency in samples)
+        errors = sum(1 for status, _ in samples if status is None or status >= 500)
+        return (f'{name:24}{len(samples):9}{errors:8}{percentile(latencies, 0.5):10.1f}'
+                f'{percentile(latencies, 0.9):10.1f}{percentile(latencies, 0.99):10.1f}{latencies[-1]:10.1f}')
@@ -0,0 +1,56 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from travel_booking.seeding import TravelDataGenerator
+
+
+class Command(BaseCommand):
+    help = 'Generate a large, realistic synthetic dataset of travel options, users and bookings'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--travel-options', type=int, default=10000,
+                            help='Number of travel options to create (default: 10000)')
+        parser.add_argument('--users', type=int, default=1000,
+                            help='Number of users to create (default: 1000)')
+        parser.add_argument('--bookings', type=int, default=20000,
+                            help='Number of bookings to create (default: 20000)')
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Random seed; the same seed always produces the same data')
+        parser.add_argument('--horizon-days', type=int, default=90,
+                            help='Spread departures over this many days from now (default: 90)')
+        parser.add_argument('--chunk-size', type=int, default=10000,
+                            help='Rows per bulk insert (default: 10000)')
+        parser.add_argument('--password', default='travel12345',
+                            help='Password shared by all generated users (hashed once)')
+
+    def handle(self, *args, **options):
+        if min(options['travel_options'], options['users'], options['bookings']) < 0:
+            raise CommandError('Row counts cannot be negative.')
+        if options['chunk_size'] < 1 or options['horizon_days'] < 1:
+            raise CommandError('--chunk-size and --horizon-days must be at least 1.')
+
+        generator = TravelDataGenerator(
+            seed=options['seed'],
+            horizon_days=options['horizon_days'],
+            password=options['password'],
+            chunk_size=options['chunk_size'],
+            log=(lambda message: self.stdout.write(message)) if options['verbosity'] > 1 else None,
+        )
+        try:
+            stats = generator.generate(
+                travel_options=options['travel_options'],
+                users=options['users'],
+                bookings=options['bookings'],
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        total_rows = total_seconds = 0
+        for label, (rows, seconds) in stats.items():
+            total_rows += rows
+            total_seconds += seconds
+            rate = rows / seconds if seconds else 0
+            self.stdout.write(f'{label}: {rows} rows in {seconds:.2f}s ({rate:,.0f} rows/sec)')
+        rate = total_rows / total_seconds if total_seconds else 0
+        self.stdout.write(self.style.SUCCESS(
+            f'Seeded {total_rows} rows in {total_seconds:.2f}s ({rate:,.0f} rows/sec)'
+        ))
@@ -0,0 +1,72 @@
+import itertools
+import json
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+
+from travel_booking.events import GAP_TIMEOUT, BookingEventConsumer, EventReader
+
+
+class Command(BaseCommand):
+    help = 'Print booking events as JSON lines, optionally following the feed under a named checkpoint'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--consumer',
+                            help='Resume from and save progress under this checkpoint name')
+        parser.add_argument('--after', type=int,
+                            help='Start after this event id (default: the checkpoint, or the beginning)')
+        parser.add_argument('--follow', action='store_true',
+                            help='Keep polling for new events')
+        parser.add_argument('--limit', type=int,
+                            help='Stop after this many events')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Events fetched per query (default: 500)')
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Seconds between polls when following (default: 1)')
+        parser.add_argument('--gap-timeout', type=float, default=GAP_TIMEOUT.total_seconds(),
+                            help='Seconds to keep delivering a missing event id if it commits late '
+                                 '(default: %(default)s)')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1.')
+        if options['follow'] and not options['consumer'] and options['limit'] is None:
+            self.stderr.write('Following without --consumer: progress is not saved.')
+
+        gap_timeout = timedelta(seconds=options['gap_timeout'])
+        consumer = None
+        if options['consumer']:
+            consumer = BookingEventConsumer(options['consumer'], options['batch_size'], gap_timeout)
+            if options['after'] is not None:
+                consumer.reset(options['after'])
+
+        if consumer is not None:
+            events = consumer.follow(options['poll_interval']) if options['follow'] else consumer.events()
+        else:
+            reader = EventReader(options['after'] or 0, (), options['batch_size'], gap_timeout)
+            events = reader.follow(options['poll_interval']) if options['follow'] else reader.events()
+
+        last = None
+        try:
+            for event in itertools.islice(events, options['limit']):
+                self.stdout.write(json.dumps(self.serialize(event)))
+                last = event.event_id
+        except KeyboardInterrupt:
+            pass
+        if consumer is not None and last is not None:
+            consumer.checkpoint(last)
+
+    @staticmethod
+    def serialize(event):
+        return {
+            'event_id': event.event_id,
+            'event_type': event.event_type,
+            'travel_id': event.travel_id,
+            'booking_id': event.booking_id,
+            'user_id': event.user_id,
+            'seats_delta': event.seats_delta,
+            'available_seats': event.available_seats,
+            'payload': event.payload,
+            'created_at': event.created_at.isoformat(),
+        }
+
@@ -1,8 +1,12 @@
+from datetime import timezone as dt_timezone
+
 from django.db import models
 from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator
 from django.utils import timezone
 
+from .timezones import validate_time_zone
+
 # Create your models here.
 
 class UserProfile(models.Model):
@@ -10,6 +14,8 @@ class UserProfile(models.Model):
     phone_number = models.CharField(max_length=15, blank=True, null=True)
     address = models.TextField(blank=True, null=True)
     date_of_birth = models.DateField(blank=True, null=True)
+    # IANA name such as 'Europe/London'; blank uses the site TIME_ZONE
+    time_zone = models.CharField(max_length=64, blank=True, default='', validators=[validate_time_zone])
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -29,6 +35,11 @@ class TravelOption(models.Model):
     destination = models.CharField(max_length=100)
     departure_datetime = models.DateTimeField()
     arrival_datetime = models.DateTimeField()
+    # Stored so searches can sort by duration with an index; kept in sync by save()
+    duration_minutes = models.PositiveIntegerField(default=0, editable=False)
+    # Minute of the day the departure falls on in UTC, so time-of-day windows
+    # compare a column instead of converting every row; kept in sync by save()
+    departure_minute = models.PositiveSmallIntegerField(default=0, editable=False)
     price = models.DecimalField(max_digits=10, decimal_places=2, validators=[MinValueValidator(0)])
     available_seats = models.PositiveIntegerField(validators=[MinValueValidator(1)])
     total_seats = models.PositiveIntegerField(validators=[MinValueValidator(1)])
@@ -38,10 +49,53 @@ class TravelOption(models.Model):
 
     class Meta:
         ordering = ['departure_datetime']
+        indexes = [
+            # Lets searches walk departures in order and stop at the page
+            # limit, so per-row fare subqueries only run for the rows shown.
+            models.Index(fields=['departure_datetime', 'available_seats'], name='travel_departure_idx'),
+            # Same for the duration sort and for price sorts/ranges on the base price
+            models.Index(fields=['duration_minutes', 'departure_datetime'], name='travel_duration_idx'),
+            models.Index(fields=['price', 'departure_datetime'], name='travel_price_idx'),
+            models.Index(fields=['departure_minute', 'departure_datetime'], name='travel_minute_idx'),
+            # Operator reports read one operator's departures in date order
+            models.Index(fields=['operator', 'departure_datetime'], name='travel_operator_idx'),
+            # City lists (autocomplete, popularity) read DISTINCT names from the index alone
+            models.Index(fields=['source'], name='travel_source_idx'),
+            models.Index(fields=['destination'], name='travel_destination_idx'),
+        ]
+        constraints = [
+            # Manual edits can still drift from the bookings; reconcile_seats finds those
+            models.CheckConstraint(check=models.Q(available_seats__lte=models.F('total_seats')),
+                                   name='available_seats_within_total',
+                                   violation_error_message='Available seats cannot exceed total seats.'),
+        ]
 
     def __str__(self):
         return f"{self.get_travel_type_display()} - {self.source} to {self.destination}"
 
+    def save(self, *args, **kwargs):
+        creating = self._state.adding
+        self.set_schedule_columns()
+        super().save(*args, **kwargs)
+        if creating:
+            from .pricing import build_price_tiers
+            build_price_tiers([self], touch=False)
+
+    def set_schedule_columns(self):
+        """Derive duration_minutes and departure_minute from the schedule"""
+        if self.departure_datetime and self.arrival_datetime:
+            self.duration_minutes = max(0, int((self.arrival_datetime - self.departure_datetime).total_seconds()) // 60)
+        if self.departure_datetime:
+            departure = self.departure_datetime.astimezone(dt_timezone.utc)
+            self.departure_minute = departure.hour * 60 + departure.minute
+
+    def current_fare(self):
+        """Per-seat fare for the current load, from the precomputed price tiers"""
+        if hasattr(self, 'fare'):  # annotated by pricing.with_current_fare()
+            return self.fare
+        from .pricing import lookup_fare
+        return lookup_fare(self)
+
     @property
     def is_available(self):
         return self.available_seats > 0 and self.departure_datetime > timezone.now()
@@ -72,13 +126,17 @@ class Booking(models.Model):
 
     class Meta:
         ordering = ['-booking_date']
+        indexes = [
+            # My bookings lists one user's bookings newest first straight from the index
+            models.Index(fields=['user', '-booking_date'], name='booking_user_date_idx'),
+        ]
 
     def __str__(self):
         return f"Booking #{self.booking_id} - {self.user.username}"
 
     def save(self, *args, **kwargs):
         if not self.total_price:
-            self.total_price = self.travel_option.price * self.number_of_seats
+            self.total_price = self.travel_option.current_fare() * self.number_of_seats
         super().save(*args, **kwargs)
 
     @property
@@ -87,4 +145,200 @@ class Booking(models.Model):
         if self.status == 'cancelled':
             return False
         time_until_departure = self.travel_option.departure_datetime - timezone.now()
-        return time_until_departure.total_seconds() > 7200  # 2 hours in seconds
\ No newline at end of file
+        return time_until_departure.total_seconds() > 7200  # 2 hours in seconds
+
+
+class WaitlistEntry(models.Model):
+    """Request for seats on a sold-out departure, promoted to a booking in FIFO order"""
+    travel_option = models.ForeignKey(TravelOption, on_delete=models.CASCADE, related_name='waitlist_entries')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='waitlist_entries')
+    number_of_seats = models.PositiveIntegerField(validators=[MinValueValidator(1)])
+    passenger_details = models.JSONField(default=list, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['created_at', 'id']
+        indexes = [
+            # Promotion reads only the head of the queue
+            models.Index(fields=['travel_option', 'created_at'], name='waitlist_fifo_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['travel_option', 'user'], name='unique_waitlist_entry_per_user'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} waiting for {self.number_of_seats} on {self.travel_option_id}"
+
+
+class BookingRequest(models.Model):
+    """Idempotency key of a booking submission; the unique index lets only one attempt per key commit"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='booking_requests')
+    key = models.CharField(max_length=64)
+    # Plain ids so the record outlives archive_departures
+    booking_id = models.IntegerField(blank=True, null=True)
+    # The departure the key was used for; the same key on another one is a client error
+    travel_id = models.IntegerField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='unique_booking_request_key'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id}:{self.key} -> {self.booking_id}"
+
+
+class PriceTier(models.Model):
+    """Fare charged for a departure once its availability drops to max_available_seats"""
+    travel_option = models.ForeignKey(TravelOption, on_delete=models.CASCADE, related_name='price_tiers')
+    max_available_seats = models.PositiveIntegerField()
+    price = models.DecimalField(max_digits=10, decimal_places=2, validators=[MinValueValidator(0)])
+
+    class Meta:
+        ordering = ['travel_option', '-max_available_seats']
+        constraints = [
+            # Also the index the fare lookup walks: (travel_option, seats >= available)
+            models.UniqueConstraint(fields=['travel_option', 'max_available_seats'],
+                                    name='unique_price_tier_per_load'),
+        ]
+
+    def __str__(self):
+        return f"{self.travel_option_id}: <= {self.max_available_seats} seats left at {self.price}"
+
+class ArchivedTravelOption(models.Model):
+    """Departed travel option moved out of the hot table by archive_departures"""
+    travel_id = models.IntegerField(primary_key=True)
+    travel_type = models.CharField(max_length=10, choices=TravelOption.TRAVEL_TYPES)
+    source = models.CharField(max_length=100)
+    destination = models.CharField(max_length=100)
+    departure_datetime = models.DateTimeField()
+    arrival_datetime = models.DateTimeField()
+    price = models.DecimalField(max_digits=10, decimal_places=2)
+    available_seats = models.PositiveIntegerField()
+    total_seats = models.PositiveIntegerField()
+    operator = models.CharField(max_length=100)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['departure_datetime']
+        indexes = [
+            models.Index(fields=['operator', 'departure_datetime'], name='archived_operator_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_travel_type_display()} - {self.source} to {self.destination}"
+
+    is_available = False
+
+class ArchivedBooking(models.Model):
+    """Booking of an archived travel option, kept readable for booking_detail"""
+    booking_id = models.IntegerField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_bookings')
+    travel_option = models.ForeignKey(ArchivedTravelOption, on_delete=models.CASCADE, related_name='bookings')
+    number_of_seats = models.PositiveIntegerField()
+    total_price = models.DecimalField(max_digits=12, decimal_places=2)
+    booking_date = models.DateTimeField()
+    status = models.CharField(max_length=10, choices=Booking.STATUS_CHOICES)
+    passenger_details = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-booking_date']
+
+    def __str__(self):
+        return f"Booking #{self.booking_id} - {self.user.username}"
+
+    # Archived departures have already left
+    can_cancel = False
+
+
+class BookingEvent(models.Model):
+    """Append-only record of a booking or seat change, written in the transaction that made it"""
+    EVENT_TYPES = [
+        ('booking_created', 'Booking created'),
+        ('booking_cancelled', 'Booking cancelled'),
+        ('seats_changed', 'Seats changed'),
+    ]
+
+    event_id = models.BigAutoField(primary_key=True)
+    event_type = models.CharField(max_length=20, choices=EVENT_TYPES)
+    # Plain ids rather than foreign keys so events outlive archive_departures
+    travel_id = models.IntegerField()
+    booking_id = models.IntegerField(blank=True, null=True)
+    user_id = models.IntegerField(blank=True, null=True)
+    seats_delta = models.IntegerField(default=0)
+    available_seats = models.PositiveIntegerField()  # after the change
+    payload = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['event_id']
+
+    def __str__(self):
+        return f"#{self.event_id} {self.event_type} travel {self.travel_id}"
+
+class EventCheckpoint(models.Model):
+    """Last BookingEvent a named consumer has processed"""
+    consumer = models.CharField(max_length=100, primary_key=True)
+    last_event_id = models.BigIntegerField(default=0)
+    # [first id, last id, first seen (epoch seconds)] of skipped ids below last_event_id that may still commit
+    gaps = models.JSONField(default=list, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.consumer} at #{self.last_event_id}"
+
+
+class RouteActivity(models.Model):
+    """Searches and bookings for a route in one hourly bucket, rolled up by travel_booking.popularity"""
+    bucket = models.DateTimeField()
+    # Blank when a search gave only one end of the route
+    source = models.CharField(max_length=100, blank=True)
+    destination = models.CharField(max_length=100, blank=True)
+    searches = models.PositiveIntegerField(default=0)
+    bookings = models.PositiveIntegerField(default=0)
+    seats = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ['-bucket']
+        constraints = [
+            models.UniqueConstraint(fields=['bucket', 'source', 'destination'], name='unique_route_activity_bucket'),
+        ]
+
+    def __str__(self):
+        return f"{self.bucket:%Y-%m-%d %H:00} {self.source} → {self.destination}"
+
+
+class TrendingRoute(models.Model):
+    """Precomputed top routes shown on the home page"""
+    rank = models.PositiveIntegerField(primary_key=True)
+    source = models.CharField(max_length=100, blank=True)
+    destination = models.CharField(max_length=100, blank=True)
+    score = models.FloatField()
+    searches = models.PositiveIntegerField()
+    bookings = models.PositiveIntegerField()
+    computed_at = models.DateTimeField()
+
+    class Meta:
+        ordering = ['rank']
+
+    def __str__(self):
+        return f"#{self.rank} {self.source} → {self.destination}"
+
+
+class CityPopularity(models.Model):
+    """Decayed activity per city, used to rank city autocomplete"""
+    city = models.CharField(max_length=100, primary_key=True)
+    score = models.FloatField()
+
+    class Meta:
+        ordering = ['-score']
+        verbose_name_plural = 'city popularity'
+
+    def __str__(self):
+        return f"{self.city}: {self.score:.1f}"
@@ -0,0 +1,255 @@
+"""
+Route popularity and trending searches.
+
+Nothing here runs GROUP BY over bookings at request time:
+
+- Searches are counted in a per-process Space-Saving sketch, a fixed-size
+  top-k counter, and a background thread flushes the heaviest entries into
+  hourly RouteActivity rows about once a minute. The same thread loads the
+  known city names, so counting a search never queries, and a worker's
+  last counts are flushed when it exits (see gunicorn.conf.py).
+- Bookings reach the same rollups from the booking event feed, read
+  incrementally under the 'popularity' checkpoint.
+- refresh_popularity() turns the recent buckets into a handful of
+  TrendingRoute and CityPopularity rows, which the home page and city
+  autocomplete read directly.
+"""
+import threading
+from collections import defaultdict
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .events import BookingEventConsumer
+from .refresher import Refresher
+from .models import (
+    TravelOption, ArchivedTravelOption, RouteActivity, TrendingRoute, CityPopularity,
+)
+
+SKETCH_CAPACITY = 200
+FLUSH_INTERVAL = 60  # seconds
+FLUSH_TOP = 50  # sketch entries written per flush
+
+WINDOW = timedelta(days=7)
+HALF_LIFE = timedelta(hours=24)
+BOOKING_WEIGHT = 5  # a booking counts as much as this many searches
+TRENDING_SIZE = 10
+RETENTION = timedelta(days=30)
+
+EVENT_CONSUMER = 'popularity'
+KNOWN_CITIES_CACHE_KEY = 'popularity:known-cities'
+KNOWN_CITIES_TIMEOUT = 600
+
+
+class SpaceSaving:
+    """Space-Saving heavy-hitter sketch over at most `capacity` keys
+
+    A new key arriving when the sketch is full replaces the smallest counter
+    and inherits its count as error, so for every tracked key
+    count - error <= true count <= count.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+
+    def __len__(self):
+        return len(self.counts)
+
+    def add(self, key, count=1):
+        if key in self.counts:
+            self.counts[key] += count
+        elif len(self.counts) < self.capacity:
+            self.counts[key] = count
+            self.errors[key] = 0
+        else:
+            victim = min(self.counts, key=self.counts.__getitem__)
+            floor = self.counts.pop(victim)
+            del self.errors[victim]
+            self.counts[key] = floor + count
+            self.errors[key] = floor
+
+    def top(self, k=None):
+        """[(key, count, error)] by count, largest first"""
+        ranked = sorted(self.counts.items(), key=lambda item: -item[1])[:k]
+        return [(key, count, self.errors[key]) for key, count in ranked]
+
+    def clear(self):
+        self.counts.clear()
+        self.errors.clear()
+
+
+def hour_bucket(moment):
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def add_route_activity(bucket, source, destination, searches=0, bookings=0, seats=0):
+    """Increment one rollup row, creating it if needed"""
+    rows = RouteActivity.objects.filter(bucket=bucket, source=source, destination=destination)
+    increments = {'searches': F('searches') + searches, 'bookings': F('bookings') + bookings,
+                  'seats': F('seats') + seats}
+    if rows.update(**increments):
+        return
+    try:
+        with transaction.atomic():
+            RouteActivity.objects.create(bucket=bucket, source=source, destination=destination,
+                                         searches=searches, bookings=bookings, seats=seats)
+    except IntegrityError:
+        rows.update(**increments)  # created concurrently
+
+
+def known_cities():
+    """casefolded name -> display name of every city with departures"""
+    cities = cache.get(KNOWN_CITIES_CACHE_KEY)
+    if cities is None:
+        from .snapshot import get_departure_snapshot
+        snapshot = get_departure_snapshot()
+        if snapshot is not None:
+            names = snapshot.search_cities('', limit=None)
+        else:
+            names = set(TravelOption.objects.order_by().values_list('source', flat=True).distinct())
+            names |= set(TravelOption.objects.order_by().values_list('destination', flat=True).distinct())
+        cities = {name.casefold(): name for name in names}
+        cache.set(KNOWN_CITIES_CACHE_KEY, cities, KNOWN_CITIES_TIMEOUT)
+    return cities
+
+
+class SearchTracker:
+    """Counts searches per route in memory and flushes the top of the sketch to RouteActivity
+
+    The sketch holds casefolded names; they are mapped to known cities when
+    flushed. Until the flusher has loaded the cities once, unknown names are
+    counted too and dropped at the flush.
+    """
+
+    def __init__(self, capacity=SKETCH_CAPACITY, flush_interval=FLUSH_INTERVAL):
+        self.sketch = SpaceSaving(capacity)
+        self.lock = threading.Lock()
+        self.cities = None  # known_cities(), loaded by the flusher
+        # Requests only count; the database reads and writes happen on this thread
+        self.flusher = Refresher('search-tracker', self.flush, flush_interval)
+
+    def record(self, source, destination):
+        """Count a search; only names of known cities are tracked"""
+        cities = self.cities
+        key = tuple(name.strip().casefold() if name else '' for name in (source, destination))
+        if cities is not None:
+            key = tuple(name if name in cities else '' for name in key)
+        if not any(key):
+            return
+        with self.lock:
+            self.sketch.add(key)
+        self.flusher.start()
+
+    def flush(self):
+        self.cities = cities = known_cities()
+        with self.lock:
+            # Lower bounds only, so the sketch never inflates a route
+            entries = [(key, count - error) for key, count, error in self.sketch.top(FLUSH_TOP)]
+            self.sketch.clear()
+        bucket = hour_bucket(timezone.now())
+        for key, count in entries:
+            source, destination = (cities.get(name, '') for name in key)
+            if count > 0 and (source or destination):
+                add_route_activity(bucket, source, destination, searches=count)
+
+    def close(self):
+        """Stop the flusher and write what is still counted, e.g. when the worker exits"""
+        self.flusher.stop()
+        self.flush()
+
+
+search_tracker = SearchTracker()
+
+
+def record_search(source, destination):
+    search_tracker.record(source, destination)
+
+
+def roll_up_booking_events(batch_size=1000):
+    """Add new booking events from the feed to the rollups; returns the number of events read"""
+    consumer = BookingEventConsumer(EVENT_CONSUMER, batch_size=batch_size)
+    read = 0
+    pending = []
+    for event in consumer.events():
+        pending.append(event)
+        if len(pending) >= batch_size:
+            read += _roll_up(consumer, pending)
+            pending = []
+    if pending:
+        read += _roll_up(consumer, pending)
+    return read
+
+
+def _roll_up(consumer, events):
+    travel_ids = {event.travel_id for event in events}
+    routes = dict((travel_id, (source, destination)) for travel_id, source, destination in
+                  TravelOption.objects.filter(travel_id__in=travel_ids)
+                  .values_list('travel_id', 'source', 'destination'))
+    missing = travel_ids - routes.keys()
+    if missing:
+        routes.update((travel_id, (source, destination)) for travel_id, source, destination in
+                      ArchivedTravelOption.objects.filter(travel_id__in=missing)
+                      .values_list('travel_id', 'source', 'destination'))
+
+    totals = defaultdict(lambda: [0, 0])
+    for event in events:
+        route = routes.get(event.travel_id)
+        if route is None or event.event_type != 'booking_created':
+            continue
+        counts = totals[hour_bucket(event.created_at), route]
+        counts[0] += 1
+        counts[1] -= event.seats_delta
+    with transaction.atomic():
+        for (bucket, (source, destination)), (bookings, seats) in totals.items():
+            add_route_activity(bucket, source, destination, bookings=bookings, seats=seats)
+        consumer.checkpoint(events[-1].event_id)
+    return len(events)
+
+
+def refresh_popularity(now=None, window=WINDOW, half_life=HALF_LIFE, size=TRENDING_SIZE):
+    """Recompute TrendingRoute and CityPopularity from the recent rollups"""
+    now = now or timezone.now()
+    half_life_hours = half_life.total_seconds() / 3600
+    routes = defaultdict(lambda: [0.0, 0, 0])
+    for bucket, source, destination, searches, bookings in RouteActivity.objects.filter(
+            bucket__gt=now - window).values_list('bucket', 'source', 'destination', 'searches', 'bookings'):
+        age_hours = max(0.0, (now - bucket).total_seconds() / 3600)
+        weight = 0.5 ** (age_hours / half_life_hours)
+        totals = routes[source, destination]
+        totals[0] += (searches + BOOKING_WEIGHT * bookings) * weight
+        totals[1] += searches
+        totals[2] += bookings
+
+    cities = defaultdict(float)
+    for (source, destination), (score, _, _) in routes.items():
+        for city in {source, destination} - {''}:
+            cities[city] += score
+
+    # Only complete routes are shown as trending
+    ranked = sorted(((key, totals) for key, totals in routes.items() if all(key)),
+                    key=lambda item: -item[1][0])[:size]
+    with transaction.atomic():
+        TrendingRoute.objects.all().delete()
+        TrendingRoute.objects.bulk_create([
+            TrendingRoute(rank=rank, source=source, destination=destination, score=score,
+                          searches=searches, bookings=bookings, computed_at=now)
+            for rank, ((source, destination), (score, searches, bookings)) in enumerate(ranked, 1)
+        ])
+        CityPopularity.objects.all().delete()
+        CityPopularity.objects.bulk_create([CityPopularity(city=city, score=score) for city, score in cities.items()])
+    return len(ranked)
+
+
+def prune_route_activity(now=None, retention=RETENTION):
+    return RouteActivity.objects.filter(bucket__lt=(now or timezone.now()) - retention).delete()[0]
+
+
+def rank_cities(names, limit=10):
+    """Sort city names by popularity, then alphabetically"""
+    scores = dict(CityPopularity.objects.filter(city__in=names).values_list('city', 'score'))
+    return sorted(names, key=lambda name: (-scores.get(name, 0), name))[:limit]
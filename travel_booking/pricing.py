@@ -0,0 +1,120 @@
+"""
+Load-based fares.
+
+Each departure gets a handful of PriceTier rows computed up front from
+LOAD_FACTOR_TIERS, so resolving the current fare is one indexed lookup
+(the tier with the smallest max_available_seats >= available_seats) that
+can run as a subquery of the search query itself.
+"""
+import math
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .caching import invalidate_travel_detail
+from .models import TravelOption, PriceTier
+
+# (share of seats sold, multiplier on the base price)
+LOAD_FACTOR_TIERS = [
+    (Decimal('0.00'), Decimal('1.00')),
+    (Decimal('0.50'), Decimal('1.10')),
+    (Decimal('0.75'), Decimal('1.25')),
+    (Decimal('0.90'), Decimal('1.50')),
+]
+
+
+def pricing_enabled():
+    return getattr(settings, 'DYNAMIC_PRICING', True)
+
+
+def fare_multiplier_range():
+    """Smallest and largest multiplier between a base price and its fares"""
+    if not pricing_enabled():
+        return Decimal('1.00'), Decimal('1.00')
+    multipliers = [multiplier for _, multiplier in LOAD_FACTOR_TIERS]
+    return min(multipliers), max(multipliers)
+
+
+def tier_prices(price, total_seats):
+    """Yield (max_available_seats, price) pairs for a base price and capacity"""
+    seen = set()
+    for load, multiplier in LOAD_FACTOR_TIERS:
+        # load >= L  <=>  available <= total * (1 - L)
+        max_available = math.floor(total_seats * (1 - load))
+        if max_available in seen:
+            continue
+        seen.add(max_available)
+        yield max_available, (price * multiplier).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+
+
+def tiers_for(travel_option):
+    """Yield (max_available_seats, price) pairs for one departure"""
+    return tier_prices(travel_option.price, travel_option.total_seats)
+
+
+def build_price_tiers(travel_options, touch=True):
+    """Replace the price tiers of the given travel options
+
+    Fares change with the tiers, so by default the departures' updated_at is
+    bumped for the caches that refresh from it (snapshot, route planner,
+    search pool) and their cached detail pages are dropped. save() passes
+    touch=False for a row it has just written.
+    """
+    travel_options = list(travel_options)
+    ids = [option.pk for option in travel_options]
+    with transaction.atomic():
+        PriceTier.objects.filter(travel_option__in=ids).delete()
+        PriceTier.objects.bulk_create([
+            PriceTier(travel_option_id=option.pk, max_available_seats=max_available, price=price)
+            for option in travel_options
+            for max_available, price in tiers_for(option)
+        ])
+        if touch:
+            TravelOption.objects.filter(pk__in=ids).update(updated_at=timezone.now())
+            invalidate_travel_detail(*ids)
+
+
+def rebuild_price_tiers(queryset=None, chunk_size=2000):
+    """Rebuild tiers for a queryset of travel options in primary key chunks"""
+    queryset = (queryset if queryset is not None else TravelOption.objects.all()).order_by('pk')
+    queryset = queryset.only('pk', 'price', 'total_seats')
+    last_pk = 0
+    count = 0
+    while True:
+        chunk = list(queryset.filter(pk__gt=last_pk)[:chunk_size])
+        if not chunk:
+            return count
+        build_price_tiers(chunk)
+        count += len(chunk)
+        last_pk = chunk[-1].pk
+
+
+def current_fare_expression():
+    """Fare for the row's current availability, falling back to the base price"""
+    tier_price = PriceTier.objects.filter(
+        travel_option=OuterRef('pk'),
+        max_available_seats__gte=OuterRef('available_seats'),
+    ).order_by('max_available_seats').values('price')[:1]
+    return Coalesce(Subquery(tier_price), F('price'))
+
+
+def with_current_fare(queryset):
+    """Annotate `fare` onto a TravelOption queryset"""
+    if not pricing_enabled():
+        return queryset.annotate(fare=F('price'))
+    return queryset.annotate(fare=current_fare_expression())
+
+
+def lookup_fare(travel_option):
+    """Current fare of a single loaded travel option"""
+    if not pricing_enabled():
+        return travel_option.price
+    price = PriceTier.objects.filter(
+        travel_option_id=travel_option.pk,
+        max_available_seats__gte=travel_option.available_seats,
+    ).order_by('max_available_seats').values_list('price', flat=True).first()
+    return price if price is not None else travel_option.price
@@ -0,0 +1,294 @@
+"""
+Minimal QR code encoder for e-tickets.
+
+Byte mode only, versions 1-10 (up to 271 bytes at level L), which covers
+the short signed booking references printed on tickets. Follows ISO/IEC
+18004: Reed-Solomon error correction over GF(256), block interleaving and
+the mask with the lowest penalty score.
+"""
+from typing import NamedTuple
+
+ERROR_LEVELS = {'L': 1, 'M': 0, 'Q': 3, 'H': 2}  # level -> format bits
+
+# (version, level) -> (EC codewords per block, [(block count, data codewords per block), ...])
+BLOCKS = {
+    (1, 'L'): (7, [(1, 19)]), (1, 'M'): (10, [(1, 16)]), (1, 'Q'): (13, [(1, 13)]), (1, 'H'): (17, [(1, 9)]),
+    (2, 'L'): (10, [(1, 34)]), (2, 'M'): (16, [(1, 28)]), (2, 'Q'): (22, [(1, 22)]), (2, 'H'): (28, [(1, 16)]),
+    (3, 'L'): (15, [(1, 55)]), (3, 'M'): (26, [(1, 44)]), (3, 'Q'): (18, [(2, 17)]), (3, 'H'): (22, [(2, 13)]),
+    (4, 'L'): (20, [(1, 80)]), (4, 'M'): (18, [(2, 32)]), (4, 'Q'): (26, [(2, 24)]), (4, 'H'): (16, [(4, 9)]),
+    (5, 'L'): (26, [(1, 108)]), (5, 'M'): (24, [(2, 43)]), (5, 'Q'): (18, [(2, 15), (2, 16)]),
+    (5, 'H'): (22, [(2, 11), (2, 12)]),
+    (6, 'L'): (18, [(2, 68)]), (6, 'M'): (16, [(4, 27)]), (6, 'Q'): (24, [(4, 19)]), (6, 'H'): (28, [(4, 15)]),
+    (7, 'L'): (20, [(2, 78)]), (7, 'M'): (18, [(4, 31)]), (7, 'Q'): (18, [(2, 14), (4, 15)]),
+    (7, 'H'): (26, [(4, 13), (1, 14)]),
+    (8, 'L'): (24, [(2, 97)]), (8, 'M'): (22, [(2, 38), (2, 39)]), (8, 'Q'): (22, [(4, 18), (2, 19)]),
+    (8, 'H'): (26, [(4, 14), (2, 15)]),
+    (9, 'L'): (30, [(2, 116)]), (9, 'M'): (22, [(3, 36), (2, 37)]), (9, 'Q'): (20, [(4, 16), (4, 17)]),
+    (9, 'H'): (24, [(4, 12), (4, 13)]),
+    (10, 'L'): (18, [(2, 68), (2, 69)]), (10, 'M'): (26, [(4, 43), (1, 44)]), (10, 'Q'): (24, [(6, 19), (2, 20)]),
+    (10, 'H'): (28, [(6, 15), (2, 16)]),
+}
+MAX_VERSION = 10
+
+ALIGNMENT_CENTERS = {
+    1: [], 2: [6, 18], 3: [6, 22], 4: [6, 26], 5: [6, 30],
+    6: [6, 34], 7: [6, 22, 38], 8: [6, 24, 42], 9: [6, 26, 46], 10: [6, 28, 50],
+}
+
+MASKS = [
+    lambda x, y: (x + y) % 2 == 0,
+    lambda x, y: y % 2 == 0,
+    lambda x, y: x % 3 == 0,
+    lambda x, y: (x + y) % 3 == 0,
+    lambda x, y: (x // 3 + y // 2) % 2 == 0,
+    lambda x, y: x * y % 2 + x * y % 3 == 0,
+    lambda x, y: (x * y % 2 + x * y % 3) % 2 == 0,
+    lambda x, y: ((x + y) % 2 + x * y % 3) % 2 == 0,
+]
+
+# GF(256) with the QR polynomial x^8 + x^4 + x^3 + x^2 + 1
+EXP = [0] * 512
+LOG = [0] * 256
+_value = 1
+for _power in range(255):
+    EXP[_power] = _value
+    LOG[_value] = _power
+    _value <<= 1
+    if _value & 0x100:
+        _value ^= 0x11D
+for _power in range(255, 512):
+    EXP[_power] = EXP[_power - 255]
+
+
+class QRCode(NamedTuple):
+    version: int
+    error: str
+    mask: int
+    modules: list  # rows of booleans, True is dark
+
+    @property
+    def size(self):
+        return len(self.modules)
+
+
+def _multiply(a, b):
+    return EXP[LOG[a] + LOG[b]] if a and b else 0
+
+
+def _generator(degree):
+    """Coefficients of prod(x - a^i) for i < degree, highest power first"""
+    poly = [1]
+    for i in range(degree):
+        poly = [coefficient ^ _multiply(previous, EXP[i])
+                for coefficient, previous in zip(poly + [0], [0] + poly)]
+    return poly
+
+
+def reed_solomon(data, degree):
+    """Error correction codewords for one block"""
+    generator = _generator(degree)
+    remainder = list(data) + [0] * degree
+    for index in range(len(data)):
+        factor = remainder[index]
+        if factor:
+            for offset, coefficient in enumerate(generator):
+                remainder[index + offset] ^= _multiply(coefficient, factor)
+    return remainder[len(data):]
+
+
+def _capacity(version, error):
+    _, groups = BLOCKS[version, error]
+    return sum(count * size for count, size in groups)
+
+
+def _data_codewords(data, version, error):
+    count_bits = 8 if version < 10 else 16
+    bits = [0, 1, 0, 0]  # byte mode
+    bits += [(len(data) >> shift) & 1 for shift in range(count_bits - 1, -1, -1)]
+    for byte in data:
+        bits += [(byte >> shift) & 1 for shift in range(7, -1, -1)]
+    capacity = _capacity(version, error) * 8
+    bits += [0] * min(4, capacity - len(bits))  # terminator
+    bits += [0] * (-len(bits) % 8)
+    codewords = [int(''.join(map(str, bits[index:index + 8])), 2) for index in range(0, len(bits), 8)]
+    for index in range(capacity // 8 - len(codewords)):
+        codewords.append(0x11 if index % 2 else 0xEC)
+    return codewords
+
+
+def _interleave(codewords, version, error):
+    degree, groups = BLOCKS[version, error]
+    blocks, position = [], 0
+    for count, size in groups:
+        for _ in range(count):
+            blocks.append(codewords[position:position + size])
+            position += size
+    ec_blocks = [reed_solomon(block, degree) for block in blocks]
+    result = []
+    for index in range(max(len(block) for block in blocks)):
+        result += [block[index] for block in blocks if index < len(block)]
+    for index in range(degree):
+        result += [block[index] for block in ec_blocks]
+    return result
+
+
+def _bch(value, generator):
+    """value followed by its BCH remainder for the given generator polynomial"""
+    remainder = value << (generator.bit_length() - 1)
+    while remainder.bit_length() >= generator.bit_length():
+        remainder ^= generator << (remainder.bit_length() - generator.bit_length())
+    return (value << (generator.bit_length() - 1)) | remainder
+
+
+class _Matrix:
+    def __init__(self, version):
+        self.version = version
+        self.size = version * 4 + 17
+        self.modules = [[False] * self.size for _ in range(self.size)]
+        self.reserved = [[False] * self.size for _ in range(self.size)]
+        self._function_patterns()
+
+    def set(self, x, y, dark, reserve=True):
+        self.modules[y][x] = dark
+        if reserve:
+            self.reserved[y][x] = True
+
+    def _function_patterns(self):
+        size = self.size
+        for index in range(size):
+            self.set(6, index, index % 2 == 0)
+            self.set(index, 6, index % 2 == 0)
+        for x, y in [(3, 3), (size - 4, 3), (3, size - 4)]:
+            for dy in range(-4, 5):
+                for dx in range(-4, 5):
+                    if 0 <= x + dx < size and 0 <= y + dy < size:
+                        distance = max(abs(dx), abs(dy))
+                        self.set(x + dx, y + dy, distance not in (2, 4))
+        centers = ALIGNMENT_CENTERS[self.version]
+        last = len(centers) - 1
+        for i, x in enumerate(centers):
+            for j, y in enumerate(centers):
+                if (i, j) in ((0, 0), (0, last), (last, 0)):
+                    continue  # overlaps a finder pattern
+                for dy in range(-2, 3):
+                    for dx in range(-2, 3):
+                        self.set(x + dx, y + dy, max(abs(dx), abs(dy)) != 1)
+        # Reserve the format and version areas; filled in after masking
+        self.draw_format(ERROR_LEVELS['L'], 0)
+        if self.version >= 7:
+            bits = _bch(self.version, 0x1F25)
+            for index in range(18):
+                dark = bool(bits >> index & 1)
+                a, b = size - 11 + index % 3, index // 3
+                self.set(a, b, dark)
+                self.set(b, a, dark)
+
+    def draw_format(self, error_bits, mask):
+        size = self.size
+        bits = _bch(error_bits << 3 | mask, 0x537) ^ 0x5412
+        bit = [bool(bits >> index & 1) for index in range(15)]
+        for index in range(6):
+            self.set(8, index, bit[index])
+        self.set(8, 7, bit[6])
+        self.set(8, 8, bit[7])
+        self.set(7, 8, bit[8])
+        for index in range(9, 15):
+            self.set(14 - index, 8, bit[index])
+        for index in range(8):
+            self.set(size - 1 - index, 8, bit[index])
+        for index in range(8, 15):
+            self.set(8, size - 15 + index, bit[index])
+        self.set(8, size - 8, True)
+
+    def draw_codewords(self, codewords):
+        size = self.size
+        total = len(codewords) * 8
+        index = 0
+        right = size - 1
+        while right >= 1:
+            if right == 6:
+                right = 5  # skip the vertical timing pattern
+            upward = (right + 1) & 2 == 0
+            for vertical in range(size):
+                y = size - 1 - vertical if upward else vertical
+                for x in (right, right - 1):
+                    if not self.reserved[y][x] and index < total:
+                        self.modules[y][x] = bool(codewords[index >> 3] >> (7 - index & 7) & 1)
+                        index += 1
+            right -= 2
+
+    def masked(self, mask):
+        condition = MASKS[mask]
+        return [
+            [dark ^ (not reserved and condition(x, y)) for x, (dark, reserved) in enumerate(zip(row, reserved_row))]
+            for y, (row, reserved_row) in enumerate(zip(self.modules, self.reserved))
+        ]
+
+
+def _run_penalty(line):
+    penalty, run, previous = 0, 0, None
+    for dark in line:
+        if dark == previous:
+            run += 1
+        else:
+            if run >= 5:
+                penalty += run - 2
+            run, previous = 1, dark
+    if run >= 5:
+        penalty += run - 2
+    return penalty
+
+
+FINDER_LIKE = ([True, False, True, True, True, False, True, False, False, False, False],
+               [False, False, False, False, True, False, True, True, True, False, True])
+
+
+def _finder_penalty(line):
+    penalty = 0
+    for start in range(len(line) - 10):
+        window = line[start:start + 11]
+        if window == FINDER_LIKE[0] or window == FINDER_LIKE[1]:
+            penalty += 40
+    return penalty
+
+
+def penalty(modules):
+    """Mask evaluation score from ISO/IEC 18004 section 7.8.3"""
+    size = len(modules)
+    columns = [list(column) for column in zip(*modules)]
+    score = 0
+    for line in modules + columns:
+        score += _run_penalty(line) + _finder_penalty(line)
+    for y in range(size - 1):
+        for x in range(size - 1):
+            if modules[y][x] == modules[y][x + 1] == modules[y + 1][x] == modules[y + 1][x + 1]:
+                score += 3
+    dark = sum(map(sum, modules))
+    score += abs(dark * 20 - size * size * 10) // (size * size) * 10
+    return score
+
+
+def encode(data, error='M', version=None, mask=None):
+    """QRCode for bytes or text (UTF-8) in the smallest version that fits"""
+    if isinstance(data, str):
+        data = data.encode()
+    if error not in ERROR_LEVELS:
+        raise ValueError(f'Unknown error correction level: {error}')
+    fits = [candidate for candidate in ([version] if version else range(1, MAX_VERSION + 1))
+            if 4 + (8 if candidate < 10 else 16) + len(data) * 8 <= _capacity(candidate, error) * 8]
+    if not fits:
+        raise ValueError(f'{len(data)} bytes do not fit in a version {version or MAX_VERSION} QR code '
+                         f'at level {error}')
+    version = fits[0]
+
+    matrix = _Matrix(version)
+    matrix.draw_codewords(_interleave(_data_codewords(data, version, error), version, error))
+    candidates = [mask] if mask is not None else range(len(MASKS))
+    best = None
+    for candidate in candidates:
+        matrix.draw_format(ERROR_LEVELS[error], candidate)
+        modules = matrix.masked(candidate)
+        score = penalty(modules) if mask is None else 0
+        if best is None or score < best[0]:
+            best = (score, candidate, modules)
+    return QRCode(version, error, best[1], best[2])
@@ -0,0 +1,168 @@
+"""
+Query-plan checks for the views.
+
+capture_selects() records the SQL and parameters of every SELECT a block
+of code runs, for example a test client request to a view. explain() asks
+the database for the plan of each one and reduces it to PlanSteps: the
+table, how it is read, and the index used. Both SQLite (EXPLAIN QUERY
+PLAN) and MySQL (EXPLAIN FORMAT=JSON) are understood. Plans from other
+backends come back without steps.
+
+VIEW_PLAN_CHECKS lists the requests the test suite replays against a
+seeded database, with the indexes each one must use and the tables it may
+scan in full. QueryPlanTest in tests.py fails when a view stops using an
+expected index, or starts scanning a large table, or sorting rows the
+index should deliver in order.
+"""
+import json
+import re
+from contextlib import contextmanager
+from typing import NamedTuple
+
+from django.db import connections
+
+SQLITE_STEP = re.compile(
+    r'^(?P<access>SCAN|SEARCH) (?P<table>\S+)(?: AS \S+)?'
+    r'(?: USING (?:(?:AUTOMATIC )?(?:PARTIAL )?COVERING )?INDEX (?P<index>\S+)| USING (?P<pk>INTEGER PRIMARY KEY))?'
+)
+
+
+class PlanStep(NamedTuple):
+    table: str  # table name, or the alias the query gives it
+    access: str  # SQLite SCAN/SEARCH, MySQL access_type
+    index: str  # None when no index is used; 'PRIMARY' for primary key lookups
+    full_scan: bool  # every row of the table is read
+
+
+class QueryPlan(NamedTuple):
+    sql: str
+    vendor: str
+    steps: list
+    temp_sort: bool  # rows are sorted, grouped or de-duplicated in a temporary structure
+    raw: str
+
+    @property
+    def indexes(self):
+        return {step.index for step in self.steps if step.index}
+
+    @property
+    def full_scans(self):
+        return [step.table for step in self.steps if step.full_scan]
+
+    def __str__(self):
+        return f'{self.sql}\n{self.raw}'
+
+
+def parse_sqlite_plan(rows):
+    """(steps, temp_sort) from EXPLAIN QUERY PLAN rows of (id, parent, notused, detail)"""
+    steps, temp_sort = [], False
+    for *_, detail in rows:
+        if detail.startswith('USE TEMP B-TREE'):
+            temp_sort = True
+        match = SQLITE_STEP.match(detail)
+        if match is None or match['table'] == 'CONSTANT':
+            continue
+        index = 'PRIMARY' if match['pk'] else match['index']
+        steps.append(PlanStep(match['table'], match['access'], index,
+                              match['access'] == 'SCAN' and index is None))
+    return steps, temp_sort
+
+
+def parse_mysql_plan(document):
+    """(steps, temp_sort) from the document returned by EXPLAIN FORMAT=JSON"""
+    steps, temp_sort = [], False
+
+    def walk(node):
+        nonlocal temp_sort
+        if isinstance(node, dict):
+            if node.get('using_filesort') or node.get('using_temporary_table'):
+                temp_sort = True
+            table = node.get('table')
+            if isinstance(table, dict) and 'table_name' in table:
+                access = table.get('access_type', '')
+                steps.append(PlanStep(table['table_name'], access, table.get('key'), access == 'ALL'))
+            for value in node.values():
+                walk(value)
+        elif isinstance(node, list):
+            for value in node:
+                walk(value)
+
+    walk(document)
+    return steps, temp_sort
+
+
+def explain(sql, params=(), using='default'):
+    """QueryPlan for one SELECT statement"""
+    connection = connections[using]
+    vendor = connection.vendor
+    prefix = connection.ops.explain_query_prefix('JSON' if vendor == 'mysql' else None)
+    with connection.cursor() as cursor:
+        cursor.execute(f'{prefix} {sql}', params)
+        rows = cursor.fetchall()
+    if vendor == 'sqlite':
+        steps, temp_sort = parse_sqlite_plan(rows)
+        raw = '\n'.join(row[-1] for row in rows)
+    elif vendor == 'mysql':
+        document = json.loads(rows[0][0])
+        steps, temp_sort = parse_mysql_plan(document)
+        raw = json.dumps(document, indent=2)
+    else:
+        steps, temp_sort = [], False
+        raw = '\n'.join(' '.join(map(str, row)) for row in rows)
+    return QueryPlan(sql, vendor, steps, temp_sort, raw)
+
+
+def explain_queryset(queryset):
+    sql, params = queryset.query.get_compiler(queryset.db).as_sql()
+    return explain(sql, params, queryset.db)
+
+
+@contextmanager
+def capture_selects(using='default'):
+    """Collect (sql, params) of each SELECT run inside the block into the yielded list"""
+    captured = []
+
+    def record(execute, sql, params, many, context):
+        if not many and sql.lstrip()[:6].upper() == 'SELECT':
+            captured.append((sql, tuple(params or ())))
+        return execute(sql, params, many, context)
+
+    with connections[using].execute_wrapper(record):
+        yield captured
+
+
+class PlanCheck(NamedTuple):
+    url_name: str
+    # Values naming a test fixture ('travel', 'booking', 'operator', 'tomorrow') are filled in by the test
+    kwargs: dict = {}
+    query: dict = {}
+    login: bool = False
+    staff: bool = False
+    indexes: tuple = ()  # index names that some statement must use
+    ordered: tuple = ()  # tables whose rows must come back in index order, without a temporary sort
+    allow_full_scan: tuple = ()  # tables this view may read in full
+
+
+# Tables small enough that reading them in full is the right plan
+SMALL_TABLES = ('travel_booking_trendingroute', 'travel_booking_citypopularity', 'django_content_type')
+
+VIEW_PLAN_CHECKS = [
+    PlanCheck('home', indexes=('travel_departure_idx',), ordered=('travel_booking_traveloption',)),
+    PlanCheck('home', query={'source': 'Mumbai', 'destination': 'Delhi'}, indexes=('travel_departure_idx',),
+              ordered=('travel_booking_traveloption',)),
+    PlanCheck('home', query={'sort': 'duration'}, indexes=('travel_duration_idx',),
+              ordered=('travel_booking_traveloption',)),
+    PlanCheck('home', query={'departure_date': 'tomorrow'}, indexes=('travel_departure_idx',)),
+    PlanCheck('home', query={'depart_after': '06:00', 'depart_before': '09:00'}, indexes=('travel_minute_idx',)),
+    PlanCheck('travel_detail', kwargs={'travel_id': 'travel'}, indexes=('PRIMARY',)),
+    PlanCheck('book_travel', kwargs={'travel_id': 'travel'}, login=True, indexes=('PRIMARY',)),
+    PlanCheck('my_bookings', login=True, indexes=('booking_user_date_idx',),
+              ordered=('travel_booking_booking',)),
+    PlanCheck('my_bookings', query={'status': 'confirmed'}, login=True, indexes=('booking_user_date_idx',),
+              ordered=('travel_booking_booking',)),
+    PlanCheck('booking_detail', kwargs={'booking_id': 'booking'}, login=True, indexes=('PRIMARY',)),
+    # icontains cannot seek in a B-tree, but the names are read from the smaller city indexes
+    PlanCheck('search_cities', query={'q': 'mu'}, indexes=('travel_source_idx', 'travel_destination_idx')),
+    PlanCheck('operator_report', query={'operator': 'operator'}, login=True, staff=True,
+              indexes=('travel_operator_idx',)),
+]
@@ -0,0 +1,63 @@
+"""
+Background refresh for the in-process read caches.
+
+The route planner, the departure snapshot, the search pool and the search
+tracker keep state in memory that is brought up to date from the database
+every few seconds. A Refresher does that on a daemon thread, so no request
+waits for a reload or holds a lock every other search needs while one
+runs.
+
+Threads do not survive a fork. start() notices when it is called in a new
+process (a gunicorn worker forked from the preloaded master) and starts a
+fresh thread there, so callers simply call it on each use.
+"""
+import logging
+import os
+import threading
+
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+
+class Refresher:
+    """Call `function` every `interval` seconds on a daemon thread"""
+
+    def __init__(self, name, function, interval):
+        self.name = name
+        self.function = function
+        self.interval = interval
+        self.thread = None
+        self.pid = None
+        self.stopping = threading.Event()
+        self.lock = threading.Lock()
+
+    def start(self, run_now=False):
+        """Start the thread in this process unless it is already running
+
+        With run_now the first call happens at once instead of after one interval.
+        """
+        with self.lock:
+            if self.pid == os.getpid() and self.thread.is_alive() and not self.stopping.is_set():
+                return
+            self.stopping = threading.Event()
+            self.thread = threading.Thread(target=self._run, args=(self.stopping, run_now), name=self.name,
+                                           daemon=True)
+            self.pid = os.getpid()
+            self.thread.start()
+
+    def stop(self):
+        """Ask the thread to exit after its current run"""
+        self.stopping.set()
+
+    def _run(self, stopping, run_now):
+        if not run_now and stopping.wait(self.interval):
+            return
+        while not stopping.is_set():
+            try:
+                self.function()
+            except Exception:
+                logger.exception('Background refresh %s failed', self.name)
+            finally:
+                connections.close_all()  # this thread's connections only
+            stopping.wait(self.interval)
@@ -0,0 +1,161 @@
+"""
+Operator occupancy and revenue reports.
+
+Rows are aggregated in SQL and read with iterator(), so an export never
+holds more than one chunk of rows. Departures moved out by
+archive_departures are read from the archive tables and merged back in
+order, so reports cover the whole history.
+
+Local dates and times use the zone passed in, not the active one: a CSV
+export is streamed after the view has returned and the request's zone has
+been deactivated.
+"""
+import csv
+import heapq
+from decimal import Decimal
+from itertools import groupby
+
+from django.db.models import (
+    Count, DecimalField, ExpressionWrapper, F, FloatField, OuterRef, Q, Subquery, Sum, Value,
+)
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+from .models import TravelOption, Booking, ArchivedTravelOption, ArchivedBooking
+
+CHUNK_SIZE = 2000
+CENTS = Decimal('0.01')
+
+GROUPINGS = ('departure', 'day')
+
+# grouping -> (CSV header, row keys)
+COLUMNS = {
+    'departure': [
+        ('Departure ID', 'travel_id'), ('Operator', 'operator'), ('Type', 'travel_type'),
+        ('From', 'source'), ('To', 'destination'), ('Departure', 'departure_datetime'),
+        ('Total seats', 'total_seats'), ('Seats sold', 'seats_sold'), ('Occupancy %', 'occupancy'),
+        ('Bookings', 'bookings'), ('Revenue', 'revenue'),
+    ],
+    'day': [
+        ('Date', 'day'), ('Operator', 'operator'), ('Departures', 'departures'),
+        ('Total seats', 'total_seats'), ('Seats sold', 'seats_sold'), ('Occupancy %', 'occupancy'),
+        ('Bookings', 'bookings'), ('Revenue', 'revenue'),
+    ],
+}
+
+MONEY = DecimalField(max_digits=14, decimal_places=2)
+
+# (departures, their bookings), archive first
+TABLES = [(ArchivedTravelOption, ArchivedBooking), (TravelOption, Booking)]
+
+
+def _departures(model, operator='', start=None, end=None):
+    queryset = model.objects.order_by()
+    if operator:
+        queryset = queryset.filter(operator=operator)
+    if start:
+        queryset = queryset.filter(departure_datetime__gte=start)
+    if end:
+        queryset = queryset.filter(departure_datetime__lt=end)
+    return queryset
+
+
+def _occupancy(sold, total):
+    return round(sold * 100 / total, 1) if total else 0.0
+
+
+def _money(value):
+    # SQLite returns sums of decimals as floats
+    return Decimal(str(value or 0)).quantize(CENTS)
+
+
+def departure_rows(model, operator='', start=None, end=None):
+    """Per-departure aggregates from one table, by departure time"""
+    confirmed = Q(bookings__status='confirmed')
+    return _departures(model, operator, start, end).annotate(
+        seats_sold=F('total_seats') - F('available_seats'),
+        occupancy=ExpressionWrapper(
+            (F('total_seats') - F('available_seats')) * Value(100.0) / F('total_seats'), output_field=FloatField(),
+        ),
+        bookings_count=Count('bookings', filter=confirmed),
+        revenue=Coalesce(Sum('bookings__total_price', filter=confirmed), Value(0), output_field=MONEY),
+    ).values(
+        'travel_id', 'operator', 'travel_type', 'source', 'destination', 'departure_datetime',
+        'total_seats', 'seats_sold', 'occupancy', 'bookings_count', 'revenue',
+    ).order_by('departure_datetime', 'travel_id')
+
+
+def day_rows(model, booking_model, operator='', start=None, end=None, zone=None):
+    """Per-day, per-operator aggregates from one table, by date in zone (default: the active zone)"""
+    # Booking totals come from subqueries: joining bookings would repeat
+    # each departure's seat counts once per booking.
+    bookings = booking_model.objects.filter(
+        travel_option=OuterRef('pk'), status='confirmed',
+    ).order_by().values('travel_option')
+    return _departures(model, operator, start, end).annotate(
+        day=TruncDate('departure_datetime', tzinfo=zone or timezone.get_current_timezone()),
+    ).values('day', 'operator').annotate(
+        departures=Count('travel_id'),
+        total=Sum('total_seats'),
+        seats_sold=Sum(F('total_seats') - F('available_seats')),
+        bookings_count=Coalesce(Sum(Subquery(bookings.annotate(n=Count('pk')).values('n'))), Value(0)),
+        revenue=Coalesce(Sum(Subquery(bookings.annotate(s=Sum('total_price')).values('s'), output_field=MONEY)),
+                         Value(0), output_field=MONEY),
+    ).order_by('day', 'operator')
+
+
+def departure_report(operator='', start=None, end=None, zone=None):
+    """Per-departure report rows, archived and live departures merged by departure time
+
+    Departure times stay aware; zone is accepted so every report takes the same arguments.
+    """
+    streams = [departure_rows(model, operator, start, end).iterator(chunk_size=CHUNK_SIZE)
+               for model, _ in TABLES]
+    for row in heapq.merge(*streams, key=lambda row: (row['departure_datetime'], row['travel_id'])):
+        row['bookings'] = row.pop('bookings_count')
+        row['occupancy'] = round(row['occupancy'] or 0, 1)
+        row['revenue'] = _money(row['revenue'])
+        yield row
+
+
+def day_report(operator='', start=None, end=None, zone=None):
+    """Per-day report rows; a day split between the archive and the live table is summed"""
+    streams = [day_rows(model, booking_model, operator, start, end, zone).iterator(chunk_size=CHUNK_SIZE)
+               for model, booking_model in TABLES]
+    merged = heapq.merge(*streams, key=lambda row: (row['day'], row['operator']))
+    for (day, operator_name), rows in groupby(merged, key=lambda row: (row['day'], row['operator'])):
+        total = {'day': day, 'operator': operator_name, 'departures': 0, 'total_seats': 0,
+                 'seats_sold': 0, 'bookings': 0, 'revenue': Decimal(0)}
+        for row in rows:
+            total['departures'] += row['departures']
+            total['total_seats'] += row['total']
+            total['seats_sold'] += row['seats_sold']
+            total['bookings'] += row['bookings_count']
+            total['revenue'] += _money(row['revenue'])
+        total['occupancy'] = _occupancy(total['seats_sold'], total['total_seats'])
+        yield total
+
+
+REPORTS = {'departure': departure_report, 'day': day_report}
+
+
+class _Echo:
+    """File-like object whose write() returns the line, for csv.writer"""
+
+    def write(self, value):
+        return value
+
+
+def report_csv(rows, grouping, zone):
+    """CSV lines for report rows, header first, with departure times in zone"""
+    columns = COLUMNS[grouping]
+    writer = csv.writer(_Echo())
+    yield writer.writerow([header for header, _ in columns])
+    for row in rows:
+        values = []
+        for _, key in columns:
+            value = row[key]
+            if key == 'departure_datetime':
+                value = timezone.localtime(value, zone).strftime('%Y-%m-%d %H:%M')
+            values.append(value)
+        yield writer.writerow(values)
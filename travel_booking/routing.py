@@ -0,0 +1,398 @@
+"""
+Connection search across upcoming departures.
+
+The planner keeps a time-expanded graph in memory: for every (source,
+destination) pair, the upcoming legs sorted by departure time. A search scans
+the first legs leaving the origin and, for each one, binary-searches the
+connecting routes for the best onward leg inside the layover window, pruning
+anything that cannot beat the current top-k. Origin and destination match
+every city whose name contains them, as the home page search does.
+
+The graph is refreshed incrementally from TravelOption.updated_at on a
+background thread and rebuilt every FULL_RELOAD_INTERVAL. It holds every
+upcoming leg, so it is off unless the ROUTE_PLANNER setting is on; each
+gunicorn worker then starts loading it when it boots (travel_booking.startup).
+"""
+import heapq
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from typing import NamedTuple
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import TravelOption
+from .pricing import with_current_fare
+from .refresher import Refresher
+
+MIN_LAYOVER = timedelta(minutes=45)
+MAX_LAYOVER = timedelta(hours=12)
+SEARCH_WINDOW = timedelta(hours=24)
+
+# How often the background refresh pulls changed rows from the database
+REFRESH_INTERVAL = 30  # seconds
+FULL_RELOAD_INTERVAL = 600  # seconds
+# How far behind the watermark each refresh re-reads, for rows stamped
+# before a slow transaction committed
+REFRESH_OVERLAP = timedelta(seconds=60)
+
+# Onward legs tried per first leg and intermediate city when sorting by price
+PRICE_CANDIDATES = 3
+
+
+def _city_key(name):
+    return name.strip().lower()
+
+
+def _epoch(value):
+    return int(value.timestamp())
+
+
+class Leg(NamedTuple):
+    departure: int  # epoch seconds
+    arrival: int
+    travel_id: int
+    price: int  # current fare in paise
+    available_seats: int
+    source: str
+    destination: str
+    travel_type: str
+    operator: str
+
+    @property
+    def departure_datetime(self):
+        return datetime.fromtimestamp(self.departure, dt_timezone.utc)
+
+    @property
+    def arrival_datetime(self):
+        return datetime.fromtimestamp(self.arrival, dt_timezone.utc)
+
+    @property
+    def fare(self):
+        return Decimal(self.price) / 100
+
+
+class Itinerary(NamedTuple):
+    legs: tuple
+
+    @property
+    def stops(self):
+        return len(self.legs) - 1
+
+    @property
+    def departure_datetime(self):
+        return self.legs[0].departure_datetime
+
+    @property
+    def arrival_datetime(self):
+        return self.legs[-1].arrival_datetime
+
+    @property
+    def total_price(self):
+        return Decimal(sum(leg.price for leg in self.legs)) / 100
+
+    def get_duration(self):
+        minutes = (self.legs[-1].arrival - self.legs[0].departure) // 60
+        return f"{minutes // 60}h {minutes % 60}m"
+
+
+class _Route:
+    """Legs of one (source, destination) pair, sorted by departure"""
+    __slots__ = ('departures', 'legs')
+
+    def __init__(self):
+        self.departures = []
+        self.legs = []
+
+    def add(self, leg):
+        index = bisect_left(self.departures, leg.departure)
+        self.departures.insert(index, leg.departure)
+        self.legs.insert(index, leg)
+
+    def remove(self, leg):
+        index = bisect_left(self.departures, leg.departure)
+        while self.legs[index].travel_id != leg.travel_id:
+            index += 1
+        del self.departures[index]
+        del self.legs[index]
+
+    def window(self, start, end, seats):
+        """Legs departing in [start, end] with enough seats, in departure order"""
+        legs = self.legs
+        for index in range(bisect_left(self.departures, start), len(legs)):
+            leg = legs[index]
+            if leg.departure > end:
+                return
+            if leg.available_seats >= seats:
+                yield leg
+
+
+class _TopK:
+    """Keeps the `limit` itineraries with the smallest sort keys"""
+
+    def __init__(self, limit, sort):
+        self.limit = limit
+        self.by_price = sort == 'price'
+        self.heap = []
+        self.counter = 0
+
+    def key(self, legs):
+        arrival = legs[-1].arrival
+        price = sum(leg.price for leg in legs)
+        return (price, arrival) if self.by_price else (arrival, price)
+
+    def bound(self):
+        """Primary key an itinerary must beat to get in"""
+        if len(self.heap) < self.limit:
+            return float('inf')
+        return -self.heap[0][0]
+
+    def offer(self, legs):
+        primary, secondary = self.key(legs)
+        self.counter += 1
+        entry = (-primary, -secondary, self.counter, legs)
+        if len(self.heap) < self.limit:
+            heapq.heappush(self.heap, entry)
+        elif entry > self.heap[0]:
+            heapq.heapreplace(self.heap, entry)
+
+    def results(self):
+        ordered = sorted(self.heap, key=lambda entry: (-entry[0], -entry[1], entry[2]))
+        return [Itinerary(tuple(entry[3])) for entry in ordered]
+
+
+class RoutePlanner:
+    """In-memory time-expanded graph of upcoming departures"""
+
+    def __init__(self):
+        self.routes = defaultdict(_Route)
+        self.legs = {}
+        self.outgoing = defaultdict(set)
+        self.incoming = defaultdict(set)
+        self.watermark = None
+        self.refreshed_at = 0
+        self.loaded_at = 0
+        self.lock = threading.Lock()
+
+    def add_leg(self, leg):
+        """Insert or replace a leg; sold-out legs are dropped"""
+        self.remove_leg(leg.travel_id)
+        if leg.available_seats <= 0:
+            return
+        source, destination = _city_key(leg.source), _city_key(leg.destination)
+        self.routes[source, destination].add(leg)
+        self.legs[leg.travel_id] = leg
+        self.outgoing[source].add(destination)
+        self.incoming[destination].add(source)
+
+    def load(self, legs):
+        """Replace the whole graph, sorting each route once instead of per insert"""
+        self.routes.clear()
+        self.legs.clear()
+        self.outgoing.clear()
+        self.incoming.clear()
+        for leg in sorted(legs):
+            if leg.available_seats <= 0:
+                continue
+            source, destination = _city_key(leg.source), _city_key(leg.destination)
+            route = self.routes[source, destination]
+            route.departures.append(leg.departure)
+            route.legs.append(leg)
+            self.legs[leg.travel_id] = leg
+            self.outgoing[source].add(destination)
+            self.incoming[destination].add(source)
+
+    def remove_leg(self, travel_id):
+        leg = self.legs.pop(travel_id, None)
+        if leg is not None:
+            self.routes[_city_key(leg.source), _city_key(leg.destination)].remove(leg)
+
+    def prune(self, now):
+        """Drop legs that have already departed"""
+        cutoff = _epoch(now)
+        for route in self.routes.values():
+            index = bisect_left(route.departures, cutoff)
+            if index:
+                for leg in route.legs[:index]:
+                    self.legs.pop(leg.travel_id, None)
+                del route.departures[:index]
+                del route.legs[:index]
+
+    def _fetch(self, queryset):
+        """(leg, updated_at) for each row of the queryset"""
+        rows = with_current_fare(queryset).order_by().values_list(
+            'travel_id', 'departure_datetime', 'arrival_datetime', 'fare', 'available_seats',
+            'source', 'destination', 'travel_type', 'operator', 'updated_at',
+        )
+        for travel_id, departure, arrival, fare, seats, source, destination, travel_type, operator, updated_at \
+                in rows.iterator(chunk_size=5000):
+            yield Leg(_epoch(departure), _epoch(arrival), travel_id, int(fare * 100), seats,
+                      source, destination, travel_type, operator), updated_at
+
+    def reload(self):
+        """Rebuild from every upcoming departure, then swap the new graph in"""
+        now = timezone.now()
+        fresh = RoutePlanner()
+        fresh.load(leg for leg, _ in self._fetch(TravelOption.objects.filter(departure_datetime__gt=now)))
+        with self.lock:
+            for name in ('routes', 'legs', 'outgoing', 'incoming'):
+                setattr(self, name, getattr(fresh, name))
+            self.watermark = now
+            self.refreshed_at = self.loaded_at = time.monotonic()
+
+    def refresh(self):
+        """Apply departures changed since the last refresh, or reload when due"""
+        if self.watermark is None or time.monotonic() - self.loaded_at >= FULL_RELOAD_INTERVAL:
+            return self.reload()
+        now = timezone.now()
+        # updated_at is stamped before the row's transaction commits, so a row
+        # committed after the last refresh can be older than the watermark.
+        # Re-reading an overlap window catches it; re-adding a leg is harmless.
+        changed = list(self._fetch(TravelOption.objects.filter(updated_at__gte=self.watermark - REFRESH_OVERLAP)))
+        cutoff = _epoch(now)
+        with self.lock:
+            for leg, updated_at in changed:
+                self.watermark = max(self.watermark, updated_at)
+                if leg.departure <= cutoff:
+                    self.remove_leg(leg.travel_id)
+                else:
+                    self.add_leg(leg)
+            self.prune(now)
+            self.refreshed_at = time.monotonic()
+
+    def matching_cities(self, query, cities):
+        """Keys in `cities` containing the query, as icontains matches them"""
+        query = _city_key(query)
+        return {city for city in cities if query in city}
+
+    def search(self, source, destination, departure_from, departure_until=None, max_stops=2,
+               sort='arrival', limit=5, seats=1, min_layover=MIN_LAYOVER, max_layover=MAX_LAYOVER):
+        """Top `limit` itineraries with up to `max_stops` changes, by arrival time or price"""
+        start = max(_epoch(departure_from), int(time.time()))
+        end = _epoch(departure_until or departure_from + SEARCH_WINDOW)
+        min_gap, max_gap = int(min_layover.total_seconds()), int(max_layover.total_seconds())
+        best = _TopK(limit, sort)
+        by_price = best.by_price
+
+        with self.lock:
+            # Cities are matched by substring, like the home page's direct search
+            origins = self.matching_cities(source, self.outgoing)
+            targets = self.matching_cities(destination, self.incoming) - origins
+            if not origins or not targets:
+                return []
+
+            first_legs = []
+            for origin in origins:
+                for hub in self.outgoing[origin] - origins:
+                    first_legs.extend(self.routes[origin, hub].window(start, end, seats))
+            first_legs.sort(key=(lambda leg: leg.price) if by_price else (lambda leg: leg.arrival))
+
+            # Intermediate cities with a route onward to a target
+            feeders = set().union(*(self.incoming[target] for target in targets)) - origins - targets
+
+            for first in first_legs:
+                bound = best.bound()
+                if (first.price if by_price else first.arrival) >= bound:
+                    break  # first legs are sorted, nothing later can qualify
+                hub = _city_key(first.destination)
+                if hub in targets:
+                    best.offer([first])
+                    continue
+                if max_stops < 1:
+                    continue
+                ready, latest = first.arrival + min_gap, first.arrival + max_gap
+
+                if hub in feeders:
+                    for target in self.outgoing[hub] & targets:
+                        last = self._best_leg(self.routes[hub, target], ready, latest, seats, by_price, best.bound())
+                        if last:
+                            best.offer([first, last])
+                if max_stops < 2:
+                    continue
+                for second_hub in self.outgoing[hub] & feeders:
+                    for second in self._candidates(self.routes[hub, second_hub], ready, latest, seats,
+                                                   by_price, best.bound()):
+                        for target in self.outgoing[second_hub] & targets:
+                            last = self._best_leg(self.routes[second_hub, target], second.arrival + min_gap,
+                                                  second.arrival + max_gap, seats, by_price, best.bound())
+                            if last:
+                                best.offer([first, second, last])
+        return best.results()
+
+    @staticmethod
+    def _best_leg(route, start, end, seats, by_price, bound):
+        """Earliest-arriving (or cheapest) leg in the window"""
+        best = None
+        for leg in route.window(start, end, seats):
+            if by_price:
+                if leg.price < bound and (best is None or leg.price < best.price):
+                    best = leg
+            else:
+                if leg.departure >= bound or (best and leg.departure >= best.arrival):
+                    break  # cannot arrive earlier than what we have
+                if best is None or leg.arrival < best.arrival:
+                    best = leg
+        return best
+
+    @classmethod
+    def _candidates(cls, route, start, end, seats, by_price, bound):
+        """Middle legs worth extending: the earliest arrival, or the few cheapest"""
+        if not by_price:
+            leg = cls._best_leg(route, start, end, seats, False, bound)
+            return [leg] if leg else []
+        legs = [leg for leg in route.window(start, end, seats) if leg.price < bound]
+        return heapq.nsmallest(PRICE_CANDIDATES, legs, key=lambda leg: leg.price)
+
+
+_planner = None
+_planner_lock = threading.Lock()
+
+
+def _refresh_planner():
+    with _planner_lock:
+        planner = _planner
+    if planner is not None:
+        planner.refresh()
+
+
+_refresher = Refresher('route-planner', _refresh_planner, REFRESH_INTERVAL)
+
+
+def load_route_planner():
+    """Load the process-wide planner now, in this thread"""
+    global _planner
+    with _planner_lock:
+        if _planner is None:
+            _planner = RoutePlanner()
+        planner = _planner
+    if planner.watermark is None:
+        planner.refresh()
+    return planner
+
+
+def get_route_planner():
+    """Process-wide planner, or None when ROUTE_PLANNER is off or the graph is still loading
+
+    Loading and refreshing happen on a background thread, never in the request.
+    """
+    global _planner
+    if not getattr(settings, 'ROUTE_PLANNER', False):
+        return None
+    with _planner_lock:
+        if _planner is None:
+            _planner = RoutePlanner()
+        planner = _planner
+    _refresher.start(run_now=planner.watermark is None)
+    return planner if planner.watermark is not None else None
+
+
+def reset_route_planner():
+    """Forget the process-wide planner and stop refreshing it"""
+    global _planner
+    _refresher.stop()
+    with _planner_lock:
+        _planner = None
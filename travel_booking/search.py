@@ -0,0 +1,214 @@
+import math
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from decimal import Decimal, InvalidOperation
+
+from django.db.models import Max, Q
+from django.utils import timezone
+
+from .models import TravelOption
+from .pricing import with_current_fare, fare_multiplier_range
+
+TRAVEL_TYPES = ['flight', 'train', 'bus']
+
+MINUTES_PER_DAY = 24 * 60
+
+SORT_OPTIONS = {
+    'departure': 'Departure time',
+    'price': 'Price',
+    'duration': 'Duration',
+}
+
+# Every ordering ends on the departure time so equal prices/durations list chronologically
+ORDERINGS = {
+    'departure': ('departure_datetime',),
+    'price': ('fare', 'departure_datetime'),
+    'duration': ('duration_minutes', 'departure_datetime'),
+}
+
+
+def parse_price(value):
+    """Non-negative Decimal from a form value, or None"""
+    try:
+        price = Decimal(value)
+    except (InvalidOperation, TypeError):
+        return None
+    return price if price.is_finite() and price >= 0 else None
+
+
+def parse_time(value):
+    """datetime.time from an HH:MM form value, or None"""
+    try:
+        return datetime.strptime(value, '%H:%M').time()
+    except (ValueError, TypeError):
+        return None
+
+
+def offset_periods(start, end, tz=None):
+    """[(period_start, period_end, UTC offset in minutes)] covering [start, end) in the zone"""
+    tz = tz or timezone.get_current_timezone()
+
+    def offset(moment):
+        return int(moment.astimezone(tz).utcoffset().total_seconds()) // 60
+
+    periods = []
+    period_start, current = start, offset(start)
+    day = start
+    while day < end:
+        following = min(day + timedelta(days=1), end)
+        if offset(following) != current:
+            # Zones change offset at most once a day, on a whole second; find it
+            low, high = int(day.timestamp()), math.ceil(following.timestamp())
+            while high - low > 1:
+                middle = (low + high) // 2
+                if offset(datetime.fromtimestamp(middle, dt_timezone.utc)) == current:
+                    low = middle
+                else:
+                    high = middle
+            change = datetime.fromtimestamp(high, dt_timezone.utc)
+            periods.append((period_start, change, current))
+            period_start, current = change, offset(change)
+        day = following
+    periods.append((period_start, end, current))
+    return periods
+
+
+def _minute_range(first, length):
+    """Q for departure_minute in [first, first + length) modulo a day"""
+    first %= MINUTES_PER_DAY
+    last = first + length
+    if last <= MINUTES_PER_DAY:
+        return Q(departure_minute__gte=first, departure_minute__lt=last)
+    return Q(departure_minute__gte=first) | Q(departure_minute__lt=last - MINUTES_PER_DAY)
+
+
+def departure_window(depart_after=None, depart_before=None, start=None, end=None):
+    """Q for departures in a local time-of-day window; after > before wraps past midnight
+
+    The window is shifted to UTC for each offset the zone has between
+    start (default now) and end (default the last departure), and compared
+    with the stored departure_minute, so no row is converted.
+    """
+    after = depart_after.hour * 60 + depart_after.minute if depart_after else 0
+    before = depart_before.hour * 60 + depart_before.minute if depart_before else MINUTES_PER_DAY
+    length = before - after if after <= before else before + MINUTES_PER_DAY - after
+    if length >= MINUTES_PER_DAY:
+        return Q()
+    if length <= 0:
+        return Q(pk__in=[])
+
+    start = start or timezone.now()
+    if end is None:
+        last = TravelOption.objects.aggregate(last=Max('departure_datetime'))['last']
+        if last is None or last < start:
+            return Q()
+        end = last + timedelta(seconds=1)
+    periods = offset_periods(start, end)
+    if len(periods) == 1:
+        return _minute_range(after - periods[0][2], length)
+    window = Q()
+    for period_start, period_end, offset in periods:
+        window |= (_minute_range(after - offset, length)
+                   & Q(departure_datetime__gte=period_start, departure_datetime__lt=period_end))
+    return window
+
+
+def format_durations(options):
+    """(option, "Xh Ym") pairs for a page of results, formatting each distinct duration once"""
+    labels = {}
+    rows = []
+    for option in options:
+        minutes = option.duration_minutes
+        label = labels.get(minutes)
+        if label is None:
+            label = labels[minutes] = f"{minutes // 60}h {minutes % 60}m"
+        rows.append((option, label))
+    return rows
+
+
+def local_day_range(departure_date):
+    """UTC [start, end) of a YYYY-MM-DD date in the current time zone, or None if invalid
+
+    Comparing the stored UTC column with constant bounds keeps the date
+    filter on the departure index; no per-row time zone conversion.
+    """
+    try:
+        date_obj = datetime.strptime(departure_date, '%Y-%m-%d').date()
+    except ValueError:
+        return None
+    # Both ends from local midnight, so days with a DST change are 23 or 25 hours long
+    start = timezone.make_aware(datetime.combine(date_obj, time.min))
+    end = timezone.make_aware(datetime.combine(date_obj + timedelta(days=1), time.min))
+    return start.astimezone(dt_timezone.utc), end.astimezone(dt_timezone.utc)
+
+
+def search_travel_options(source='', destination='', travel_type='', departure_date='', sort='departure',
+                          min_price=None, max_price=None, depart_after=None, depart_before=None):
+    """Upcoming, bookable travel options matching the home page filters"""
+    from .search_pool import get_search_pool, PooledSearchResults
+    from .snapshot import get_departure_snapshot
+
+    start, end = (departure_date and local_day_range(departure_date)) or (None, None)
+    travel_type = travel_type if travel_type in TRAVEL_TYPES else ''
+    sort = sort if sort in SORT_OPTIONS else 'departure'
+    filtered = any(value is not None for value in (min_price, max_price, depart_after, depart_before))
+    pool = get_search_pool()
+    if pool is not None and sort != 'duration' and not filtered:
+        return PooledSearchResults(pool, source=source, destination=destination, start=start, end=end,
+                                   travel_type=travel_type, sort=sort)
+    snapshot = get_departure_snapshot()
+    if snapshot is not None:
+        return snapshot.search(source, destination, travel_type, start, end, sort=sort,
+                               min_price=min_price, max_price=max_price,
+                               depart_after=depart_after, depart_before=depart_before)
+
+    # Start with available travel options
+    travel_options = TravelOption.objects.filter(
+        departure_datetime__gt=timezone.now(),
+        available_seats__gt=0
+    )
+
+    # Apply filters if provided
+    if source:
+        travel_options = travel_options.filter(source__icontains=source)
+
+    if destination:
+        travel_options = travel_options.filter(destination__icontains=destination)
+
+    if travel_type:
+        travel_options = travel_options.filter(travel_type=travel_type)
+
+    if start is not None:  # an invalid date is ignored
+        travel_options = travel_options.filter(departure_datetime__gte=start, departure_datetime__lt=end)
+
+    if depart_after or depart_before:
+        travel_options = travel_options.filter(departure_window(depart_after, depart_before, start, end))
+
+    # The fare is resolved in the same query as the results
+    travel_options = with_current_fare(travel_options)
+
+    # Fares stay within the tier multipliers of the base price, so the
+    # range is also applied to the indexed price column to narrow the scan
+    lowest, highest = fare_multiplier_range()
+    if min_price is not None:
+        travel_options = travel_options.filter(
+            price__gte=(min_price / highest).quantize(Decimal('0.01')) - Decimal('0.01'),
+            fare__gte=min_price,
+        )
+    if max_price is not None:
+        travel_options = travel_options.filter(price__lte=max_price / lowest, fare__lte=max_price)
+
+    return travel_options.order_by(*ORDERINGS[sort])
+
+
+def search_connections(source, destination, departure_date='', sort='arrival', limit=5):
+    """1- and 2-stop itineraries for routes without direct service (none while the planner is off or loading)"""
+    from .routing import get_route_planner
+
+    planner = get_route_planner()
+    if planner is None:
+        return []
+    departure_from = timezone.now()
+    day = departure_date and local_day_range(departure_date)
+    if day:  # an invalid date searches from now
+        departure_from = max(departure_from, day[0])
+    return planner.search(source, destination, departure_from, sort=sort, limit=limit)
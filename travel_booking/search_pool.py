@@ -0,0 +1,368 @@
+"""
+Process pool for heavy searches.
+
+The upcoming TravelOption catalogue is published into shared memory as
+compact array columns (ids, route, type, departure epoch, fare, seats),
+sorted by (route, departure) so every route is one contiguous slice. Routes
+are sharded across worker processes by route id; a search resolves the
+matching routes in the parent, fans the route lists out to the shards and
+merges the per-shard top-k.
+
+Each publish creates a new generation of blocks. A search holds a
+reference to the generation it started on, and a replaced generation is
+unlinked only when its last search has finished, so workers can always
+attach to the blocks they are sent. Workers keep the last two generations
+they attached to mapped.
+
+Enabled with the SEARCH_WORKER_PROCESSES setting (0 keeps searches on the
+request thread). The catalogue is republished by a background thread; until
+the first one is ready, searches go to the snapshot or the ORM.
+"""
+import heapq
+import multiprocessing
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from concurrent.futures import BrokenExecutor, ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import shared_memory
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import TravelOption
+from .pricing import with_current_fare
+from .refresher import Refresher
+from .snapshot import get_departure_snapshot
+
+# How often the background refresh republishes the catalogue
+REFRESH_INTERVAL = 30  # seconds
+
+TRAVEL_TYPE_CODES = {'flight': 0, 'train': 1, 'bus': 2}
+
+# column name -> array typecode
+COLUMNS = {
+    'travel_id': 'q',
+    'route': 'i',
+    'travel_type': 'b',
+    'departure': 'q',
+    'price': 'q',
+    'available_seats': 'i',
+}
+
+SORT_KEYS = ('departure', 'price')
+
+
+class CatalogueColumns:
+    """Column arrays sorted by (route, departure) plus the route table"""
+
+    def __init__(self, columns, routes):
+        self.columns = columns
+        self.routes = routes  # route id -> (source, destination)
+        # route id -> [offsets[id], offsets[id + 1]) slice of the columns
+        self.offsets = array('q', [0] * (len(routes) + 1))
+        for route in columns['route']:
+            self.offsets[route + 1] += 1
+        for route in range(len(routes)):
+            self.offsets[route + 1] += self.offsets[route]
+
+    def __len__(self):
+        return len(self.columns['travel_id'])
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Build from (travel_id, source, destination, travel_type, departure_epoch, price_paise, seats)"""
+        route_ids = {}
+        keyed = []
+        for travel_id, source, destination, travel_type, departure, price, seats in rows:
+            route = route_ids.setdefault((source, destination), len(route_ids))
+            keyed.append((route, departure, travel_id, TRAVEL_TYPE_CODES.get(travel_type, -1), price, seats))
+        keyed.sort()
+        columns = {name: array(code) for name, code in COLUMNS.items()}
+        for route, departure, travel_id, travel_type, price, seats in keyed:
+            columns['route'].append(route)
+            columns['departure'].append(departure)
+            columns['travel_id'].append(travel_id)
+            columns['travel_type'].append(travel_type)
+            columns['price'].append(price)
+            columns['available_seats'].append(seats)
+        return cls(columns, list(route_ids))
+
+    @classmethod
+    def from_database(cls):
+        rows = with_current_fare(
+            TravelOption.objects.filter(departure_datetime__gt=timezone.now(), available_seats__gt=0)
+        ).order_by().values_list(
+            'travel_id', 'source', 'destination', 'travel_type', 'departure_datetime', 'fare', 'available_seats'
+        )
+        return cls.from_rows(
+            (travel_id, source, destination, travel_type, int(departure.timestamp()), int(fare * 100), seats)
+            for travel_id, source, destination, travel_type, departure, fare, seats in rows.iterator(chunk_size=5000)
+        )
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        return cls.from_rows(
+            (row.travel_id, row.source, row.destination, row.travel_type, row.departure, row.fare_paise,
+             row.available_seats)
+            for row in snapshot.upcoming_rows() if row.available_seats > 0
+        )
+
+
+class SharedCatalogue:
+    """Catalogue columns copied into named shared memory blocks"""
+
+    def __init__(self, catalogue, generation):
+        self.generation = generation
+        self.routes = catalogue.routes
+        self.blocks = []
+        self.searches = 0  # searches still using these blocks
+        self.spec = {'generation': generation, 'columns': {}}
+        arrays = dict(catalogue.columns, offsets=catalogue.offsets)
+        try:
+            for name, values in arrays.items():
+                block = shared_memory.SharedMemory(create=True,
+                                                   size=max(values.itemsize, len(values) * values.itemsize))
+                self.blocks.append(block)
+                block.buf[:len(values) * values.itemsize] = values.tobytes()
+                self.spec['columns'][name] = (block.name, values.typecode, len(values))
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
+
+
+# Worker-side cache of attached catalogues: generation -> (blocks, memoryviews, column views)
+_attached = {}
+ATTACHED_GENERATIONS = 2  # a search on the old generation can overlap the first ones on the new
+
+
+def _attach(spec):
+    generation = spec['generation']
+    if generation not in _attached:
+        while len(_attached) >= ATTACHED_GENERATIONS:
+            blocks, buffers, _ = _attached.pop(min(_attached))
+            for buffer in reversed(buffers):
+                buffer.release()
+            for block in blocks:
+                block.close()
+        # Workers share the parent's resource tracker, which unlinks the blocks
+        # if the parent dies; attaching must not unregister them
+        blocks, buffers, views = [], [], {}
+        for name, (block_name, typecode, length) in spec['columns'].items():
+            block = shared_memory.SharedMemory(name=block_name)
+            column = block.buf.cast(typecode)
+            blocks.append(block)
+            buffers.extend([column, column[:length]])
+            views[name] = buffers[-1]
+        _attached[generation] = (blocks, buffers, views)
+    return _attached[generation][2]
+
+
+def _search_shard(spec, route_ids, start, end, seats, travel_type, sort, limit):
+    """Scan the given routes' slices; return (match count, top-k sort keys)"""
+    views = _attach(spec)
+    offsets, departures = views['offsets'], views['departure']
+    prices, available, types, ids = views['price'], views['available_seats'], views['travel_type'], views['travel_id']
+    by_price = sort == 'price'
+    matches = []
+    for route in route_ids:
+        index, stop = offsets[route], offsets[route + 1]
+        index = bisect_left(departures, start, index, stop)
+        while index < stop and departures[index] < end:
+            if available[index] >= seats and (travel_type < 0 or types[index] == travel_type):
+                if by_price:
+                    matches.append((prices[index], departures[index], ids[index]))
+                else:
+                    matches.append((departures[index], ids[index]))
+            index += 1
+    return len(matches), heapq.nsmallest(limit, matches)
+
+
+def match_cities(query, cities):
+    """Cities containing the query, case-insensitively, as icontains matches them"""
+    query = query.strip().lower()
+    return {city for city in cities if query in city.lower()}
+
+
+class SearchWorkerPool:
+    """Fans searches out over route shards in worker processes"""
+
+    def __init__(self, processes):
+        self.processes = processes
+        if multiprocessing.current_process().daemon:
+            # A daemonic process (a test runner's --parallel worker, for one)
+            # cannot start children, so its shards run on one thread instead
+            self.executor = ThreadPoolExecutor(max_workers=1)
+        else:
+            self.executor = ProcessPoolExecutor(max_workers=processes)
+        self.broken = False
+        self.current = None
+        self.retired = []  # replaced generations that searches still hold
+        self.generation = 0
+        self.published_at = 0
+        self.lock = threading.Lock()
+
+    def publish(self, catalogue):
+        """Swap in a new catalogue; the old one is released once no search uses it"""
+        with self.lock:
+            self.generation += 1
+            shared = SharedCatalogue(catalogue, self.generation)
+            old, self.current = self.current, shared
+            if old is not None:
+                if old.searches:
+                    self.retired.append(old)
+                else:
+                    old.close()
+            self.published_at = time.monotonic()
+
+    def _acquire(self):
+        with self.lock:
+            shared = self.current
+            shared.searches += 1
+            return shared
+
+    def _release(self, shared):
+        with self.lock:
+            shared.searches -= 1
+            if shared in self.retired and not shared.searches:
+                shared.close()
+                self.retired.remove(shared)
+
+    def search(self, source='', destination='', start=None, end=None, seats=1, travel_type='',
+               sort='departure', limit=10):
+        """Return (total matches, [travel_id, ...] for the first `limit` in sort order)"""
+        if sort not in SORT_KEYS:
+            raise ValueError(f'Unsupported sort: {sort}')
+        shared = self._acquire()
+        try:
+            return self._search(shared, source, destination, start, end, seats, travel_type, sort, limit)
+        finally:
+            self._release(shared)
+
+    def _search(self, shared, source, destination, start, end, seats, travel_type, sort, limit):
+        routes = shared.routes
+        sources = match_cities(source, {route[0] for route in routes})
+        destinations = match_cities(destination, {route[1] for route in routes})
+        shards = [[] for _ in range(self.processes)]
+        for route_id, (route_source, route_destination) in enumerate(routes):
+            if route_source in sources and route_destination in destinations:
+                shards[route_id % self.processes].append(route_id)
+
+        start = max(int(start.timestamp()), int(time.time())) if start else int(time.time())
+        end = int(end.timestamp()) if end else 2 ** 62
+        type_code = TRAVEL_TYPE_CODES.get(travel_type, -1)
+        total, partials = 0, []
+        try:
+            futures = [
+                self.executor.submit(_search_shard, shared.spec, route_ids, start, end, seats, type_code, sort,
+                                     limit)
+                for route_ids in shards if route_ids
+            ]
+            for future in futures:
+                count, keys = future.result()
+                total += count
+                partials.append(keys)
+        except BrokenExecutor:
+            # The pool cannot run anything again; give its shared memory back now
+            self.broken = True
+            self.close()
+            raise
+        merged = heapq.merge(*partials)
+        return total, [key[-1] for key, _ in zip(merged, range(limit))]
+
+    def close(self):
+        try:
+            self.executor.shutdown()
+        finally:
+            with self.lock:
+                for shared in [*self.retired, self.current]:
+                    if shared is not None:
+                        shared.close()
+                self.retired = []
+                self.current = None
+
+
+class PooledSearchResults:
+    """Paginator-compatible result list backed by the worker pool
+
+    Counting also fetches the first `prefetch` ids, so the first page costs
+    one fan-out.
+    """
+
+    def __init__(self, pool, prefetch=10, **search):
+        self.pool = pool
+        self.prefetch = prefetch
+        self.search = search
+        self._count = None
+        self._ids = []
+
+    def _fetch(self, limit):
+        self._count, self._ids = self.pool.search(limit=limit, **self.search)
+
+    def count(self):
+        if self._count is None:
+            self._fetch(self.prefetch)
+        return self._count
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        if self._count is None or (index.stop > len(self._ids) and len(self._ids) < self._count):
+            self._fetch(index.stop)
+        travel_ids = self._ids[index]
+        options = with_current_fare(TravelOption.objects.filter(travel_id__in=travel_ids)).in_bulk()
+        return [options[travel_id] for travel_id in travel_ids if travel_id in options]
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _republish():
+    """Build the catalogue without holding any lock, then swap it in"""
+    with _pool_lock:
+        pool = _pool
+    if pool is None:
+        return
+    snapshot = get_departure_snapshot()
+    if snapshot is not None:
+        catalogue = CatalogueColumns.from_snapshot(snapshot)
+    else:
+        catalogue = CatalogueColumns.from_database()
+    pool.publish(catalogue)
+
+
+_refresher = Refresher('search-pool', _republish, REFRESH_INTERVAL)
+
+
+def get_search_pool():
+    """Process-wide pool, or None when SEARCH_WORKER_PROCESSES is 0 or nothing is published yet"""
+    global _pool
+    processes = getattr(settings, 'SEARCH_WORKER_PROCESSES', 0)
+    if not processes:
+        return None
+    with _pool_lock:
+        if _pool is None or _pool.broken:
+            _pool = SearchWorkerPool(processes)
+        pool = _pool
+    _refresher.start(run_now=pool.current is None)
+    return pool if pool.current is not None else None
+
+
+def reset_search_pool():
+    """Stop republishing and release the process-wide pool"""
+    global _pool
+    _refresher.stop()
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.close()
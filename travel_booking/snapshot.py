@@ -0,0 +1,412 @@
+"""
+Read-side snapshot of upcoming departures.
+
+Search result cards only need a dozen small fields, so instead of building a
+TravelOption instance per row the snapshot keeps upcoming departures in
+array columns: city and operator names are interned to integer ids,
+timestamps are epoch seconds and money is integer paise. Per-city posting
+lists and a departure-ordered index let a search pick its candidate rows
+without scanning the catalogue, and only the rows on the requested page are
+turned into objects.
+
+The snapshot is refreshed incrementally from TravelOption.updated_at and
+reloaded in full every FULL_RELOAD_INTERVAL to drop deleted rows, both on
+a background thread. Enabled with the DEPARTURE_SNAPSHOT setting; each
+gunicorn worker starts loading it when it boots (travel_booking.startup),
+and until a process has it loaded its searches go to the ORM.
+"""
+import heapq
+import math
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from typing import NamedTuple
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import TravelOption
+from .pricing import with_current_fare
+from .refresher import Refresher
+
+# How often the background refresh pulls changed rows from the database
+REFRESH_INTERVAL = 30  # seconds
+FULL_RELOAD_INTERVAL = 600  # seconds
+# How far behind the watermark each refresh re-reads, for rows stamped
+# before a slow transaction committed
+REFRESH_OVERLAP = timedelta(seconds=60)
+
+TRAVEL_TYPES = [code for code, _ in TravelOption.TRAVEL_TYPES]
+TRAVEL_TYPE_LABELS = [label for _, label in TravelOption.TRAVEL_TYPES]
+
+# column name -> array typecode
+COLUMNS = {
+    'travel_id': 'q',
+    'travel_type': 'b',
+    'source': 'i',
+    'destination': 'i',
+    'operator': 'i',
+    'departure': 'q',
+    'arrival': 'q',
+    'fare': 'q',
+    'available_seats': 'i',
+}
+
+
+def _epoch(value):
+    return int(value.timestamp())
+
+
+class SnapshotDeparture(NamedTuple):
+    """Result card row with the TravelOption attributes the templates use"""
+    travel_id: int
+    travel_type: str
+    source: str
+    destination: str
+    operator: str
+    departure: int
+    arrival: int
+    fare_paise: int  # current fare
+    available_seats: int
+
+    @property
+    def departure_datetime(self):
+        return datetime.fromtimestamp(self.departure, dt_timezone.utc)
+
+    @property
+    def arrival_datetime(self):
+        return datetime.fromtimestamp(self.arrival, dt_timezone.utc)
+
+    @property
+    def fare(self):
+        """Current fare in rupees, as TravelOption.fare"""
+        return Decimal(self.fare_paise) / 100
+
+    @property
+    def duration_minutes(self):
+        return (self.arrival - self.departure) // 60
+
+    @property
+    def is_available(self):
+        return self.available_seats > 0 and self.departure > time.time()
+
+    def get_travel_type_display(self):
+        return TRAVEL_TYPE_LABELS[TRAVEL_TYPES.index(self.travel_type)]
+
+    def get_duration(self):
+        minutes = (self.arrival - self.departure) // 60
+        return f"{minutes // 60}h {minutes % 60}m"
+
+
+def _row(columns, strings, index):
+    return SnapshotDeparture(
+        columns['travel_id'][index],
+        TRAVEL_TYPES[columns['travel_type'][index]],
+        strings[columns['source'][index]],
+        strings[columns['destination'][index]],
+        strings[columns['operator'][index]],
+        columns['departure'][index],
+        columns['arrival'][index],
+        columns['fare'][index],
+        columns['available_seats'][index],
+    )
+
+
+class SnapshotResults:
+    """Paginator-compatible list of snapshot rows
+
+    Holds the columns the indices were found in: a full reload swaps in new
+    columns, but this search keeps reading its own generation. Refreshes
+    only append rows and update them in place, so the indices stay valid.
+    """
+
+    def __init__(self, columns, strings, indices):
+        self.columns = columns
+        self.strings = strings
+        self.indices = indices
+
+    def count(self):
+        return len(self.indices)
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [_row(self.columns, self.strings, position) for position in self.indices[index]]
+        return _row(self.columns, self.strings, self.indices[index])
+
+
+class DepartureSnapshot:
+    """Upcoming departures in array columns, searchable without the ORM"""
+
+    def __init__(self):
+        self.strings = []  # interned city and operator names
+        self.string_ids = {}
+        self.cities = set()  # string ids used as a source or destination
+        self.columns = {name: array(code) for name, code in COLUMNS.items()}
+        self.positions = {}  # travel_id -> row index of its live row
+        self.by_source = defaultdict(lambda: array('i'))
+        self.by_destination = defaultdict(lambda: array('i'))
+        self.order = array('i')  # row indices sorted by departure
+        self.watermark = None
+        self.refreshed_at = 0
+        self.loaded_at = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.positions)
+
+    def intern(self, value):
+        string_id = self.string_ids.get(value)
+        if string_id is None:
+            string_id = self.string_ids[value] = len(self.strings)
+            self.strings.append(value)
+        return string_id
+
+    def _append(self, travel_id, travel_type, source, destination, operator, departure, arrival, fare, seats):
+        columns = self.columns
+        index = len(columns['travel_id'])
+        source_id, destination_id = self.intern(source), self.intern(destination)
+        columns['travel_id'].append(travel_id)
+        columns['travel_type'].append(TRAVEL_TYPES.index(travel_type))
+        columns['source'].append(source_id)
+        columns['destination'].append(destination_id)
+        columns['operator'].append(self.intern(operator))
+        columns['departure'].append(departure)
+        columns['arrival'].append(arrival)
+        columns['fare'].append(fare)
+        columns['available_seats'].append(seats)
+        self.by_source[source_id].append(index)
+        self.by_destination[destination_id].append(index)
+        self.cities.update((source_id, destination_id))
+        self.positions[travel_id] = index
+        return index
+
+    def _update(self, index, travel_type, source, destination, operator, departure, arrival, fare, seats):
+        """Update a row in place; False if it moved route or time and needs a new row"""
+        columns = self.columns
+        if (columns['departure'][index] != departure
+                or self.strings[columns['source'][index]] != source
+                or self.strings[columns['destination'][index]] != destination):
+            return False
+        columns['travel_type'][index] = TRAVEL_TYPES.index(travel_type)
+        columns['operator'][index] = self.intern(operator)
+        columns['arrival'][index] = arrival
+        columns['fare'][index] = fare
+        columns['available_seats'][index] = seats
+        return True
+
+    def _retire(self, travel_id):
+        """Leave a row behind as a sold-out tombstone; full reloads compact them away"""
+        index = self.positions.pop(travel_id, None)
+        if index is not None:
+            self.columns['available_seats'][index] = 0
+
+    def _fetch(self, queryset):
+        rows = with_current_fare(queryset).order_by().values_list(
+            'travel_id', 'travel_type', 'source', 'destination', 'operator',
+            'departure_datetime', 'arrival_datetime', 'fare', 'available_seats', 'updated_at',
+        )
+        for travel_id, travel_type, source, destination, operator, departure, arrival, fare, seats, updated_at \
+                in rows.iterator(chunk_size=5000):
+            yield (travel_id, travel_type, source, destination, operator,
+                   _epoch(departure), _epoch(arrival), int(fare * 100), seats), updated_at
+
+    def load(self):
+        """Rebuild from every upcoming departure"""
+        now = timezone.now()
+        fresh = DepartureSnapshot()
+        for values, _ in self._fetch(TravelOption.objects.filter(departure_datetime__gt=now)):
+            fresh._append(*values)
+        departures = fresh.columns['departure']
+        fresh.order = array('i', sorted(range(len(departures)), key=departures.__getitem__))
+        with self.lock:
+            for name in ('strings', 'string_ids', 'cities', 'columns', 'positions',
+                         'by_source', 'by_destination', 'order'):
+                setattr(self, name, getattr(fresh, name))
+            self.watermark = now
+            self.refreshed_at = self.loaded_at = time.monotonic()
+
+    def refresh(self):
+        """Apply rows changed since the last refresh, or reload when due"""
+        if self.watermark is None or time.monotonic() - self.loaded_at >= FULL_RELOAD_INTERVAL:
+            return self.load()
+        # updated_at is stamped before the row's transaction commits, so a row
+        # committed after the last refresh can be older than the watermark.
+        # Re-reading an overlap window catches it; re-applying a row is harmless.
+        changed = list(self._fetch(TravelOption.objects.filter(updated_at__gte=self.watermark - REFRESH_OVERLAP)))
+        with self.lock:
+            added = []
+            for values, updated_at in changed:
+                self.watermark = max(self.watermark, updated_at)
+                travel_id = values[0]
+                index = self.positions.get(travel_id)
+                if index is not None and self._update(index, *values[1:]):
+                    continue
+                self._retire(travel_id)
+                added.append(self._append(*values))
+            if added:
+                departures = self.columns['departure']
+                added.sort(key=departures.__getitem__)
+                self.order = array('i', heapq.merge(self.order, added, key=departures.__getitem__))
+            self.refreshed_at = time.monotonic()
+
+    def row(self, index):
+        return _row(self.columns, self.strings, index)
+
+    def upcoming_rows(self):
+        """Live upcoming rows as SnapshotDeparture tuples"""
+        now = int(time.time())
+        with self.lock:
+            departures = self.columns['departure']
+            return [self.row(index) for index in self.positions.values() if departures[index] > now]
+
+    def matching_cities(self, query):
+        """Interned ids of cities whose name contains the query"""
+        query = query.lower()
+        return [city for city in self.cities if query in self.strings[city].lower()]
+
+    def search(self, source='', destination='', travel_type='', start=None, end=None, sort='departure',
+               min_price=None, max_price=None, depart_after=None, depart_before=None):
+        """Rows matching the home page filters, ordered by departure, fare or duration"""
+        now = int(time.time())
+        start = max(_epoch(start), now + 1) if start else now + 1
+        end = _epoch(end) if end else None
+        with self.lock:
+            columns = self.columns
+            departures, seats, types = columns['departure'], columns['available_seats'], columns['travel_type']
+            if source or destination:
+                # Candidates from the posting lists of the narrower side
+                sides = []
+                if source:
+                    sides.append((self.matching_cities(source), self.by_source, columns['source']))
+                if destination:
+                    sides.append((self.matching_cities(destination), self.by_destination, columns['destination']))
+                sides.sort(key=lambda side: sum(len(side[1].get(city, ())) for city in side[0]))
+                (cities, postings, _), others = sides[0], sides[1:]
+                candidates = [index for city in cities for index in postings.get(city, ())]
+                for other_cities, _, column in others:
+                    wanted = set(other_cities)
+                    candidates = [index for index in candidates if column[index] in wanted]
+                candidates.sort(key=departures.__getitem__)
+            else:
+                candidates = self.order
+            first = bisect_left(candidates, start, key=departures.__getitem__)
+            last = bisect_left(candidates, end, key=departures.__getitem__) if end else len(candidates)
+            if travel_type in TRAVEL_TYPES:
+                code = TRAVEL_TYPES.index(travel_type)
+                indices = [index for index in candidates[first:last] if seats[index] > 0 and types[index] == code]
+            else:
+                indices = [index for index in candidates[first:last] if seats[index] > 0]
+
+            fares = columns['fare']
+            if min_price is not None:
+                lowest = math.ceil(min_price * 100)
+                indices = [index for index in indices if fares[index] >= lowest]
+            if max_price is not None:
+                highest = math.floor(max_price * 100)
+                indices = [index for index in indices if fares[index] <= highest]
+            if depart_after or depart_before:
+                indices = self._in_departure_window(indices, depart_after, depart_before)
+
+            # Candidates are in departure order and list.sort is stable, so
+            # ties on fare or duration stay chronological as in the ORM path
+            if sort == 'price':
+                indices.sort(key=fares.__getitem__)
+            elif sort == 'duration':
+                arrivals = columns['arrival']
+                indices.sort(key=lambda index: arrivals[index] - departures[index])
+        return SnapshotResults(columns, self.strings, indices)
+
+    def _in_departure_window(self, indices, depart_after, depart_before):
+        """Rows departing in a local time-of-day window; after > before wraps past midnight"""
+        tz = timezone.get_current_timezone()
+        offsets = {}  # UTC offsets only change on the hour
+        departures = self.columns['departure']
+        after = depart_after.hour * 3600 + depart_after.minute * 60 if depart_after else 0
+        before = depart_before.hour * 3600 + depart_before.minute * 60 if depart_before else 86400
+        wraps = after > before
+        kept = []
+        for index in indices:
+            departure = departures[index]
+            hour = departure // 3600
+            offset = offsets.get(hour)
+            if offset is None:
+                moment = datetime.fromtimestamp(hour * 3600, dt_timezone.utc)
+                offset = offsets[hour] = int(moment.astimezone(tz).utcoffset().total_seconds())
+            seconds = (departure + offset) % 86400
+            if (seconds >= after or seconds < before) if wraps else (after <= seconds < before):
+                kept.append(index)
+        return kept
+
+    def search_cities(self, query, limit=10):
+        """City names containing the query, alphabetically"""
+        with self.lock:
+            return sorted(self.strings[city] for city in self.matching_cities(query))[:limit]
+
+    def memory_usage(self):
+        """Approximate bytes held by the columns and indexes"""
+        import sys
+
+        total = sum(column.itemsize * len(column) for column in self.columns.values())
+        total += self.order.itemsize * len(self.order)
+        for postings in (self.by_source, self.by_destination):
+            total += sum(len(indices) * indices.itemsize for indices in postings.values())
+        total += sys.getsizeof(self.positions) + sum(sys.getsizeof(key) for key in self.positions)
+        total += sum(sys.getsizeof(value) for value in self.strings)
+        return total
+
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+
+
+def _refresh_snapshot():
+    with _snapshot_lock:
+        snapshot = _snapshot
+    if snapshot is not None:
+        snapshot.refresh()
+
+
+_refresher = Refresher('departure-snapshot', _refresh_snapshot, REFRESH_INTERVAL)
+
+
+def load_departure_snapshot():
+    """Load the process-wide snapshot now, in this thread"""
+    global _snapshot
+    with _snapshot_lock:
+        if _snapshot is None:
+            _snapshot = DepartureSnapshot()
+        snapshot = _snapshot
+    if snapshot.watermark is None:
+        snapshot.load()
+    return snapshot
+
+
+def get_departure_snapshot():
+    """Process-wide snapshot, or None when DEPARTURE_SNAPSHOT is off or it is still loading
+
+    Loads, refreshes and full reloads happen on a background thread, never in the request.
+    """
+    global _snapshot
+    if not getattr(settings, 'DEPARTURE_SNAPSHOT', False):
+        return None
+    with _snapshot_lock:
+        if _snapshot is None:
+            _snapshot = DepartureSnapshot()
+        snapshot = _snapshot
+    _refresher.start(run_now=snapshot.watermark is None)
+    return snapshot if snapshot.watermark is not None else None
+
+
+def reset_departure_snapshot():
+    """Forget the process-wide snapshot and stop refreshing it"""
+    global _snapshot
+    _refresher.stop()
+    with _snapshot_lock:
+        _snapshot = None
@@ -0,0 +1,110 @@
+"""
+Process start-up helpers for the production server.
+
+gunicorn.conf.py preloads the application in the master process and calls
+warm_up() there, so the URLconf, every view module, the modules the views
+import lazily and the compiled page templates are loaded once and shared
+copy-on-write by the forked workers instead of being rebuilt on each
+worker's first request.
+
+The in-memory caches are not loaded there. Workers are recycled every
+max_requests, and a worker forked hours after boot would inherit a copy
+as old as the master. Each worker calls start_caches() once it is up
+instead, which starts loading them in the background.
+
+time_first_request() is the child side of the profile_startup command. It
+must not import Django before it starts timing.
+"""
+import importlib
+import json
+import sys
+import time
+
+# Imported inside view functions to keep the first import of views light;
+# imported here before forking so the workers share them
+WARM_MODULES = [
+    'travel_booking.snapshot',
+    'travel_booking.routing',
+    'travel_booking.search_pool',
+    'travel_booking.reports',
+    'travel_booking.tickets',
+    'PIL.Image',
+    'PIL.ImageDraw',
+    'PIL.ImageFont',
+]
+
+# Compiled into the cached template loader before forking
+WARM_TEMPLATES = [
+    'travel_booking/home.html',
+    'travel_booking/travel_detail.html',
+    'travel_booking/book_travel.html',
+    'travel_booking/my_bookings.html',
+    'travel_booking/booking_detail.html',
+]
+
+
+def warm_up():
+    """Load the URLconf, the views and their lazy imports and the main templates"""
+    from django.template.loader import get_template
+    from django.urls import get_resolver
+
+    get_resolver().url_patterns
+    for name in WARM_MODULES:
+        importlib.import_module(name)
+    for name in WARM_TEMPLATES:
+        get_template(name)
+
+
+def start_caches():
+    """Start loading the enabled in-memory caches on their background threads; searches use the ORM until then"""
+    from .routing import get_route_planner
+    from .snapshot import get_departure_snapshot
+
+    get_departure_snapshot()
+    get_route_planner()
+
+
+def time_first_request(path='/', warm=False):
+    """Boot Django, serve `path` twice through the WSGI handler and print phase timings as JSON"""
+    started = time.perf_counter()
+    from django.conf import settings
+
+    settings.INSTALLED_APPS  # imports the settings module
+    settings_loaded = time.perf_counter()
+    from django.core.wsgi import get_wsgi_application
+
+    application = get_wsgi_application()  # django.setup() and the middleware chain
+    app_loaded = time.perf_counter()
+    if warm:
+        warm_up()
+    warmed = time.perf_counter()
+
+    def serve():
+        from wsgiref.util import setup_testing_defaults
+
+        path_info, _, query = path.partition('?')
+        environ = {'PATH_INFO': path_info, 'QUERY_STRING': query, 'HTTP_HOST': 'localhost'}
+        setup_testing_defaults(environ)
+        status = []
+        response = application(environ, lambda value, headers, exc_info=None: status.append(value))
+        try:
+            b''.join(response)
+        finally:
+            if hasattr(response, 'close'):
+                response.close()
+        return status[0]
+
+    status = serve()
+    first_served = time.perf_counter()
+    first_served_at = time.time()
+    serve()
+    second_served = time.perf_counter()
+    json.dump({
+        'status': status,
+        'settings': settings_loaded - started,
+        'setup': app_loaded - settings_loaded,
+        'warm_up': warmed - app_loaded,
+        'first_request': first_served - warmed,
+        'second_request': second_served - first_served,
+        'first_served_at': first_served_at,
+    }, sys.stdout)
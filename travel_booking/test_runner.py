@@ -0,0 +1,88 @@
+"""
+Test runner that reports how long each test class takes.
+
+Time is attributed from the end of the previous test to the end of the
+current one, so a class's setUpClass/setUpTestData cost is counted against
+it. With --parallel, workers measure their own tests and send the timings to
+the parent process as an extra result event.
+"""
+import time
+import unittest
+from collections import defaultdict
+
+from django.test.runner import (
+    DiscoverRunner, ParallelTestSuite, RemoteTestResult, RemoteTestRunner,
+)
+
+SLOWEST_CLASSES_SHOWN = 10
+
+
+def _class_label(test):
+    return f'{test.__class__.__module__}.{test.__class__.__qualname__}'
+
+
+class TimedRemoteTestResult(RemoteTestResult):
+    """Worker-side result that ships per-test durations to the parent"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._last_stop = time.perf_counter()
+
+    def stopTest(self, test):
+        now = time.perf_counter()
+        self.events.append(('addTestDuration', self.test_index, now - self._last_stop))
+        self._last_stop = now
+        super().stopTest(test)
+
+
+class TimedRemoteTestRunner(RemoteTestRunner):
+    resultclass = TimedRemoteTestResult
+
+
+class TimedParallelTestSuite(ParallelTestSuite):
+    runner_class = TimedRemoteTestRunner
+
+
+class TimedTextTestResult(unittest.TextTestResult):
+    """Accumulates wall-clock time and test counts per test class"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.class_durations = defaultdict(float)
+        self.class_test_counts = defaultdict(int)
+        self._last_stop = time.perf_counter()
+        self._remote_duration = False
+
+    def addTestDuration(self, test, elapsed):
+        """Replayed from parallel workers, before the matching stopTest"""
+        self.class_durations[_class_label(test)] += elapsed
+        self._remote_duration = True
+
+    def stopTest(self, test):
+        now = time.perf_counter()
+        if not self._remote_duration:
+            self.class_durations[_class_label(test)] += now - self._last_stop
+        self._remote_duration = False
+        self._last_stop = now
+        self.class_test_counts[_class_label(test)] += 1
+        super().stopTest(test)
+
+
+class TimedTestRunner(DiscoverRunner):
+    """DiscoverRunner that prints the slowest test classes after the run"""
+    parallel_test_suite = TimedParallelTestSuite
+
+    def get_resultclass(self):
+        return super().get_resultclass() or TimedTextTestResult
+
+    def run_suite(self, suite, **kwargs):
+        result = super().run_suite(suite, **kwargs)
+        if hasattr(result, 'class_durations') and self.verbosity > 0:
+            self.report_durations(result)
+        return result
+
+    def report_durations(self, result):
+        ranked = sorted(result.class_durations.items(), key=lambda item: item[1], reverse=True)
+        self.log(f'\nSlowest test classes (total {sum(result.class_durations.values()):.3f}s):')
+        for label, seconds in ranked[:SLOWEST_CLASSES_SHOWN]:
+            self.log(f'{seconds:8.3f}s  {result.class_test_counts[label]:3d} tests  {label}')
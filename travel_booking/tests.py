@@ -1,17 +1,53 @@
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase, LiveServerTestCase, Client, RequestFactory, override_settings
+from django.contrib import admin
+from django.db import connection, transaction, IntegrityError
+from django.core import mail
+from django.conf import settings
+from django.core.cache import cache
+import threading
+import time
+from django.core.management import call_command, CommandError
 from django.contrib.auth.models import User
 from django.urls import reverse
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
-from datetime import timedelta
+from datetime import datetime, timedelta, timezone as dt_timezone
+from zoneinfo import ZoneInfo
+from io import StringIO
+from pathlib import Path
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+import json
+import shutil
+import tempfile
 from decimal import Decimal
 
-from .models import UserProfile, TravelOption, Booking
+from .models import (
+    UserProfile, TravelOption, Booking, PriceTier, ArchivedTravelOption, ArchivedBooking,
+    BookingEvent, EventCheckpoint, BookingRequest, WaitlistEntry, RouteActivity, TrendingRoute,
+)
+from .waitlist import promote_waitlist
+from .admin import TravelOptionAdmin
+from .pricing import rebuild_price_tiers, tiers_for
+from .popularity import (
+    SpaceSaving, SearchTracker, hour_bucket, roll_up_booking_events, refresh_popularity, prune_route_activity,
+)
+from .events import GAP_TIMEOUT, BookingEventConsumer
+from .routing import RoutePlanner, load_route_planner, reset_route_planner
+from .search_pool import CatalogueColumns, SearchWorkerPool, PooledSearchResults
+from .search import search_travel_options, format_durations, local_day_range, offset_periods, parse_time
+from .snapshot import DepartureSnapshot, load_departure_snapshot, reset_departure_snapshot
+from . import qr, tickets
+from .timezones import SESSION_KEY as TIME_ZONE_SESSION_KEY
+from .traffic import REPLAY_HEADER, Replayer
+from .query_plans import SMALL_TABLES, VIEW_PLAN_CHECKS, capture_selects, explain, parse_mysql_plan
 
 # Create your tests here.
 
 class UserProfileModelTest(TestCase):
-    def setUp(self):
-        self.user = User.objects.create_user(
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
             username='testuser',
             email='test@example.com',
             password='testpass123'
@@ -28,16 +64,17 @@ class UserProfileModelTest(TestCase):
         self.assertEqual(profile.user, self.user)
 
 class TravelOptionModelTest(TestCase):
-    def setUp(self):
-        self.departure_time = timezone.now() + timedelta(hours=24)
-        self.arrival_time = self.departure_time + timedelta(hours=2)
+    @classmethod
+    def setUpTestData(cls):
+        cls.departure_time = timezone.now() + timedelta(hours=24)
+        cls.arrival_time = cls.departure_time + timedelta(hours=2)
         
-        self.travel_option = TravelOption.objects.create(
+        cls.travel_option = TravelOption.objects.create(
             travel_type='flight',
             source='Delhi',
             destination='Mumbai',
-            departure_datetime=self.departure_time,
-            arrival_datetime=self.arrival_time,
+            departure_datetime=cls.departure_time,
+            arrival_datetime=cls.arrival_time,
             price=Decimal('5000.00'),
             available_seats=100,
             total_seats=100,
@@ -67,8 +104,9 @@ class TravelOptionModelTest(TestCase):
         self.assertFalse(self.travel_option.is_available)
 
 class BookingModelTest(TestCase):
-    def setUp(self):
-        self.user = User.objects.create_user(
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
             username='testuser',
             password='testpass123'
         )
@@ -76,7 +114,7 @@ class BookingModelTest(TestCase):
         departure_time = timezone.now() + timedelta(hours=24)
         arrival_time = departure_time + timedelta(hours=2)
         
-        self.travel_option = TravelOption.objects.create(
+        cls.travel_option = TravelOption.objects.create(
             travel_type='flight',
             source='Delhi',
             destination='Mumbai',
@@ -137,18 +175,19 @@ class BookingModelTest(TestCase):
         self.assertFalse(past_booking.can_cancel)
 
 class ViewsTestCase(TestCase):
-    def setUp(self):
-        self.user = User.objects.create_user(
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
             username='testuser',
             email='test@example.com',
             password='testpass123'
         )
-        UserProfile.objects.create(user=self.user)
+        UserProfile.objects.create(user=cls.user)
         
         departure_time = timezone.now() + timedelta(hours=24)
         arrival_time = departure_time + timedelta(hours=2)
         
-        self.travel_option = TravelOption.objects.create(
+        cls.travel_option = TravelOption.objects.create(
             travel_type='flight',
             source='Delhi',
             destination='Mumbai',
@@ -219,7 +258,8 @@ class ViewsTestCase(TestCase):
         response = self.client.post(
             reverse('book_travel', kwargs={'travel_id': self.travel_option.travel_id}), {
                 'number_of_seats': 2,
-                'passenger_names': 'John Doe\nJane Doe'
+                'passenger_names': 'John Doe\nJane Doe',
+                'terms': 'on'
             }
         )
         self.assertEqual(response.status_code, 302)  # Redirect after successful booking
@@ -254,6 +294,8 @@ class ViewsTestCase(TestCase):
             travel_option=self.travel_option,
             number_of_seats=2,
         )
+        self.travel_option.available_seats -= 2
+        self.travel_option.save()
         
         # Test GET request (confirmation page)
         response = self.client.get(
@@ -263,7 +305,8 @@ class ViewsTestCase(TestCase):
         
         # Test POST request (actual cancellation)
         response = self.client.post(
-            reverse('cancel_booking', kwargs={'booking_id': booking.booking_id})
+            reverse('cancel_booking', kwargs={'booking_id': booking.booking_id}),
+            {'confirm_cancel': 'yes'}
         )
         self.assertEqual(response.status_code, 302)  # Redirect
         
@@ -272,4 +315,1667 @@ class ViewsTestCase(TestCase):
         self.assertEqual(booking.status, 'cancelled')
         
         self.travel_option.refresh_from_db()
-        self.assertEqual(self.travel_option.available_seats, 100)  # Seats restored
\ No newline at end of file
+        self.assertEqual(self.travel_option.available_seats, 100)  # Seats restored
+
+class TravelDetailCachingTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='testuser',
+            password='testpass123'
+        )
+
+        departure_time = timezone.now() + timedelta(hours=24)
+        cls.travel_option = TravelOption.objects.create(
+            travel_type='train',
+            source='Delhi',
+            destination='Jaipur',
+            departure_datetime=departure_time,
+            arrival_datetime=departure_time + timedelta(hours=5),
+            price=Decimal('800.00'),
+            available_seats=50,
+            total_seats=50,
+            operator='Test Rail'
+        )
+        cls.url = reverse('travel_detail', kwargs={'travel_id': cls.travel_option.travel_id})
+
+    def test_conditional_get_returns_not_modified(self):
+        """Test that a matching ETag short-circuits to 304"""
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('ETag', response)
+        self.assertIn('Last-Modified', response)
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertIn('public', response['Cache-Control'])
+
+    def test_cache_control_depends_on_user(self):
+        """Test public caching for anonymous and private caching for users"""
+        anonymous_response = self.client.get(self.url)
+        self.assertIn('public', anonymous_response['Cache-Control'])
+
+        self.client.login(username='testuser', password='testpass123')
+        response = self.client.get(self.url)
+        self.assertIn('private', response['Cache-Control'])
+        self.assertNotEqual(response['ETag'], anonymous_response['ETag'])
+
+    def test_time_zone_change_invalidates_page(self):
+        """Test that a page rendered in one time zone is not revalidated in another"""
+        self.client.login(username='testuser', password='testpass123')
+        response = self.client.get(self.url)
+        session = self.client.session
+        session[TIME_ZONE_SESSION_KEY] = 'America/New_York'
+        session.save()
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('America/New_York', response['ETag'])
+
+    def test_seat_change_invalidates_cached_page(self):
+        """Test that the cached page is not served after seats change"""
+        response = self.client.get(self.url)
+        self.assertContains(response, '>50<')
+
+        self.travel_option.available_seats = 48
+        self.travel_option.save()
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '>48<')
+
+
+class ArchiveDeparturesCommandTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='testuser',
+            password='testpass123'
+        )
+
+        departed = timezone.now() - timedelta(days=60)
+        cls.old_option = TravelOption.objects.create(
+            travel_type='bus',
+            source='Delhi',
+            destination='Agra',
+            departure_datetime=departed,
+            arrival_datetime=departed + timedelta(hours=4),
+            price=Decimal('500.00'),
+            available_seats=38,
+            total_seats=40,
+            operator='Test Bus'
+        )
+        cls.old_booking = Booking.objects.create(
+            user=cls.user,
+            travel_option=cls.old_option,
+            number_of_seats=2,
+            passenger_details=['John Doe', 'Jane Doe']
+        )
+
+        upcoming = timezone.now() + timedelta(days=2)
+        cls.new_option = TravelOption.objects.create(
+            travel_type='bus',
+            source='Delhi',
+            destination='Agra',
+            departure_datetime=upcoming,
+            arrival_datetime=upcoming + timedelta(hours=4),
+            price=Decimal('500.00'),
+            available_seats=40,
+            total_seats=40,
+            operator='Test Bus'
+        )
+
+    def test_archives_only_old_departures(self):
+        """Test that departures past the retention window move to the archive"""
+        call_command('archive_departures', days=30, batch_size=1, stdout=StringIO())
+
+        self.assertFalse(TravelOption.objects.filter(travel_id=self.old_option.travel_id).exists())
+        self.assertFalse(Booking.objects.filter(booking_id=self.old_booking.booking_id).exists())
+        self.assertTrue(TravelOption.objects.filter(travel_id=self.new_option.travel_id).exists())
+
+        archived = ArchivedBooking.objects.get(booking_id=self.old_booking.booking_id)
+        self.assertEqual(archived.travel_option.travel_id, self.old_option.travel_id)
+        self.assertEqual(archived.total_price, Decimal('1000.00'))
+        self.assertEqual(archived.passenger_details, ['John Doe', 'Jane Doe'])
+
+    def test_dry_run_keeps_rows(self):
+        """Test that a dry run does not move anything"""
+        call_command('archive_departures', days=30, dry_run=True, stdout=StringIO())
+        self.assertTrue(TravelOption.objects.filter(travel_id=self.old_option.travel_id).exists())
+        self.assertFalse(ArchivedTravelOption.objects.exists())
+
+    def test_booking_detail_reads_archive(self):
+        """Test that booking_detail keeps working for archived bookings"""
+        call_command('archive_departures', days=30, stdout=StringIO())
+        self.client.login(username='testuser', password='testpass123')
+        response = self.client.get(
+            reverse('booking_detail', kwargs={'booking_id': self.old_booking.booking_id})
+        )
+        self.assertContains(response, 'Delhi → Agra')
+        self.assertContains(response, 'Archived')
+        self.assertNotContains(response, 'Cancel Booking')
+
+
+class SeedTravelDataCommandTest(TestCase):
+    def test_seeded_seats_match_bookings(self):
+        """Test that seeded seat counts agree with seeded confirmed bookings"""
+        call_command('seed_travel_data', travel_options=50, users=5, bookings=200, stdout=StringIO())
+
+        self.assertEqual(TravelOption.objects.count(), 50)
+        self.assertEqual(User.objects.count(), 5)
+        self.assertEqual(Booking.objects.count(), 200)
+        option = TravelOption.objects.first()
+        self.assertEqual(sorted(option.price_tiers.values_list('max_available_seats', 'price')),
+                         sorted(tiers_for(option)))
+        self.assertTrue(User.objects.first().check_password('travel12345'))
+        for option in TravelOption.objects.all():
+            booked = sum(
+                option.bookings.filter(status='confirmed').values_list('number_of_seats', flat=True)
+            )
+            self.assertEqual(option.available_seats, option.total_seats - booked)
+
+    def test_same_seed_generates_same_data(self):
+        """Test that generation is deterministic for a given seed"""
+        fields = ('source', 'destination', 'travel_type', 'price', 'total_seats', 'operator')
+        call_command('seed_travel_data', travel_options=20, users=0, bookings=0, seed=7, stdout=StringIO())
+        first = list(TravelOption.objects.order_by('travel_id').values_list(*fields))
+        TravelOption.objects.all().delete()
+        call_command('seed_travel_data', travel_options=20, users=0, bookings=0, seed=7, stdout=StringIO())
+        second = list(TravelOption.objects.order_by('travel_id').values_list(*fields))
+        self.assertEqual(first, second)
+
+
+class SeedIndexRebuildTest(TransactionTestCase):
+    def test_indexes_rebuilt_after_large_load(self):
+        """Test that a load into an empty table drops its indexes and rebuilds them at the end"""
+        out = StringIO()
+        call_command('seed_travel_data', travel_options=30, users=3, bookings=40, verbosity=2, stdout=out)
+        self.assertIn('travel options: rebuilding indexes', out.getvalue())
+        self.assertIn('bookings: rebuilding indexes', out.getvalue())
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, TravelOption._meta.db_table)
+        self.assertLessEqual({index.name for index in TravelOption._meta.indexes}, set(constraints))
+
+
+class DynamicPricingTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='testuser',
+            password='testpass123'
+        )
+
+        departure_time = timezone.now() + timedelta(hours=24)
+        cls.travel_option = TravelOption.objects.create(
+            travel_type='flight',
+            source='Delhi',
+            destination='Goa',
+            departure_datetime=departure_time,
+            arrival_datetime=departure_time + timedelta(hours=2, minutes=30),
+            price=Decimal('4000.00'),
+            available_seats=100,
+            total_seats=100,
+            operator='Test Airlines'
+        )
+
+    def test_tiers_precomputed_on_create(self):
+        """Test that price tiers are built when a travel option is created"""
+        tiers = list(self.travel_option.price_tiers.order_by('-max_available_seats')
+                     .values_list('max_available_seats', 'price'))
+        self.assertEqual(tiers, [
+            (100, Decimal('4000.00')),
+            (50, Decimal('4400.00')),
+            (25, Decimal('5000.00')),
+            (10, Decimal('6000.00')),
+        ])
+
+    def test_rebuild_touches_departures(self):
+        """Test that rebuilding tiers bumps updated_at so fare caches refresh"""
+        before = self.travel_option.updated_at
+        TravelOption.objects.filter(pk=self.travel_option.pk).update(price=Decimal('5000.00'))
+        self.assertEqual(rebuild_price_tiers(TravelOption.objects.filter(pk=self.travel_option.pk)), 1)
+        self.travel_option.refresh_from_db()
+        self.assertGreater(self.travel_option.updated_at, before)
+        self.assertEqual(self.travel_option.current_fare(), Decimal('5000.00'))
+
+    def test_fare_rises_with_load(self):
+        """Test that the current fare follows availability"""
+        self.assertEqual(self.travel_option.current_fare(), Decimal('4000.00'))
+        self.travel_option.available_seats = 50
+        self.assertEqual(self.travel_option.current_fare(), Decimal('4400.00'))
+        self.travel_option.available_seats = 5
+        self.assertEqual(self.travel_option.current_fare(), Decimal('6000.00'))
+
+    def test_search_resolves_fare(self):
+        """Test that the home page shows the fare annotated by the search query"""
+        TravelOption.objects.filter(pk=self.travel_option.pk).update(available_seats=20)
+        response = self.client.get(reverse('home'), {'source': 'Delhi'})
+        self.assertEqual(response.context['travel_options'][0].fare, Decimal('5000.00'))
+        self.assertContains(response, '₹5000.00')
+
+    def test_booking_locks_current_fare(self):
+        """Test that a booking is charged the fare seen under the seat lock"""
+        TravelOption.objects.filter(pk=self.travel_option.pk).update(available_seats=12)
+        self.client.login(username='testuser', password='testpass123')
+        self.client.post(
+            reverse('book_travel', kwargs={'travel_id': self.travel_option.travel_id}), {
+                'number_of_seats': 2,
+                'passenger_names': 'John Doe\nJane Doe',
+                'terms': 'on'
+            }
+        )
+        booking = Booking.objects.get(user=self.user)
+        self.assertEqual(booking.total_price, Decimal('10000.00'))  # 2 * 5000
+
+
+class RoutePlannerTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        base = timezone.now() + timedelta(days=1)
+
+        def leg(source, destination, depart_hours, duration_hours, price):
+            departure = base + timedelta(hours=depart_hours)
+            return TravelOption.objects.create(
+                travel_type='train',
+                source=source,
+                destination=destination,
+                departure_datetime=departure,
+                arrival_datetime=departure + timedelta(hours=duration_hours),
+                price=Decimal(price),
+                available_seats=50,
+                total_seats=50,
+                operator='Test Rail'
+            )
+
+        cls.delhi_jaipur = leg('Delhi', 'Jaipur', 0, 4, '500.00')
+        cls.jaipur_udaipur = leg('Jaipur', 'Udaipur', 5, 6, '400.00')
+        cls.jaipur_udaipur_tight = leg('Jaipur', 'Udaipur', 4.25, 6, '300.00')  # 15 min layover
+        cls.delhi_agra = leg('Delhi', 'Agra', 0, 1.5, '200.00')
+        cls.agra_jaipur = leg('Agra', 'Jaipur', 2.25, 1.75, '100.00')
+        cls.departure_from = base - timedelta(hours=1)
+
+    def setUp(self):
+        reset_route_planner()
+
+    def tearDown(self):
+        reset_route_planner()
+
+    def test_one_stop_respects_min_layover(self):
+        """Test that connections need at least the minimum layover"""
+        planner = RoutePlanner()
+        planner.refresh()
+        itineraries = planner.search('delhi', 'udaipur', self.departure_from, max_stops=1)
+        self.assertEqual(len(itineraries), 1)
+        self.assertEqual(
+            [leg.travel_id for leg in itineraries[0].legs],
+            [self.delhi_jaipur.travel_id, self.jaipur_udaipur.travel_id]
+        )
+
+    def test_two_stop_and_price_sort(self):
+        """Test that 2-stop itineraries are found and ranked by price"""
+        planner = RoutePlanner()
+        planner.refresh()
+        itineraries = planner.search('Delhi', 'Udaipur', self.departure_from, sort='price')
+        self.assertEqual(itineraries[0].total_price, Decimal('700.00'))  # via Agra and Jaipur
+        self.assertEqual(itineraries[0].stops, 2)
+        prices = [itinerary.total_price for itinerary in itineraries]
+        self.assertEqual(prices, sorted(prices))
+
+    def test_incremental_refresh_drops_sold_out_legs(self):
+        """Test that a refresh picks up seat changes"""
+        planner = RoutePlanner()
+        planner.refresh()
+        self.jaipur_udaipur.available_seats = 0
+        self.jaipur_udaipur.save()
+        planner.refresh()
+        self.assertEqual(planner.search('Delhi', 'Udaipur', self.departure_from, max_stops=1), [])
+
+    def test_refresh_rereads_rows_committed_behind_the_watermark(self):
+        """Test that a change stamped before the last refresh is still picked up"""
+        planner = RoutePlanner()
+        planner.refresh()
+        planner.refresh()
+        TravelOption.objects.filter(pk=self.jaipur_udaipur.pk).update(
+            available_seats=0, updated_at=planner.watermark - timedelta(seconds=10)
+        )
+        planner.refresh()
+        self.assertNotIn(self.jaipur_udaipur.travel_id, planner.legs)
+
+    def test_cities_match_by_substring(self):
+        """Test that cities match the way the home page's icontains search does"""
+        planner = RoutePlanner()
+        planner.refresh()
+        itineraries = planner.search('elh', ' UDAI', self.departure_from, max_stops=1)
+        self.assertEqual(len(itineraries), 1)
+
+    @override_settings(ROUTE_PLANNER=True)
+    def test_home_offers_connections(self):
+        """Test that the home page suggests connections when there is no direct service"""
+        load_route_planner()
+        response = self.client.get(reverse('home'), {'source': 'Delhi', 'destination': 'Udaipur'})
+        self.assertContains(response, 'Connecting Journeys')
+        self.assertContains(response, 'Delhi → Jaipur → Udaipur')
+
+    def test_planner_off_by_default(self):
+        """Test that no connections are searched unless ROUTE_PLANNER is on"""
+        response = self.client.get(reverse('home'), {'source': 'Delhi', 'destination': 'Udaipur'})
+        self.assertNotContains(response, 'Connecting Journeys')
+
+
+class SearchWorkerPoolTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.pool = SearchWorkerPool(2)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.pool.close()
+        super().tearDownClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        base = timezone.now() + timedelta(days=2)
+        cls.options = [
+            TravelOption.objects.create(
+                travel_type=travel_type,
+                source=source,
+                destination='Mumbai',
+                departure_datetime=base + timedelta(hours=hours),
+                arrival_datetime=base + timedelta(hours=hours + 2),
+                price=Decimal(price),
+                available_seats=seats,
+                total_seats=50,
+                operator='Pool Lines'
+            )
+            for source, travel_type, hours, price, seats in [
+                ('Delhi', 'flight', 3, '4000.00', 50),
+                ('Delhi', 'train', 1, '900.00', 50),
+                ('New Delhi', 'bus', 2, '500.00', 2),  # nearly full: 750.00
+                ('Pune', 'bus', 0, '300.00', 50),
+            ]
+        ]
+
+    def test_sharded_search_matches_filters(self):
+        """Test that fanned-out searches merge in sort order across shards"""
+        self.pool.publish(CatalogueColumns.from_database())
+        delhi = [option.travel_id for option in self.options[:3]]
+        total, by_departure = self.pool.search(source='delhi')
+        self.assertEqual(total, 3)
+        self.assertEqual(by_departure, [delhi[1], delhi[2], delhi[0]])
+        _, by_price = self.pool.search(source='delhi', sort='price', limit=2)
+        self.assertEqual(by_price, [delhi[2], delhi[1]])
+        self.assertEqual(self.pool.search(source='delhi', seats=3)[0], 2)
+        self.assertEqual(self.pool.search(source='delhi', travel_type='flight')[1], [delhi[0]])
+        self.assertEqual(self.pool.search(source='Dehli')[0], 0)  # substrings only, like icontains
+        self.assertEqual(self.pool.search(source=' NEW ')[1], [delhi[2]])
+
+    def test_broken_executor_releases_shared_memory(self):
+        """Test that a pool whose workers died unlinks its shared memory"""
+        class BrokenExecutor:
+            def submit(self, *args):
+                raise BrokenProcessPool('worker died')
+
+            def shutdown(self):
+                pass
+
+        pool = SearchWorkerPool(1)
+        pool.executor.shutdown()
+        pool.executor = BrokenExecutor()
+        pool.publish(CatalogueColumns.from_database())
+        names = [name for name, _, _ in pool.current.spec['columns'].values()]
+        with self.assertRaises(BrokenProcessPool):
+            pool.search(source='delhi')
+        self.assertTrue(pool.broken)
+        for name in names:
+            with self.assertRaises(FileNotFoundError):
+                shared_memory.SharedMemory(name=name)
+
+    def test_results_are_paginated_model_instances(self):
+        """Test that pooled results load the page's travel options with fares"""
+        self.pool.publish(CatalogueColumns.from_database())
+        results = PooledSearchResults(self.pool, source='', destination='mumbai')
+        self.assertEqual(results.count(), 4)
+        page = results[1:3]
+        self.assertEqual([option.travel_id for option in page],
+                         [self.options[1].travel_id, self.options[2].travel_id])
+        self.assertEqual(page[0].fare, Decimal('900.00'))
+
+    def test_first_page_comes_with_the_count(self):
+        """Test that counting and loading the first page fan out once"""
+        self.pool.publish(CatalogueColumns.from_database())
+        limits = []
+
+        class CountingPool:
+            def search(pool, limit, **search):
+                limits.append(limit)
+                return self.pool.search(limit=limit, **search)
+
+        results = PooledSearchResults(CountingPool(), prefetch=2, source='', destination='mumbai')
+        self.assertEqual(results.count(), 4)
+        self.assertEqual(len(results[0:2]), 2)
+        self.assertEqual(limits, [2])
+        self.assertEqual(len(results[2:4]), 2)
+        self.assertEqual(limits, [2, 4])
+
+    def test_replaced_generation_outlives_its_searches(self):
+        """Test that a republish keeps the old blocks until searches on them finish"""
+        self.pool.publish(CatalogueColumns.from_database())
+        shared = self.pool._acquire()
+        names = [name for name, _, _ in shared.spec['columns'].values()]
+        self.pool.publish(CatalogueColumns.from_database())
+        self.pool.publish(CatalogueColumns.from_database())
+        total, _ = self.pool._search(shared, '', 'mumbai', None, None, 1, '', 'departure', 10)
+        self.assertEqual(total, 4)
+        self.pool._release(shared)
+        for name in names:
+            with self.assertRaises(FileNotFoundError):
+                shared_memory.SharedMemory(name=name)
+
+
+class DepartureSnapshotTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        base = timezone.now() + timedelta(days=3)
+
+        def option(travel_type, source, destination, hours, seats=40):
+            return TravelOption.objects.create(
+                travel_type=travel_type,
+                source=source,
+                destination=destination,
+                departure_datetime=base + timedelta(hours=hours),
+                arrival_datetime=base + timedelta(hours=hours + 3),
+                price=Decimal('1000.00'),
+                available_seats=seats,
+                total_seats=40,
+                operator='Snapshot Travels'
+            )
+
+        cls.delhi_goa = option('flight', 'Delhi', 'Goa', 5)
+        cls.delhi_pune = option('train', 'Delhi', 'Pune', 1)
+        cls.pune_goa = option('bus', 'Pune', 'Goa', 3)
+        cls.sold_out = option('bus', 'Delhi', 'Goa', 2, seats=1)
+        cls.sold_out.available_seats = 0
+        cls.sold_out.save()
+        cls.departed = option('bus', 'Delhi', 'Goa', -100)
+
+    def setUp(self):
+        reset_departure_snapshot()
+
+    def tearDown(self):
+        reset_departure_snapshot()
+
+    def test_search_matches_orm(self):
+        """Test that snapshot searches return what the ORM query returns"""
+        snapshot = DepartureSnapshot()
+        snapshot.load()
+        date = self.delhi_goa.departure_datetime.astimezone(timezone.get_current_timezone()).date()
+        for source, destination, travel_type, start_end in [
+            ('', '', '', None), ('del', '', '', None), ('', 'goa', 'bus', None), ('delhi', 'GOA', '', None),
+            ('', '', '', (timezone.make_aware(timezone.datetime.combine(date, timezone.datetime.min.time())),
+                          None)),
+        ]:
+            start, end = start_end or (None, None)
+            rows = snapshot.search(source, destination, travel_type, start, end)
+            expected = search_travel_options(source, destination, travel_type)
+            if start:
+                expected = expected.filter(departure_datetime__gte=start)
+            self.assertEqual([row.travel_id for row in rows[:10]],
+                             [option.travel_id for option in expected], (source, destination, travel_type))
+            self.assertEqual(rows.count(), expected.count())
+
+    def test_results_survive_a_full_reload(self):
+        """Test that a page sliced after a full reload still reads the rows the search found"""
+        snapshot = DepartureSnapshot()
+        snapshot.load()
+        rows = snapshot.search('delhi', 'goa')
+        TravelOption.objects.filter(pk=self.delhi_pune.pk).delete()
+        snapshot.load()  # fewer rows, so the old indices point elsewhere or past the end
+        self.assertEqual([row.travel_id for row in rows[:10]], [self.delhi_goa.travel_id])
+
+    def test_incremental_refresh(self):
+        """Test that seat, schedule and new-row changes are applied from updated_at"""
+        snapshot = DepartureSnapshot()
+        snapshot.load()
+        self.delhi_goa.available_seats = 0
+        self.delhi_goa.save()
+        self.pune_goa.departure_datetime -= timedelta(hours=3)
+        self.pune_goa.arrival_datetime -= timedelta(hours=3)
+        self.pune_goa.save()
+        self.sold_out.available_seats = 1
+        self.sold_out.save()
+        snapshot.refresh()
+        self.assertEqual([row.travel_id for row in snapshot.search()[:10]],
+                         [self.pune_goa.travel_id, self.delhi_pune.travel_id, self.sold_out.travel_id])
+        self.assertEqual(snapshot.search('delhi', 'goa')[0].fare, self.sold_out.current_fare())
+
+    def test_refresh_rereads_rows_committed_behind_the_watermark(self):
+        """Test that a change stamped before the last refresh is still applied"""
+        snapshot = DepartureSnapshot()
+        snapshot.load()
+        snapshot.refresh()
+        TravelOption.objects.filter(pk=self.delhi_goa.pk).update(
+            available_seats=0, updated_at=snapshot.watermark - timedelta(seconds=10)
+        )
+        snapshot.refresh()
+        self.assertNotIn(self.delhi_goa.travel_id, [row.travel_id for row in snapshot.search('delhi', 'goa')[:10]])
+
+    def test_rows_carry_fares_in_paise_and_rupees(self):
+        """Test that the paise column is only exposed under its own name"""
+        snapshot = DepartureSnapshot()
+        snapshot.load()
+        row = snapshot.search('delhi', 'pune')[0]
+        self.assertEqual(row.fare, self.delhi_pune.current_fare())
+        self.assertEqual(row.fare_paise, int(row.fare * 100))
+        self.assertFalse(hasattr(row, 'price'))
+
+    @override_settings(DEPARTURE_SNAPSHOT=True)
+    def test_views_served_from_snapshot(self):
+        """Test that the home page and city autocomplete read from the snapshot"""
+        load_departure_snapshot()  # as gunicorn does before forking
+        with self.assertNumQueries(1):  # the trending routes
+            response = self.client.get(reverse('home'), {'source': 'Delhi'})
+        self.assertContains(response, 'Delhi → Pune')
+        self.assertContains(response, '3h 0m')
+        self.assertEqual(response.context['page_obj'].paginator.count, 2)
+        with self.assertNumQueries(1):  # the city ranking
+            response = self.client.get(reverse('search_cities'), {'q': 'oa'})
+        self.assertEqual(response.json(), ['Goa'])
+
+
+class SearchSortFilterTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        tz = timezone.get_current_timezone()
+        day = (timezone.now() + timedelta(days=5)).astimezone(tz).replace(hour=0, minute=0, second=0, microsecond=0)
+
+        def option(hour, hours_long, price):
+            return TravelOption.objects.create(
+                travel_type='train',
+                source='Chennai',
+                destination='Bengaluru',
+                departure_datetime=day + timedelta(hours=hour),
+                arrival_datetime=day + timedelta(hours=hour + hours_long),
+                price=Decimal(price),
+                available_seats=60,
+                total_seats=60,
+                operator='Sort Rail'
+            )
+
+        cls.night = option(23, 5.5, '700.00')
+        cls.morning = option(7, 6, '450.00')
+        cls.early = option(2, 7.25, '300.00')
+        cls.noon = option(12, 4.75, '900.00')
+
+    def setUp(self):
+        reset_departure_snapshot()
+
+    def ids(self, results):
+        return [option.travel_id for option in results[:10]]
+
+    def test_duration_stored_on_save(self):
+        """Test that duration_minutes is kept in sync with the schedule"""
+        self.assertEqual(self.early.duration_minutes, 435)
+        self.noon.arrival_datetime += timedelta(minutes=30)
+        self.noon.save()
+        self.noon.refresh_from_db()
+        self.assertEqual(self.noon.duration_minutes, 315)
+
+    def test_sorts_and_filters(self):
+        """Test price/duration sorts, price range and time window, from the ORM and the snapshot"""
+        snapshot = DepartureSnapshot()
+        snapshot.load()
+        cases = [
+            ({'sort': 'price'}, [self.early, self.morning, self.night, self.noon]),
+            ({'sort': 'duration'}, [self.noon, self.night, self.morning, self.early]),
+            ({'min_price': Decimal('400'), 'max_price': Decimal('700')}, [self.morning, self.night]),
+            ({'depart_after': timezone.datetime.strptime('06:00', '%H:%M').time(),
+              'depart_before': timezone.datetime.strptime('13:00', '%H:%M').time()}, [self.morning, self.noon]),
+            ({'depart_after': timezone.datetime.strptime('22:00', '%H:%M').time(),
+              'depart_before': timezone.datetime.strptime('06:00', '%H:%M').time(), 'sort': 'price'},
+             [self.early, self.night]),
+        ]
+        for params, expected in cases:
+            expected = [option.travel_id for option in expected]
+            self.assertEqual(self.ids(search_travel_options('chennai', **params)), expected, params)
+            self.assertEqual(self.ids(snapshot.search('chennai', **params)), expected, params)
+
+    def test_home_sorting_and_duration_labels(self):
+        """Test that the home page applies the sort and shows batch-formatted durations"""
+        response = self.client.get(reverse('home'), {'source': 'Chennai', 'sort': 'duration', 'max_price': 'abc'})
+        self.assertEqual([option.travel_id for option in response.context['page_obj']],
+                         [self.noon.travel_id, self.night.travel_id, self.morning.travel_id, self.early.travel_id])
+        self.assertEqual([label for _, label in response.context['result_rows']], ['4h 45m', '5h 30m', '6h 0m', '7h 15m'])
+        self.assertContains(response, '<option value="duration" selected>')
+        self.assertEqual(format_durations([self.early]), [(self.early, '7h 15m')])
+
+    def test_time_window_across_a_dst_change(self):
+        """Test that the stored UTC minute follows the zone's offset on both sides of a DST change"""
+        london = ZoneInfo('Europe/London')
+        options = [
+            TravelOption.objects.create(
+                travel_type='bus', source='Leeds', destination='York',
+                departure_datetime=datetime(2099, month, day, 10, 0, tzinfo=london),
+                arrival_datetime=datetime(2099, month, day, 11, 0, tzinfo=london),
+                price=Decimal('20.00'), available_seats=30, total_seats=30, operator='Shire Coaches'
+            )
+            for month, day in [(3, 26), (3, 28), (4, 1)]  # GMT, GMT, BST (from 29 March)
+        ]
+        self.assertEqual([option.departure_minute for option in options], [600, 600, 540])
+        window = {'depart_after': parse_time('09:30'), 'depart_before': parse_time('10:30')}
+        with timezone.override(london):
+            self.assertEqual(self.ids(search_travel_options('leeds', **window)), [option.travel_id for option in options])
+            self.assertEqual(self.ids(search_travel_options('leeds', departure_date='2099-04-01', **window)),
+                             [options[2].travel_id])
+        with timezone.override(ZoneInfo('UTC')):  # 10:00 GMT is 10:00 UTC, 10:00 BST is 09:00 UTC
+            self.assertEqual(self.ids(search_travel_options('leeds', **window)),
+                             [options[0].travel_id, options[1].travel_id])
+
+    def test_offset_periods_split_at_the_transition(self):
+        """Test that UTC offset periods change at the zone's transition instant"""
+        start = datetime(2099, 3, 25, tzinfo=dt_timezone.utc)
+        periods = offset_periods(start, start + timedelta(days=14), ZoneInfo('Europe/London'))
+        self.assertEqual([offset for *_, offset in periods], [0, 60])
+        self.assertEqual(periods[0][1], datetime(2099, 3, 29, 1, 0, tzinfo=dt_timezone.utc))
+
+    def test_backfill_schedule_columns(self):
+        """Test that rows written before the derived columns existed are filled in"""
+        TravelOption.objects.filter(pk=self.noon.pk).update(duration_minutes=0, departure_minute=0)
+        out = StringIO()
+        call_command('backfill_schedule_columns', chunk_size=2, stdout=out)
+        self.assertIn('Checked 4 travel options, updated 1.', out.getvalue())
+        self.noon.refresh_from_db()
+        self.assertEqual(self.noon.duration_minutes, 285)
+        utc = self.noon.departure_datetime.astimezone(dt_timezone.utc)
+        self.assertEqual(self.noon.departure_minute, utc.hour * 60 + utc.minute)
+
+
+class BookingEventFeedTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='testuser', password='testpass123')
+        departure_time = timezone.now() + timedelta(days=2)
+        cls.travel_option = TravelOption.objects.create(
+            travel_type='bus',
+            source='Mumbai',
+            destination='Pune',
+            departure_datetime=departure_time,
+            arrival_datetime=departure_time + timedelta(hours=4),
+            price=Decimal('600.00'),
+            available_seats=30,
+            total_seats=30,
+            operator='Feed Travels'
+        )
+
+    def book_and_cancel(self):
+        self.client.login(username='testuser', password='testpass123')
+        self.client.post(reverse('book_travel', kwargs={'travel_id': self.travel_option.travel_id}), {
+            'number_of_seats': 2, 'passenger_names': 'John Doe\nJane Doe', 'terms': 'on',
+        })
+        booking = Booking.objects.filter(user=self.user).latest('booking_id')
+        cancel_url = reverse('cancel_booking', kwargs={'booking_id': booking.booking_id})
+        self.client.post(cancel_url, {'confirm_cancel': 'yes'})
+        self.client.post(cancel_url, {'confirm_cancel': 'yes'})  # double submit
+        return booking
+
+    def test_events_written_with_changes(self):
+        """Test that booking and cancellation each append one event"""
+        booking = self.book_and_cancel()
+        events = list(BookingEvent.objects.values_list(
+            'event_type', 'travel_id', 'booking_id', 'user_id', 'seats_delta', 'available_seats'))
+        self.assertEqual(events, [
+            ('booking_created', self.travel_option.travel_id, booking.booking_id, self.user.pk, -2, 28),
+            ('booking_cancelled', self.travel_option.travel_id, booking.booking_id, self.user.pk, 2, 30),
+        ])
+
+    def test_consumer_checkpoints(self):
+        """Test that a consumer resumes after its checkpoint"""
+        self.book_and_cancel()
+        consumer = BookingEventConsumer('cache', batch_size=1)
+        first, second = consumer.events()
+        consumer.checkpoint(first.event_id)
+        self.assertEqual([event.event_id for event in consumer.events()], [second.event_id])
+
+        followed = consumer.follow(poll_interval=0)
+        self.assertEqual(next(followed), second)
+        stopped = BookingEventConsumer('other').follow(poll_interval=0, stop=lambda: True)
+        self.assertEqual(list(stopped), [])
+        followed.close()
+
+    def test_reader_delivers_late_events(self):
+        """Test that events after a missing id are not held back and the id is delivered if it commits later"""
+        self.book_and_cancel()
+        self.book_and_cancel()
+        first, late, third, fourth = BookingEvent.objects.order_by('event_id')
+        BookingEvent.objects.filter(pk=late.pk).delete()  # still in an open transaction
+        consumer = BookingEventConsumer('cache', batch_size=2)
+        events = list(consumer.events())
+        self.assertEqual(events, [first, third, fourth])
+        consumer.checkpoint(third.event_id)
+        checkpoint = EventCheckpoint.objects.get(consumer='cache')
+        self.assertEqual(checkpoint.last_event_id, third.event_id)
+        self.assertEqual([gap[:2] for gap in checkpoint.gaps], [[late.event_id, late.event_id]])
+
+        late.save(force_insert=True)  # commits with its lower id
+        consumer = BookingEventConsumer('cache')
+        self.assertEqual(list(consumer.events()), [late, fourth])
+        consumer.checkpoint(fourth.event_id)
+        self.assertEqual(EventCheckpoint.objects.get(consumer='cache').gaps, [])
+
+    def test_reader_forgets_old_gaps(self):
+        """Test that a gap open for GAP_TIMEOUT is dropped, as a rolled-back or never used id"""
+        self.book_and_cancel()
+        first, second = BookingEvent.objects.order_by('event_id')
+        BookingEvent.objects.filter(pk=first.pk).delete()
+        consumer = BookingEventConsumer('cache')
+        self.assertEqual(list(consumer.events()), [second])
+        consumer.checkpoint(second.event_id)
+
+        checkpoint = EventCheckpoint.objects.get(consumer='cache')
+        checkpoint.gaps[0][2] -= GAP_TIMEOUT.total_seconds()
+        checkpoint.save()
+        first.save(force_insert=True)
+        self.assertEqual(list(BookingEventConsumer('cache').events()), [])
+
+    def test_tail_command_resumes(self):
+        """Test that tail_booking_events prints JSON lines and saves the consumer position"""
+        self.book_and_cancel()
+        out = StringIO()
+        call_command('tail_booking_events', consumer='replica', limit=1, stdout=out)
+        self.assertIn('"event_type": "booking_created"', out.getvalue())
+        out = StringIO()
+        call_command('tail_booking_events', consumer='replica', stdout=out)
+        self.assertEqual(len(out.getvalue().splitlines()), 1)
+        self.assertIn('"event_type": "booking_cancelled"', out.getvalue())
+        self.assertEqual(EventCheckpoint.objects.get(consumer='replica').last_event_id,
+                         BookingEvent.objects.latest('event_id').event_id)
+
+
+def create_bus(seats=20):
+    departure_time = timezone.now() + timedelta(days=2)
+    return TravelOption.objects.create(
+        travel_type='bus',
+        source='Hyderabad',
+        destination='Vijayawada',
+        departure_datetime=departure_time,
+        arrival_datetime=departure_time + timedelta(hours=5),
+        price=Decimal('500.00'),
+        available_seats=seats,
+        total_seats=seats,
+        operator='Retry Travels'
+    )
+
+
+BOOKING_FORM = {'number_of_seats': 1, 'passenger_names': 'John Doe', 'terms': 'on'}
+
+
+class IdempotentBookingTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='testuser', password='testpass123')
+        cls.travel_option = create_bus()
+
+    def setUp(self):
+        self.client.login(username='testuser', password='testpass123')
+        self.url = reverse('book_travel', kwargs={'travel_id': self.travel_option.travel_id})
+
+    def test_form_token_replay(self):
+        """Test that resubmitting the form token redirects to the first booking"""
+        response = self.client.get(self.url)
+        key = response.context['idempotency_key']
+        self.assertContains(response, f'name="idempotency_key" value="{key}"')
+        first = self.client.post(self.url, dict(BOOKING_FORM, idempotency_key=key))
+        with self.assertNumQueries(3):  # session, user, key lookup: TravelOption is not read
+            second = self.client.post(self.url, dict(BOOKING_FORM, idempotency_key=key))
+        self.assertEqual(second.url, first.url)
+        self.assertEqual(Booking.objects.count(), 1)
+        self.travel_option.refresh_from_db()
+        self.assertEqual(self.travel_option.available_seats, 19)
+
+    def test_header_key_and_failed_attempt_released(self):
+        """Test that a failed attempt does not use up its key"""
+        headers = {'HTTP_IDEMPOTENCY_KEY': 'retry-1'}
+        response = self.client.post(self.url, dict(BOOKING_FORM, number_of_seats=0), **headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(BookingRequest.objects.exists())
+        self.client.post(self.url, BOOKING_FORM, **headers)
+        self.client.post(self.url, BOOKING_FORM, **headers)
+        booking = Booking.objects.get()
+        self.assertEqual(BookingRequest.objects.get(key='retry-1').booking_id, booking.booking_id)
+
+    def test_key_reused_for_another_travel_option(self):
+        """Test that a key that booked one departure is rejected for another"""
+        headers = {'HTTP_IDEMPOTENCY_KEY': 'reused'}
+        self.client.post(self.url, BOOKING_FORM, **headers)
+        other = create_bus()
+        response = self.client.post(reverse('book_travel', kwargs={'travel_id': other.travel_id}),
+                                    BOOKING_FORM, **headers)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(Booking.objects.count(), 1)
+        other.refresh_from_db()
+        self.assertEqual(other.available_seats, 20)
+
+    def test_key_claimed_between_check_and_insert(self):
+        """Test the unique-constraint path: a submission that commits after the replay check wins"""
+        first = self.client.post(self.url, BOOKING_FORM, HTTP_IDEMPOTENCY_KEY='first')
+        booking = Booking.objects.get()
+        claimed = []
+
+        def commit_competing_claim(execute, sql, params, many, context):
+            result = execute(sql, params, many, context)
+            if not claimed and sql.startswith('SELECT') and BookingRequest._meta.db_table in sql:
+                claimed.append(BookingRequest.objects.create(
+                    user=self.user, key='race', booking_id=booking.booking_id, travel_id=self.travel_option.pk,
+                ))
+            return result
+
+        with connection.execute_wrapper(commit_competing_claim):
+            response = self.client.post(self.url, BOOKING_FORM, HTTP_IDEMPOTENCY_KEY='race')
+        self.assertTrue(claimed)
+        self.assertEqual(response.url, first.url)
+        self.assertEqual(Booking.objects.count(), 1)
+        self.travel_option.refresh_from_db()
+        self.assertEqual(self.travel_option.available_seats, 19)
+
+
+class ConcurrentBookingSubmissionTest(TransactionTestCase):
+    # On SQLite the submissions queue on the database write lock rather than
+    # a row lock, which still leaves one to claim the key and the rest to
+    # find it taken
+    def test_parallel_identical_submissions_book_once(self):
+        """Test that N parallel submissions with one key produce exactly one booking"""
+        User.objects.create_user(username='testuser', password='testpass123')
+        travel_option = create_bus()
+        url = reverse('book_travel', kwargs={'travel_id': travel_option.travel_id})
+        start = threading.Barrier(8)
+        statuses = []
+
+        def submit():
+            client = Client()
+            client.login(username='testuser', password='testpass123')
+            start.wait()
+            try:
+                statuses.append(client.post(url, BOOKING_FORM, HTTP_IDEMPOTENCY_KEY='double-click').status_code)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=submit) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(statuses, [302] * 8)
+        self.assertEqual(Booking.objects.count(), 1)
+        travel_option.refresh_from_db()
+        self.assertEqual(travel_option.available_seats, 19)
+
+
+class BatchBookingTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='testuser', password='testpass123')
+        cls.first = create_bus(seats=40)
+        cls.second = create_bus(seats=5)
+
+    def setUp(self):
+        self.client.login(username='testuser', password='testpass123')
+
+    def post(self, items):
+        return self.client.post(reverse('book_batch'), {'items': items}, content_type='application/json')
+
+    def test_books_all_items_in_one_transaction(self):
+        """Test that a batch books every departure, decrements seats and logs events"""
+        response = self.post([
+            {'travel_id': self.second.travel_id, 'seats': 4, 'passenger_names': ['A Roy', 'B Roy', 'C Roy', 'D Roy']},
+            {'travel_id': self.first.travel_id, 'seats': 12, 'passenger_names': ['Team Member'] * 12},
+        ])
+        self.assertEqual(response.status_code, 201)
+        data = response.json()
+        self.assertEqual([item['travel_id'] for item in data['bookings']],
+                         [self.second.travel_id, self.first.travel_id])
+        # Fares are for the load seen before the batch, as in book_travel
+        self.assertEqual(data['bookings'][0]['total_price'], '2000.00')
+        self.assertEqual(data['total_price'], '8000.00')
+        self.assertEqual(set(Booking.objects.values_list('booking_id', flat=True)),
+                         {item['booking_id'] for item in data['bookings']})
+        self.first.refresh_from_db()
+        self.second.refresh_from_db()
+        self.assertEqual((self.first.available_seats, self.second.available_seats), (28, 1))
+        self.assertEqual(BookingEvent.objects.filter(event_type='booking_created').count(), 2)
+
+    def test_rejects_invalid_or_unavailable_batches_without_writes(self):
+        """Test that validation and seat shortages fail the whole batch"""
+        cases = [
+            ([], 400),
+            ([{'travel_id': self.first.travel_id, 'seats': 1, 'passenger_names': ['X1']}], 400),
+            ([{'travel_id': self.first.travel_id, 'seats': 1, 'passenger_names': ['Ann Lee']}] * 2, 400),
+            ([{'travel_id': 999999, 'seats': 1, 'passenger_names': ['Ann Lee']}], 400),
+            ([{'travel_id': self.first.travel_id, 'seats': 1, 'passenger_names': ['Ann Lee']},
+              {'travel_id': self.second.travel_id, 'seats': 6, 'passenger_names': ['Ann Lee'] * 6}], 409),
+        ]
+        for items, status in cases:
+            self.assertEqual(self.post(items).status_code, status, items)
+        self.assertFalse(Booking.objects.exists())
+        self.first.refresh_from_db()
+        self.assertEqual(self.first.available_seats, 40)
+
+    def test_requires_login(self):
+        """Test that anonymous batch requests are refused"""
+        self.client.logout()
+        self.assertEqual(self.post([]).status_code, 401)
+
+
+class WaitlistTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.travel_option = create_bus(seats=10)
+        cls.holder = User.objects.create_user(username='holder', password='testpass123')
+        cls.booking = Booking.objects.create(user=cls.holder, travel_option=cls.travel_option, number_of_seats=3)
+        cls.travel_option.available_seats = 0
+        cls.travel_option.save()
+        cls.waiting = []
+        for name, seats in [('first', 2), ('second', 3), ('third', 1)]:
+            user = User.objects.create_user(username=name, email=f'{name}@example.com', password='testpass123')
+            cls.waiting.append(WaitlistEntry.objects.create(
+                travel_option=cls.travel_option, user=user, number_of_seats=seats,
+                passenger_details=['Wait Listed'] * seats,
+            ))
+
+    def test_join_waitlist(self):
+        """Test that a user can queue for a sold-out departure and sees their position"""
+        User.objects.create_user(username='late', password='testpass123')
+        self.client.login(username='late', password='testpass123')
+        url = reverse('join_waitlist', kwargs={'travel_id': self.travel_option.travel_id})
+        response = self.client.post(url, {'number_of_seats': 1, 'passenger_names': 'Late Comer'}, follow=True)
+        self.assertContains(response, 'You are number <strong>4</strong>')
+        response = self.client.post(url, {'leave': 'yes'})
+        self.assertFalse(WaitlistEntry.objects.filter(user__username='late').exists())
+
+    def test_cancellation_promotes_entries_that_fit(self):
+        """Test that released seats book the queue in order, skipping entries that do not fit"""
+        self.client.login(username='holder', password='testpass123')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('cancel_booking', kwargs={'booking_id': self.booking.booking_id}),
+                             {'confirm_cancel': 'yes'})
+        promoted = Booking.objects.get(user__username='first')
+        self.assertEqual((promoted.number_of_seats, promoted.status), (2, 'confirmed'))
+        self.assertEqual(list(WaitlistEntry.objects.values_list('user__username', flat=True)), ['second'])
+        self.travel_option.refresh_from_db()
+        self.assertEqual(self.travel_option.available_seats, 0)  # 'third' goes ahead of 'second'
+        self.assertEqual([message.to for message in mail.outbox], [['first@example.com'], ['third@example.com']])
+        self.assertEqual(list(BookingEvent.objects.values_list('event_type', 'seats_delta', 'available_seats')),
+                         [('booking_cancelled', 3, 3), ('booking_created', -2, 1), ('booking_created', -1, 0)])
+
+    def test_admin_seat_increase_promotes(self):
+        """Test that seats added in the admin go to the waitlist before they go on sale"""
+        class Form:
+            changed_data = ['available_seats']
+            initial = {'available_seats': 0}
+
+        request = RequestFactory().post('/')
+        request.user = User.objects.create_superuser(username='staff', password='testpass123')
+        self.travel_option.available_seats = 4
+        with transaction.atomic():
+            TravelOptionAdmin(TravelOption, admin.site).save_model(request, self.travel_option, Form(), change=True)
+        self.assertEqual(sorted(Booking.objects.filter(user__username__in=['first', 'second', 'third'])
+                                .values_list('user__username', flat=True)), ['first', 'third'])
+        self.travel_option.refresh_from_db()
+        self.assertEqual(self.travel_option.available_seats, 1)
+
+    def test_promotion_cost_independent_of_queue_length(self):
+        """Test that promotion reads only as many entries as seats were released"""
+        for index in range(100):
+            user = User.objects.create_user(username=f'bulk{index}')
+            WaitlistEntry.objects.create(travel_option=self.travel_option, user=user, number_of_seats=1)
+        self.waiting[1].delete()
+        self.travel_option.available_seats = 3
+        # head of queue, a fare per promotion, bulk bookings, bulk events, delete
+        with self.assertNumQueries(6):
+            promoted = promote_waitlist(self.travel_option)
+        self.assertEqual([booking.user.username for booking in promoted], ['first', 'third'])
+        self.assertEqual(self.travel_option.available_seats, 0)
+
+
+class PopularityTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='traveller', password='testpass123')
+        cls.travel_option = create_bus()
+        departure_time = timezone.now() + timedelta(days=3)
+        for source, destination in [('Hyderabad', 'Chennai'), ('Chennai', 'Bangalore')]:
+            TravelOption.objects.create(
+                travel_type='train', source=source, destination=destination,
+                departure_datetime=departure_time, arrival_datetime=departure_time + timedelta(hours=8),
+                price=Decimal('700.00'), available_seats=50, total_seats=50, operator='Popular Rail',
+            )
+
+    def setUp(self):
+        cache.clear()
+        self.tracker = SearchTracker(flush_interval=3600)
+
+    def tearDown(self):
+        self.tracker.flusher.stop()
+
+    def test_space_saving_bounds(self):
+        """Test that the sketch keeps heavy hitters and brackets their true counts"""
+        sketch = SpaceSaving(3)
+        stream = ['a'] * 50 + ['b'] * 40 + [f'rare{index}' for index in range(20)] + ['c'] * 5
+        for key in stream:
+            sketch.add(key)
+        self.assertEqual(len(sketch), 3)
+        top = {key: (count, error) for key, count, error in sketch.top(2)}
+        self.assertEqual(set(top), {'a', 'b'})
+        for key, (count, error) in top.items():
+            self.assertLessEqual(count - error, stream.count(key))
+            self.assertGreaterEqual(count, stream.count(key))
+
+    def test_flush_writes_hourly_bucket(self):
+        """Test that searches for known cities are flushed into the current bucket and repeat flushes add up"""
+        self.tracker.record('hyderabad', 'Vijayawada')
+        self.tracker.record('Hyderabad ', 'vijayawada')
+        self.tracker.record('', 'Chennai')
+        self.tracker.record('Atlantis', 'Nowhere')
+        self.tracker.flush()
+        self.tracker.record('Hyderabad', 'Vijayawada')
+        self.tracker.flush()
+        self.assertEqual(sorted(RouteActivity.objects.values_list('source', 'destination', 'searches')),
+                         [('', 'Chennai', 1), ('Hyderabad', 'Vijayawada', 3)])
+        self.assertEqual(RouteActivity.objects.get(destination='Chennai').bucket,
+                         hour_bucket(timezone.now()))
+
+    def test_record_never_queries(self):
+        """Test that counting a search leaves loading cities and the flush to the background thread"""
+        with self.assertNumQueries(0):
+            self.tracker.record('Hyderabad', 'Vijayawada')
+            self.tracker.record('Hyderabad', 'Vijayawada')
+        self.assertTrue(self.tracker.flusher.thread.is_alive())
+        self.assertFalse(RouteActivity.objects.exists())
+
+    def test_close_flushes_remaining_searches(self):
+        """Test that an exiting worker writes what it counted since the last flush"""
+        self.tracker.flush()  # loads the known cities
+        self.tracker.record('chennai', 'Atlantis')
+        self.tracker.close()
+        self.assertTrue(self.tracker.flusher.stopping.is_set())
+        self.assertEqual(list(RouteActivity.objects.values_list('source', 'destination', 'searches')),
+                         [('Chennai', '', 1)])
+
+    def test_booking_events_roll_up_once(self):
+        """Test that bookings are read from the event feed under a checkpoint"""
+        self.client.login(username='traveller', password='testpass123')
+        self.client.post(reverse('book_travel', kwargs={'travel_id': self.travel_option.travel_id}),
+                         dict(BOOKING_FORM, number_of_seats=2, passenger_names='John Doe\nJane Doe'))
+        BookingEvent.objects.update(created_at=timezone.now() - timedelta(minutes=1))
+        self.assertEqual(roll_up_booking_events(), 1)
+        self.assertEqual(roll_up_booking_events(), 0)
+        activity = RouteActivity.objects.get()
+        self.assertEqual((activity.source, activity.bookings, activity.seats), ('Hyderabad', 1, 2))
+
+    def test_trending_and_city_ranking(self):
+        """Test that refresh ranks routes by decayed activity and autocomplete follows city popularity"""
+        now = timezone.now()
+        bucket = hour_bucket(now)
+        RouteActivity.objects.create(bucket=bucket, source='Chennai', destination='Bangalore', searches=10)
+        RouteActivity.objects.create(bucket=bucket, source='Hyderabad', destination='Vijayawada', searches=2, bookings=2)
+        # Larger but three days old: decays below the fresh routes
+        RouteActivity.objects.create(bucket=bucket - timedelta(days=3), source='Hyderabad', destination='Chennai',
+                                     searches=60)
+        RouteActivity.objects.create(bucket=bucket - timedelta(days=40), source='Hyderabad', destination='Chennai',
+                                     searches=1000)
+        self.assertEqual(prune_route_activity(now), 1)
+        self.assertEqual(refresh_popularity(now), 3)
+        self.assertEqual(list(TrendingRoute.objects.values_list('source', 'destination')), [
+            ('Hyderabad', 'Vijayawada'), ('Chennai', 'Bangalore'), ('Hyderabad', 'Chennai'),
+        ])
+
+        response = self.client.get(reverse('home'))
+        self.assertContains(response, 'Trending Routes')
+        self.assertContains(response, '?source=Chennai&destination=Bangalore')
+        response = self.client.get(reverse('search_cities'), {'q': 'a'})
+        self.assertEqual(response.json(), [])
+        response = self.client.get(reverse('search_cities'), {'q': 'ba'})
+        self.assertEqual(response.json(), ['Hyderabad', 'Bangalore'])
+
+    def test_refresh_command(self):
+        """Test that refresh_popularity rolls up events and rebuilds the trending table"""
+        RouteActivity.objects.create(bucket=hour_bucket(timezone.now()), source='Chennai',
+                                     destination='Bangalore', searches=4)
+        out = StringIO()
+        call_command('refresh_popularity', stdout=out)
+        self.assertIn('1 trending routes', out.getvalue())
+        self.assertEqual(TrendingRoute.objects.get().source, 'Chennai')
+
+
+class OperatorReportTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user(username='ops', password='testpass123', is_staff=True)
+        cls.user = User.objects.create_user(username='rider', password='testpass123')
+        day = timezone.localtime().replace(hour=9, minute=0, second=0, microsecond=0) - timedelta(days=40)
+        cls.live = TravelOption.objects.create(
+            travel_type='bus', source='Delhi', destination='Agra',
+            departure_datetime=day + timedelta(hours=6), arrival_datetime=day + timedelta(hours=10),
+            price=Decimal('500.00'), available_seats=37, total_seats=40, operator='Report Bus',
+        )
+        Booking.objects.create(user=cls.user, travel_option=cls.live, number_of_seats=3, total_price=Decimal('1500.00'))
+        Booking.objects.create(user=cls.user, travel_option=cls.live, number_of_seats=1, total_price=Decimal('500.00'),
+                               status='cancelled')
+        # Same local day, already moved to the archive
+        cls.archived = ArchivedTravelOption.objects.create(
+            travel_id=cls.live.travel_id + 1000, travel_type='bus', source='Agra', destination='Delhi',
+            departure_datetime=day, arrival_datetime=day + timedelta(hours=4), price=Decimal('450.00'),
+            available_seats=15, total_seats=20, operator='Report Bus', created_at=day, updated_at=day,
+        )
+        ArchivedBooking.objects.create(
+            booking_id=90001, user=cls.user, travel_option=cls.archived, number_of_seats=5,
+            total_price=Decimal('2250.50'), booking_date=day, status='confirmed', created_at=day, updated_at=day,
+        )
+        TravelOption.objects.create(
+            travel_type='train', source='Delhi', destination='Jaipur',
+            departure_datetime=day + timedelta(days=1), arrival_datetime=day + timedelta(days=1, hours=5),
+            price=Decimal('800.00'), available_seats=100, total_seats=100, operator='Other Rail',
+        )
+        cls.day = day.date()
+
+    def test_staff_only(self):
+        """Test that reports are only available to staff"""
+        self.client.login(username='rider', password='testpass123')
+        self.assertEqual(self.client.get(reverse('operator_report')).status_code, 302)
+        self.client.login(username='ops', password='testpass123')
+        response = self.client.get(reverse('operator_report'), {'operator': 'Report Bus'})
+        self.assertContains(response, 'Report Bus')
+        self.assertNotContains(response, 'Other Rail</td>')
+
+    def test_daily_csv_merges_archive(self):
+        """Test that the daily export sums live and archived departures of one day"""
+        self.client.login(username='ops', password='testpass123')
+        response = self.client.get(reverse('operator_report'), {'group': 'day', 'format': 'csv'})
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines, [
+            'Date,Operator,Departures,Total seats,Seats sold,Occupancy %,Bookings,Revenue',
+            f'{self.day},Report Bus,2,60,8,13.3,2,3750.50',
+            f'{self.day + timedelta(days=1)},Other Rail,1,100,0,0.0,0,0.00',
+        ])
+
+    def test_departure_csv(self):
+        """Test that the per-departure export counts only confirmed bookings"""
+        self.client.login(username='ops', password='testpass123')
+        response = self.client.get(reverse('operator_report'), {
+            'group': 'departure', 'operator': 'Report Bus', 'format': 'csv',
+            'start': str(self.day), 'end': str(self.day),
+        })
+        self.assertIn('report-bus.csv', response['Content-Disposition'])
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[1].startswith(f'{self.archived.travel_id},Report Bus,bus,Agra,Delhi,'))
+        self.assertTrue(lines[1].endswith(',20,5,25.0,1,2250.50'))
+        self.assertTrue(lines[2].endswith(',40,3,7.5,1,1500.00'))
+
+    def test_csv_uses_the_users_time_zone(self):
+        """Test that a streamed export groups and prints in the user's zone, not TIME_ZONE"""
+        zone = ZoneInfo('America/Los_Angeles')
+        UserProfile.objects.create(user=self.staff, time_zone='America/Los_Angeles')
+        self.client.login(username='ops', password='testpass123')
+        archived = timezone.localtime(self.archived.departure_datetime, zone)
+        live = timezone.localtime(self.live.departure_datetime, zone)
+        self.assertNotEqual(archived.date(), live.date())
+
+        response = self.client.get(reverse('operator_report'), {
+            'group': 'day', 'operator': 'Report Bus', 'format': 'csv',
+        })
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[1:], [
+            f'{archived.date()},Report Bus,1,20,5,25.0,1,2250.50',
+            f'{live.date()},Report Bus,1,40,3,7.5,1,1500.00',
+        ])
+
+        response = self.client.get(reverse('operator_report'), {
+            'group': 'departure', 'operator': 'Report Bus', 'format': 'csv',
+        })
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertIn(f',{live:%Y-%m-%d %H:%M},', lines[2])
+
+
+class ReconcileSeatsCommandTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='counted', password='testpass123')
+        cls.buses = [create_bus(seats=10) for _ in range(5)]
+        for bus in cls.buses:
+            Booking.objects.create(user=cls.user, travel_option=bus, number_of_seats=2, total_price=Decimal('1000.00'))
+            Booking.objects.create(user=cls.user, travel_option=bus, number_of_seats=3, total_price=Decimal('1500.00'),
+                                   status='cancelled')
+        TravelOption.objects.update(available_seats=8)
+
+    def test_reports_drift_without_changes(self):
+        """Test that drifted departures are listed and left alone without --repair"""
+        TravelOption.objects.filter(travel_id=self.buses[1].travel_id).update(available_seats=5)
+        out = StringIO()
+        with self.assertNumQueries(4):  # id bounds, then one aggregate per chunk
+            call_command('reconcile_seats', chunk_size=2, stdout=out)
+        self.assertIn(f'#{self.buses[1].travel_id}: available_seats 5, bookings leave 8', out.getvalue())
+        self.assertIn('1 travel options drifted', out.getvalue())
+        self.assertEqual(TravelOption.objects.get(travel_id=self.buses[1].travel_id).available_seats, 5)
+
+    def test_repair(self):
+        """Test that --repair restores the booked count, records events and promotes the waitlist"""
+        short, over = self.buses[2], self.buses[3]
+        TravelOption.objects.filter(travel_id=short.travel_id).update(available_seats=0)
+        Booking.objects.create(user=self.user, travel_option=over, number_of_seats=9, total_price=Decimal('4500.00'))
+        waiting = User.objects.create_user(username='patient', password='testpass123')
+        WaitlistEntry.objects.create(travel_option=short, user=waiting, number_of_seats=3)
+
+        call_command('reconcile_seats', repair=True, stdout=StringIO())
+        self.assertEqual(dict(TravelOption.objects.filter(travel_id__in=[short.travel_id, over.travel_id])
+                              .values_list('travel_id', 'available_seats')),
+                         {short.travel_id: 5, over.travel_id: 0})
+        self.assertTrue(Booking.objects.filter(user=waiting, travel_option=short, status='confirmed').exists())
+        self.assertEqual(list(BookingEvent.objects.filter(event_type='seats_changed').order_by('travel_id')
+                              .values_list('travel_id', 'seats_delta', 'payload')),
+                         [(short.travel_id, 8, {'source': 'reconcile_seats'}),
+                          (over.travel_id, -8, {'source': 'reconcile_seats'})])
+        out = StringIO()
+        call_command('reconcile_seats', stdout=out)
+        self.assertIn('All seat counts match', out.getvalue())
+
+    def test_available_cannot_exceed_total(self):
+        """Test that the database rejects more available than total seats"""
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            TravelOption.objects.filter(travel_id=self.buses[0].travel_id).update(available_seats=11)
+
+
+class ProfileStartupCommandTest(TestCase):
+    def test_reports_imports_and_first_request(self):
+        """Test that profile_startup times a cold process up to its first response and enforces the budget"""
+        out = StringIO()
+        call_command('profile_startup', path='/auth/login/', top=3, warm=True, stdout=out)
+        output = out.getvalue()
+        self.assertIn('Cold start for /auth/login/ (200 OK)', output)
+        self.assertIn('travel_booking.* (own time', output)
+        self.assertIn('Process start to first response', output)
+        with self.assertRaisesMessage(CommandError, 'over the 1 ms budget'):
+            call_command('profile_startup', path='/auth/login/', top=0, budget=1, stdout=StringIO())
+
+
+# Reference symbols from an independent encoder (segno 1.6.6), '#' dark.
+# Masks are fixed: encoders score masks differently and any mask decodes.
+# segno appends a spare zero byte when the data ends on a codeword
+# boundary; the references were made without it, as ISO/IEC 18004 7.4.10 says.
+QR_REFERENCE = [
+    ('TB-1', 'H', 6, [
+    '#######..#....#######',
+    '#.....#..#.##.#.....#',
+    '#.###.#.#.....#.###.#',
+    '#.###.#.##.##.#.###.#',
+    '#.###.#..#....#.###.#',
+    '#.....#..#..#.#.....#',
+    '#######.#.#.#.#######',
+    '.........#..#........',
+    '...##.##..#.#....##..',
+    '.......#.#..###.#.#.#',
+    '..###.#.#...##..##.##',
+    '.#..##.#...####..##..',
+    '..###.##.#.#.##..#..#',
+    '........#.###.##.#..#',
+    '#######.##.#...####..',
+    '#.....#...#.#.###.#.#',
+    '#.###.#.##.#.###...##',
+    '#.###.#.#####...###..',
+    '#.###.#...#.###...###',
+    '#.....#..##.###.#.###',
+    '#######..#.#.#....#..',
+    ]),
+    # Version 7: alignment patterns and the version information blocks
+    ('TB-1048576:Q2hlY2sgdGhpcyB0aWNrZXQgYXQgdGhlIGdhdGUgcGxlYXNl', 'H', 5, [
+    '#######.###....#.###########..##....#.#######',
+    '#.....#...#...###.#.#.###..####.#..#..#.....#',
+    '#.###.#.###.#.##...#.#..#.....#..#.#..#.###.#',
+    '#.###.#..##..##...#.#.##..##.#.#.#.##.#.###.#',
+    '#.###.#.#####..#...######....##.#.###.#.###.#',
+    '#.....#..#..#..#...##...##..##.##.....#.....#',
+    '#######.#.#.#.#.#.#.#.#.#.#.#.#.#.#.#.#######',
+    '........##.#...#....#...##.#...#..##.........',
+    '.....##...#.####...##########.##.#....#.#.#.#',
+    '....##..##....####....#..#..####..#####.#.#..',
+    '#.##..##.#.##.##..##....#..#####..##.#..##.#.',
+    '.#.##..#.##...#.##......#..#.###.#.##...#####',
+    '.##...##.###..##...####.###.#.#.###.#.#.###.#',
+    '.#####..#.####......#.##..##.###.#.##....####',
+    '#.#..####.##...#..##.##.#.#.....##...####.#..',
+    '.......#.###.#.#.#......#.....#.......#.###..',
+    '##..#####..##..#.####...##.#.###.#....#...#..',
+    '##..##..##..####..##..######..#..#.###.##...#',
+    '##...##.#....#.#.##...#.#...#.###.#.....###.#',
+    '.#.......###.###.##.##..#..###.###.########.#',
+    '...######..#.#....###########....#.######....',
+    '#..##...#..###..#.#.#...#.#.##...####...#.###',
+    '.##.#.#.#.####..##..#.#.##..#.##.##.#.#.#.##.',
+    '.#.##...#...###.#####...#.#..#.#.##.#...#####',
+    '....#######....#....#####..#..############.#.',
+    '.....#.#...##............#.###.#......#..##.#',
+    '.##.###..#.#.........##..###.##..#..##....##.',
+    '.##.##..#.#..#.#..####.##...#.#.###..#...###.',
+    '####..##.#.#...##...#.......#..#....###.#.##.',
+    '##...#.#..##...#.#.##.##............#....##.#',
+    '.##.#.#.#.##..###.##..#.#.##..#.#...#.#.#...#',
+    '..#.##..#.....###...####...##.##.#.....#####.',
+    '###.###...#...#..#..#.###......#..#...####...',
+    '.#.##...###.##.#.####.###....###.##.#####.#.#',
+    '....#.##.#..##..##.##...#.#..#.#.###.#.#...#.',
+    '.####....###.#..##..#.#....##.###....#..#.##.',
+    '#..##.###..#.#......#####.#.#...#.########.#.',
+    '........#..#.##..#.##...##.#.#...#..#...##.##',
+    '#######.....######..#.#.##.#.#..#####.#.#.#..',
+    '#.....#.####....#.#.#...###.####....#...#####',
+    '#.###.#...#....#..#.########..#..#..#######..',
+    '#.###.#..######...#.##.##....#.###......#.###',
+    '#.###.#...#....#.#.##.##..#.#.#.##..###.#.###',
+    '#.....#..###..###.#.#....#.#.#...###...####..',
+    '#######..........#.#.####.#.#.#####.###..###.',
+    ]),
+]
+
+
+class TicketTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.travel_option = create_bus()
+        cls.user = User.objects.create_user(username='traveller', password='testpass123')
+        cls.booking = Booking.objects.create(user=cls.user, travel_option=cls.travel_option, number_of_seats=2,
+                                             passenger_details=['John Doe', 'Jane Doe'])
+        cls.travel_option.available_seats -= 2
+        cls.travel_option.save()
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        override = self.settings(MEDIA_ROOT=media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.client.login(username='traveller', password='testpass123')
+
+    def ticket_url(self, fmt):
+        return reverse('booking_ticket', kwargs={'booking_id': self.booking.booking_id, 'fmt': fmt})
+
+    def test_qr_encode(self):
+        """Test that the QR encoder picks the smallest version that fits"""
+        code = qr.encode(tickets.ticket_reference(self.booking))
+        self.assertEqual(code.size, code.version * 4 + 17)
+        self.assertEqual(qr.encode('TB-1', 'H').version, 1)
+        with self.assertRaises(ValueError):
+            qr.encode('x' * 300)
+
+    def test_qr_matches_reference_symbols(self):
+        """Test that encoded symbols match a reference encoder module for module"""
+        for data, error, mask, expected in QR_REFERENCE:
+            code = qr.encode(data, error, mask=mask)
+            rows = [''.join('#' if dark else '.' for dark in row) for row in code.modules]
+            self.assertEqual(rows, expected, data)
+
+    def test_ticket_is_rendered_once_per_version(self):
+        """Test that a ticket is reused until the booking changes and the old version is then removed"""
+        first = tickets.build_ticket(self.booking, 'png')
+        self.assertEqual(first.read_bytes()[:8], b'\x89PNG\r\n\x1a\n')
+        modified = first.stat().st_mtime_ns
+        self.assertEqual(tickets.build_ticket(self.booking, 'png'), first)
+        self.assertEqual(first.stat().st_mtime_ns, modified)
+
+        self.booking.save()  # bumps updated_at
+        second = tickets.build_ticket(self.booking, 'png')
+        self.assertNotEqual(second, first)
+        self.assertFalse(first.exists())
+
+    def test_ticket_follows_the_passengers_time_zone(self):
+        """Test that tickets print the passenger's zone, whatever zone the request has, and key files by it"""
+        default = tickets.build_ticket(self.booking, 'png')
+        self.assertIn('Asia.Kolkata', default.name)
+        with timezone.override(ZoneInfo('America/New_York')):
+            self.assertEqual(tickets.build_ticket(self.booking, 'png'), default)
+
+        UserProfile.objects.update_or_create(user=self.user, defaults={'time_zone': 'Europe/London'})
+        london = tickets.build_ticket(self.booking, 'png')
+        self.assertIn('Europe.London', london.name)
+        self.assertFalse(default.exists())
+
+    def test_download(self):
+        """Test that the ticket is sent as an attachment, or left to the proxy with X-Sendfile"""
+        response = self.client.get(self.ticket_url('pdf'))
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertIn('ticket-%d.pdf' % self.booking.booking_id, response['Content-Disposition'])
+        self.assertTrue(b''.join(response.streaming_content).startswith(b'%PDF'))
+
+        with self.settings(TICKET_SENDFILE='X-Sendfile'):
+            response = self.client.get(self.ticket_url('png'))
+        self.assertEqual(response['X-Sendfile'], str(tickets.ticket_path(self.booking, 'png')))
+        self.assertEqual(response.content, b'')
+        self.assertEqual(self.client.get(self.ticket_url('gif')).status_code, 404)
+
+    def test_cancelled_booking_has_no_ticket(self):
+        """Test that cancelling deletes the stored tickets and further downloads are refused"""
+        path = tickets.build_ticket(self.booking, 'png')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('cancel_booking', kwargs={'booking_id': self.booking.booking_id}),
+                             {'confirm_cancel': 'yes'})
+        self.assertFalse(path.exists())
+        response = self.client.get(self.ticket_url('png'))
+        self.assertRedirects(response, reverse('booking_detail', kwargs={'booking_id': self.booking.booking_id}))
+
+    def test_pregenerated_after_commit(self):
+        """Test that new bookings schedule their tickets for after commit"""
+        with self.settings(TICKET_PREGENERATE=True), self.captureOnCommitCallbacks() as callbacks:
+            tickets.schedule_tickets([self.booking])
+        self.assertEqual(len(callbacks), 1)
+
+        tickets.pregenerate_tickets([self.booking.booking_id])
+        stored = sorted(path.suffix for path in Path(tickets.ticket_path(self.booking, 'png')).parent.iterdir())
+        self.assertEqual(stored, ['.pdf', '.png'])
+
+
+class TrafficCaptureTest(LiveServerTestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.trace = Path(directory) / 'trace.jsonl'
+        create_bus()
+
+    def test_capture_and_replay(self):
+        """Test that requests are traced without personal data and the trace replays against a server"""
+        User.objects.create_user(username='traveller', password='testpass123')
+        with self.settings(TRAFFIC_CAPTURE_FILE=str(self.trace)):
+            client = Client()
+            client.get(reverse('home'), {'source': 'Hyderabad'})
+            client.get(reverse('search_cities'), {'q': 'hy'})
+            client.post(reverse('login'), {'username': 'traveller', 'password': 'testpass123'})
+            client.get(reverse('my_bookings'))
+        entries = [json.loads(line) for line in self.trace.read_text().splitlines()]
+        self.assertEqual([entry['url_name'] for entry in entries], ['home', 'search_cities', 'login', 'my_bookings'])
+        self.assertEqual(entries[0]['params'], {'source': ['Hyderabad']})
+        self.assertEqual(entries[2]['form'], ['username'])
+        self.assertNotIn('traveller', self.trace.read_text())
+        self.assertEqual(entries[0]['user'], 'anon')
+        self.assertIsInstance(entries[3]['user'], int)
+
+        out = StringIO()
+        call_command('replay_traffic', str(self.trace), base_url=self.live_server_url, speed=0, workers=2, stdout=out)
+        output = out.getvalue()
+        self.assertIn('Replaying 2 requests', output)
+        self.assertIn('Skipped: 1 POST, 1 signed in', output)
+        self.assertRegex(output, r'search_cities\s+1\s+0')
+        self.assertRegex(output, r'all\s+2\s+0')
+
+    def test_replay_token_keeps_replays_out_of_the_trace(self):
+        """Test that only the configured replay token, not a user agent, skips capture"""
+        with self.settings(TRAFFIC_CAPTURE_FILE=str(self.trace), TRAFFIC_REPLAY_TOKEN='s3cret'):
+            client = Client()
+            client.get(reverse('home'), headers={REPLAY_HEADER: 's3cret'})
+            client.get(reverse('home'), headers={REPLAY_HEADER: 'guess', 'User-Agent': 'travel-booking-replay'})
+        self.assertEqual(len(self.trace.read_text().splitlines()), 1)
+
+    def test_replay_bookings(self):
+        """Test that booking POSTs replay with CSRF checks on, and only when writes are allowed"""
+        travel = TravelOption.objects.get()
+        User.objects.create_user(username='traveller', password='testpass123')
+        with self.settings(TRAFFIC_CAPTURE_FILE=str(self.trace)):
+            client = Client()
+            client.login(username='traveller', password='testpass123')
+            client.post(reverse('book_travel', kwargs={'travel_id': travel.travel_id}),
+                        {**BOOKING_FORM, 'idempotency_key': 'captured-key'})
+        self.assertEqual(json.loads(self.trace.read_text())['form'],
+                         ['idempotency_key', 'number_of_seats', 'passenger_names', 'terms'])
+        cookie = f'{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}'
+
+        out = StringIO()
+        with self.assertRaises(CommandError):
+            call_command('replay_traffic', str(self.trace), base_url=self.live_server_url, session_cookie=cookie,
+                         stdout=out)
+        call_command('replay_traffic', str(self.trace), base_url=self.live_server_url, session_cookie=cookie,
+                     allow_writes=True, speed=0, stdout=out)
+        self.assertRegex(out.getvalue(), r'book_travel\s+1\s+0')
+        self.assertEqual(Booking.objects.filter(travel_option=travel, status='confirmed').count(), 2)
+
+    def test_full_speed_latency_starts_at_the_send(self):
+        """Test that requests waiting for a free worker at speed 0 do not count the wait as latency"""
+        class SlowConnection:
+            status = 200
+
+            def __init__(self, netloc, timeout):
+                pass
+
+            def request(self, method, target, body=None, headers=None):
+                pass
+
+            def getresponse(self):
+                time.sleep(0.05)
+                return self
+
+            def read(self):
+                return b''
+
+        replayer = Replayer('http://replay.invalid', workers=1, speed=0)
+        replayer.connection_class = SlowConnection
+        entries = [{'ts': 0, 'method': 'GET', 'path': '/', 'url_name': 'home', 'params': {}, 'form': []}] * 5
+        latencies = [latency for _, latency in replayer.run(entries)['home']]
+        self.assertEqual(len(latencies), 5)
+        self.assertLess(max(latencies), 150)  # the last one waited 200 ms for the worker
+
+
+class QueryPlanTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        call_command('seed_travel_data', travel_options=2000, users=20, bookings=3000, seed=3, stdout=StringIO())
+        cls.booking = Booking.objects.order_by('booking_id').select_related('user', 'travel_option').first()
+        cls.staff = User.objects.create_user(username='plan-staff', is_staff=True)
+        upcoming = TravelOption.objects.filter(departure_datetime__gt=timezone.now()).first()
+        cls.fixtures = {
+            'travel': upcoming.travel_id,
+            'booking': cls.booking.booking_id,
+            'operator': upcoming.operator,
+            'tomorrow': (timezone.localdate() + timedelta(days=1)).isoformat(),
+        }
+
+    def fill(self, values):
+        return {key: self.fixtures.get(value, value) for key, value in values.items()}
+
+    def test_views_use_their_indexes(self):
+        """Test that each view's queries use the expected indexes without full scans or extra sorts"""
+        for check in VIEW_PLAN_CHECKS:
+            with self.subTest(check.url_name, query=check.query):
+                client = Client()
+                if check.login:
+                    client.force_login(self.staff if check.staff else self.booking.user)
+                url = reverse(check.url_name, kwargs=self.fill(check.kwargs))
+                with capture_selects() as selects:
+                    response = client.get(url, self.fill(check.query))
+                self.assertEqual(response.status_code, 200)
+
+                plans = [explain(sql, params) for sql, params in selects]
+                used = set().union(*(plan.indexes for plan in plans))
+                for index in check.indexes:
+                    self.assertIn(index, used, '\n\n'.join(map(str, plans)))
+                for plan in plans:
+                    scans = [table for table in plan.full_scans
+                             if table not in SMALL_TABLES + check.allow_full_scan]
+                    self.assertEqual(scans, [], f'Full table scan in:\n{plan}')
+                    if any(step.table in check.ordered for step in plan.steps):
+                        self.assertFalse(plan.temp_sort, f'Temporary sort in:\n{plan}')
+
+    def test_mysql_plan(self):
+        """Test that MySQL JSON plans are read down to nested and subquery tables"""
+        steps, temp_sort = parse_mysql_plan({'query_block': {
+            'ordering_operation': {'using_filesort': True, 'nested_loop': [
+                {'table': {'table_name': 'travel_booking_booking', 'access_type': 'ref',
+                           'key': 'booking_user_date_idx'}},
+                {'table': {'table_name': 'travel_booking_traveloption', 'access_type': 'ALL'}},
+            ]},
+            'select_list_subqueries': [{'query_block': {'table': {
+                'table_name': 'U0', 'access_type': 'range', 'key': 'unique_price_tier'}}}],
+        }})
+        self.assertTrue(temp_sort)
+        self.assertEqual([(step.table, step.index, step.full_scan) for step in steps], [
+            ('travel_booking_booking', 'booking_user_date_idx', False),
+            ('travel_booking_traveloption', None, True),
+            ('U0', 'unique_price_tier', False),
+        ])
+
+
+class TimezoneDateSearchTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.day = timezone.localdate() + timedelta(days=5)
+        cls.option = create_bus()
+        # 23:00 in New York is already the next morning in India
+        cls.option.departure_datetime = timezone.make_aware(
+            datetime(cls.day.year, cls.day.month, cls.day.day, 23), ZoneInfo('America/New_York'))
+        cls.option.arrival_datetime = cls.option.departure_datetime + timedelta(hours=5)
+        cls.option.save()
+        cls.user = User.objects.create_user(username='traveller', password='testpass123',
+                                            first_name='Test', last_name='User', email='traveller@example.com')
+        UserProfile.objects.create(user=cls.user)
+
+    def search(self, day):
+        response = self.client.get(reverse('home'), {'departure_date': day.isoformat()})
+        return [option.travel_id for option in response.context['travel_options']]
+
+    def test_local_day_range(self):
+        """Test that a local day becomes a UTC half-open range, 23 hours long on a DST change"""
+        start, end = local_day_range('2026-03-08')
+        self.assertEqual(start, datetime(2026, 3, 7, 18, 30, tzinfo=dt_timezone.utc))
+        self.assertEqual(end - start, timedelta(days=1))
+        with timezone.override(ZoneInfo('America/New_York')):
+            start, end = local_day_range('2026-03-08')
+        self.assertEqual(start, datetime(2026, 3, 8, 5, 0, tzinfo=dt_timezone.utc))
+        self.assertEqual(end - start, timedelta(hours=23))
+        self.assertIsNone(local_day_range('2026-02-30'))
+
+    def test_search_follows_profile_time_zone(self):
+        """Test that date search uses the signed-in user's time zone from their profile"""
+        next_day = self.day + timedelta(days=1)
+        self.assertEqual(self.search(self.day), [])
+        self.assertEqual(self.search(next_day), [self.option.travel_id])
+
+        self.client.login(username='traveller', password='testpass123')
+        response = self.client.post(reverse('profile'), {
+            'first_name': 'Test', 'last_name': 'User', 'email': 'traveller@example.com',
+            'time_zone': 'America/New_York',
+        })
+        self.assertRedirects(response, reverse('home'))
+        self.assertEqual(UserProfile.objects.get(user=self.user).time_zone, 'America/New_York')
+        self.assertEqual(self.search(self.day), [self.option.travel_id])
+        self.assertEqual(self.search(next_day), [])
+
+        response = self.client.post(reverse('profile'), {
+            'first_name': 'Test', 'last_name': 'User', 'email': 'traveller@example.com', 'time_zone': 'Mars/Olympus',
+        })
+        self.assertContains(response, 'Choose a valid time zone.')
+
+    def test_time_zone_loaded_once_per_session(self):
+        """Test that a zone saved on the profile is read once at sign-in, not on every request"""
+        UserProfile.objects.filter(user=self.user).update(time_zone='America/New_York')
+        self.client.login(username='traveller', password='testpass123')
+        self.assertEqual(self.search(self.day), [self.option.travel_id])
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('home'))
+        self.assertFalse(any('userprofile' in query['sql'] for query in queries))
@@ -0,0 +1,203 @@
+"""
+E-tickets.
+
+A ticket is rendered with Pillow once per (booking_id, updated_at, zone)
+and kept under MEDIA_ROOT/tickets/<booking_id>-<updated_at>-<zone>.<format>.
+Times are printed in the passenger's profile time zone (TIME_ZONE if none),
+whoever downloads the ticket. Any change to the booking bumps updated_at,
+and a profile zone change changes the zone, so either way the file name
+changes and a stale ticket is never served. New bookings get their tickets
+rendered on a background thread after commit, and cancelling a booking
+deletes its files.
+
+Files are sent with FileResponse, which hands the open file to the
+server's wsgi.file_wrapper (sendfile under gunicorn). Behind a proxy,
+TICKET_SENDFILE = 'X-Sendfile' or 'X-Accel-Redirect' lets the proxy send
+the file instead.
+"""
+import logging
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from django.conf import settings
+from django.core.signing import Signer
+from django.db import connection, transaction
+from django.http import FileResponse, HttpResponse
+from django.utils import timezone
+
+from . import qr
+from .timezones import get_zone
+
+logger = logging.getLogger(__name__)
+
+TICKET_DIR = 'tickets'
+TICKET_FORMATS = {'png': 'image/png', 'pdf': 'application/pdf'}
+REFERENCE_SALT = 'travel_booking.tickets'
+
+WIDTH, HEIGHT = 1200, 560
+QR_SCALE = 8
+PDF_RESOLUTION = 150
+
+
+def ticket_reference(booking):
+    """Signed booking reference encoded in the QR code, checked at boarding"""
+    return Signer(salt=REFERENCE_SALT).sign(f'TB-{booking.booking_id}')
+
+
+def ticket_zone(booking):
+    """Name of the zone a ticket's times are printed in: the passenger's profile zone, or TIME_ZONE"""
+    from .models import UserProfile
+
+    name = UserProfile.objects.filter(user_id=booking.user_id).values_list('time_zone', flat=True).first()
+    return name or settings.TIME_ZONE
+
+
+def ticket_path(booking, fmt, zone=None):
+    stamp = int(booking.updated_at.timestamp() * 1_000_000)
+    zone = (zone or ticket_zone(booking)).replace('/', '.')
+    return Path(settings.MEDIA_ROOT) / TICKET_DIR / f'{booking.booking_id}-{stamp}-{zone}.{fmt}'
+
+
+def _stored_tickets(booking_id):
+    directory = Path(settings.MEDIA_ROOT) / TICKET_DIR
+    return directory.glob(f'{booking_id}-*') if directory.is_dir() else []
+
+
+def render_ticket(booking, zone):
+    """Ticket image for a booking, with times in the named zone"""
+    # Pillow is only needed by whoever renders tickets
+    from PIL import Image, ImageDraw, ImageFont
+
+    option = booking.travel_option
+    image = Image.new('RGB', (WIDTH, HEIGHT), 'white')
+    draw = ImageDraw.Draw(image)
+    fonts = {size: ImageFont.load_default(size=size) for size in (22, 28, 44)}
+
+    draw.rectangle([0, 0, WIDTH, 90], fill='#0d6efd')
+    draw.text((40, 24), 'E-TICKET', font=fonts[44], fill='white')
+    draw.text((WIDTH - 40, 34), f'Booking #{booking.booking_id}', font=fonts[28], fill='white', anchor='ra')
+
+    departure = timezone.localtime(option.departure_datetime, get_zone(zone))
+    arrival = timezone.localtime(option.arrival_datetime, get_zone(zone))
+    draw.text((40, 120), f'{option.source} to {option.destination}', font=fonts[44], fill='#212529')
+    draw.text((40, 180), f'{option.get_travel_type_display()} · {option.operator}', font=fonts[28], fill='#212529')
+    rows = [
+        ('Departure', f'{departure:%a %d %b %Y, %H:%M %Z}'),
+        ('Arrival', f'{arrival:%a %d %b %Y, %H:%M %Z}'),
+        ('Seats', str(booking.number_of_seats)),
+        ('Paid', f'Rs. {booking.total_price:,.2f}'),  # the default font has no rupee sign
+    ]
+    passengers = list(booking.passenger_details or [])
+    if passengers:
+        shown = ', '.join(passengers[:4]) + (f' +{len(passengers) - 4} more' if len(passengers) > 4 else '')
+        rows.append(('Passengers', shown))
+    for index, (label, value) in enumerate(rows):
+        y = 240 + index * 40
+        draw.text((40, y), label, font=fonts[22], fill='#6c757d')
+        draw.text((190, y), value, font=fonts[22], fill='#212529')
+
+    code = qr.encode(ticket_reference(booking), 'M')
+    border = 4 * QR_SCALE
+    side = code.size * QR_SCALE + 2 * border
+    left, top = WIDTH - 40 - side, 110
+    for row, modules in enumerate(code.modules):
+        for column, dark in enumerate(modules):
+            if dark:
+                x, y = left + border + column * QR_SCALE, top + border + row * QR_SCALE
+                draw.rectangle([x, y, x + QR_SCALE - 1, y + QR_SCALE - 1], fill='black')
+    draw.text((left + side // 2, top + side + 8), 'Show this code when boarding',
+              font=fonts[22], fill='#6c757d', anchor='ma')
+    return image
+
+
+def build_ticket(booking, fmt):
+    """Path of the booking's ticket, rendering and storing it if this version is not on disk yet"""
+    zone = ticket_zone(booking)
+    path = ticket_path(booking, fmt, zone)
+    if path.exists():
+        return path
+    path.parent.mkdir(parents=True, exist_ok=True)
+    image = render_ticket(booking, zone)
+    # Write under a temporary name so readers never see a partial file
+    descriptor, temporary = tempfile.mkstemp(dir=path.parent, suffix=f'.{fmt}.tmp')
+    try:
+        with os.fdopen(descriptor, 'wb') as output:
+            if fmt == 'pdf':
+                image.save(output, 'PDF', resolution=PDF_RESOLUTION)
+            else:
+                image.save(output, 'PNG', optimize=True)
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+    for stale in _stored_tickets(booking.booking_id):
+        if stale.suffix == path.suffix and stale != path:
+            stale.unlink(missing_ok=True)
+    return path
+
+
+def invalidate_tickets(booking_id):
+    """Delete every stored ticket of a booking"""
+    for stored in _stored_tickets(booking_id):
+        stored.unlink(missing_ok=True)
+
+
+def ticket_response(path, fmt, filename):
+    sendfile = getattr(settings, 'TICKET_SENDFILE', '')
+    if sendfile:
+        response = HttpResponse(content_type=TICKET_FORMATS[fmt])
+        if sendfile.lower() == 'x-accel-redirect':
+            # nginx maps an internal location onto MEDIA_ROOT
+            relative = path.relative_to(settings.MEDIA_ROOT).as_posix()
+            response['X-Accel-Redirect'] = f'{settings.MEDIA_URL}{relative}'
+        else:
+            response[sendfile] = str(path)
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    else:
+        response = FileResponse(open(path, 'rb'), as_attachment=True, filename=filename,
+                                content_type=TICKET_FORMATS[fmt])
+    response['Cache-Control'] = 'private'
+    return response
+
+
+def pregenerate_tickets(booking_ids):
+    """Render every format for the given confirmed bookings"""
+    from .models import Booking
+
+    try:
+        for booking in Booking.objects.select_related('travel_option').filter(
+                booking_id__in=booking_ids, status='confirmed'):
+            for fmt in TICKET_FORMATS:
+                build_ticket(booking, fmt)
+    except Exception:
+        logger.exception('Pre-generating tickets for bookings %s failed', booking_ids)
+
+
+def _pregenerate_in_background(booking_ids):
+    try:
+        pregenerate_tickets(booking_ids)
+    finally:
+        connection.close()  # the executor thread's own connection
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def schedule_tickets(bookings):
+    """Render the bookings' tickets on a background thread once the current transaction commits"""
+    if not getattr(settings, 'TICKET_PREGENERATE', True):
+        return
+    booking_ids = [booking.booking_id for booking in bookings]
+
+    def submit():
+        global _executor
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='tickets')
+        _executor.submit(_pregenerate_in_background, booking_ids)
+
+    transaction.on_commit(submit)
@@ -0,0 +1,58 @@
+"""
+Per-user time zones.
+
+UserProfile.time_zone overrides TIME_ZONE for a signed-in user. The zone
+is copied into the session the first time it is needed, and again when the
+profile is saved. From then on UserTimezoneMiddleware activates it from
+the session, so local dates in forms, templates and searches follow the
+user without a profile query on every request.
+"""
+from functools import lru_cache
+from zoneinfo import ZoneInfo, available_timezones
+
+from django.core.exceptions import ValidationError
+from django.utils import timezone
+
+SESSION_KEY = '_time_zone'
+
+
+@lru_cache(maxsize=1)
+def time_zone_names():
+    """Sorted IANA zone names accepted for a profile"""
+    return sorted(available_timezones())
+
+
+@lru_cache(maxsize=None)
+def get_zone(name):
+    return ZoneInfo(name)
+
+
+def validate_time_zone(name):
+    if name and name not in time_zone_names():
+        raise ValidationError(f'{name} is not a known time zone.')
+
+
+def remember_time_zone(request, name):
+    """Store the user's zone in the session ('' means the site default)"""
+    request.session[SESSION_KEY] = name or ''
+
+
+class UserTimezoneMiddleware:
+    """Activate the signed-in user's profile time zone for the request"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        name = request.session.get(SESSION_KEY)
+        if name is None and request.user.is_authenticated:
+            from .models import UserProfile
+
+            name = UserProfile.objects.filter(user=request.user).values_list('time_zone', flat=True).first()
+            remember_time_zone(request, name)
+        if name:
+            timezone.activate(get_zone(name))
+        try:
+            return self.get_response(request)
+        finally:
+            timezone.deactivate()
@@ -0,0 +1,216 @@
+"""
+Production traffic capture and replay.
+
+With TRAFFIC_CAPTURE_FILE set, TrafficCaptureMiddleware appends one JSON
+line per request to that file:
+
+    {"ts": 1760000000.123, "method": "GET", "path": "/", "url_name": "home",
+     "params": {"source": ["Mumbai"]}, "form": [], "user": "anon",
+     "status": 200, "ms": 12.4}
+
+Traces are anonymized. Signed-in users become one of
+TRAFFIC_CAPTURE_USER_BUCKETS stable buckets derived from a keyed hash of
+their id. POST bodies keep only their field names. Sensitive query
+parameters, cookies, headers and client addresses are never written.
+Each line goes out in one O_APPEND write, so gunicorn workers and
+threads can share the file. Requests carrying an X-Traffic-Replay header
+equal to TRAFFIC_REPLAY_TOKEN are left out, so replaying a trace against a
+capturing server does not feed the next trace.
+
+The replay_traffic command reads a trace and sends it to a running server
+at the recorded pace or faster, then reports latency percentiles per URL
+name. GET and HEAD requests are always replayed. Booking, waitlist and
+cancellation POSTs are replayed only when writes are allowed, which is for
+servers running on a disposable copy of the database. Their recorded field
+names are filled with FORM_PLACEHOLDERS and a fresh idempotency key, and
+CSRF is satisfied with a token the replayer sets as both cookie and form
+field.
+"""
+import http.client
+import json
+import math
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode, urlsplit
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.utils.crypto import constant_time_compare, get_random_string, salted_hmac
+
+SENSITIVE_PARAMS = {'csrfmiddlewaretoken', 'password', 'password1', 'password2', 'token', 'key'}
+REPLAYED_METHODS = {'GET', 'HEAD'}
+REPLAY_USER_AGENT = 'travel-booking-replay'
+REPLAY_HEADER = 'X-Traffic-Replay'
+
+# Values sent for the recorded field names of replayed POSTs; a POST with any other field is skipped
+FORM_PLACEHOLDERS = {
+    'number_of_seats': '1',
+    'passenger_names': 'Replay Passenger',
+    'terms': 'on',
+    'confirm_cancel': 'yes',
+    'leave': 'yes',
+}
+
+
+def user_bucket(user, buckets):
+    """'anon' or a stable bucket number for a signed-in user that cannot be mapped back to the account"""
+    if not user.is_authenticated:
+        return 'anon'
+    digest = salted_hmac('travel_booking.traffic', str(user.pk)).hexdigest()
+    return int(digest[:8], 16) % buckets
+
+
+class TrafficCaptureMiddleware:
+    """Record an anonymized trace line for every request (off unless TRAFFIC_CAPTURE_FILE is set)"""
+
+    def __init__(self, get_response):
+        path = getattr(settings, 'TRAFFIC_CAPTURE_FILE', '')
+        if not path:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.buckets = getattr(settings, 'TRAFFIC_CAPTURE_USER_BUCKETS', 64)
+        self.replay_token = getattr(settings, 'TRAFFIC_REPLAY_TOKEN', '')
+        self.fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o640)
+
+    def __call__(self, request):
+        ts = time.time()
+        started = time.perf_counter()
+        response = self.get_response(request)
+        elapsed = time.perf_counter() - started
+        if self.replay_token and constant_time_compare(request.headers.get(REPLAY_HEADER, ''), self.replay_token):
+            return response  # keep replays of a trace out of the next one
+
+        match = request.resolver_match
+        user = getattr(request, 'user', None)
+        entry = {
+            'ts': round(ts, 3),
+            'method': request.method,
+            'path': request.path_info,
+            'url_name': match.view_name if match else None,
+            'params': {key: values for key, values in request.GET.lists() if key not in SENSITIVE_PARAMS},
+            'form': sorted(key for key in request.POST if key not in SENSITIVE_PARAMS)
+            if request.method == 'POST' else [],
+            'user': user_bucket(user, self.buckets) if user is not None else 'anon',
+            'status': response.status_code,
+            'ms': round(elapsed * 1000, 2),
+        }
+        os.write(self.fd, (json.dumps(entry, separators=(',', ':')) + '\n').encode())
+        return response
+
+
+def read_trace(path):
+    """Trace entries in recorded order"""
+    with open(path, encoding='utf-8') as trace:
+        entries = [json.loads(line) for line in trace if line.strip()]
+    entries.sort(key=lambda entry: entry['ts'])
+    return entries
+
+
+def percentile(ordered, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+class Replayer:
+    """Send trace entries to a server from a pool of threads, one keep-alive connection each"""
+
+    def __init__(self, base_url, workers=8, speed=1.0, cookie='', timeout=30, replay_token=''):
+        parts = urlsplit(base_url)
+        self.connection_class = (http.client.HTTPSConnection if parts.scheme == 'https'
+                                 else http.client.HTTPConnection)
+        self.netloc = parts.netloc
+        self.prefix = parts.path.rstrip('/')
+        self.workers = workers
+        self.speed = speed
+        # Any well-formed secret passes CSRF when cookie and form field agree
+        self.csrf_token = get_random_string(32)
+        csrf_cookie = f'{settings.CSRF_COOKIE_NAME}={self.csrf_token}'
+        self.headers = {'User-Agent': REPLAY_USER_AGENT,
+                        'Cookie': f'{cookie}; {csrf_cookie}' if cookie else csrf_cookie}
+        if replay_token:
+            self.headers[REPLAY_HEADER] = replay_token
+        self.post_headers = {**self.headers, 'Content-Type': 'application/x-www-form-urlencoded',
+                             'Origin': f'{parts.scheme}://{parts.netloc}'}
+        self.timeout = timeout
+        self.local = threading.local()
+        self.results = defaultdict(list)  # url_name -> [(status, latency ms)]
+        self.lock = threading.Lock()
+
+    def _connection(self):
+        if getattr(self.local, 'connection', None) is None:
+            self.local.connection = self.connection_class(self.netloc, timeout=self.timeout)
+        return self.local.connection
+
+    def _form(self, entry):
+        """Request body for a replayed POST"""
+        form = {field: FORM_PLACEHOLDERS.get(field, '') for field in entry['form']}
+        if 'idempotency_key' in form:
+            form['idempotency_key'] = uuid.uuid4().hex  # each captured submission made its own booking
+        form['csrfmiddlewaretoken'] = self.csrf_token
+        return urlencode(form)
+
+    def _send(self, entry, scheduled):
+        target = self.prefix + entry['path']
+        if entry['params']:
+            target += '?' + urlencode(entry['params'], doseq=True)
+        body, headers = None, self.headers
+        if entry['method'] == 'POST':
+            body, headers = self._form(entry), self.post_headers
+        # Paced replays count from the time the request was due, so a
+        # saturated server shows up as queueing rather than being hidden by
+        # it. At full speed nothing is due, so latency starts at the send.
+        started = scheduled if scheduled is not None else time.perf_counter()
+        try:
+            connection = self._connection()
+            connection.request(entry['method'], target, body=body, headers=headers)
+            response = connection.getresponse()
+            response.read()
+            status = response.status
+        except (OSError, http.client.HTTPException):
+            if getattr(self.local, 'connection', None) is not None:
+                self.local.connection.close()
+                self.local.connection = None
+            status = None
+        latency = (time.perf_counter() - started) * 1000
+        with self.lock:
+            self.results[entry['url_name'] or entry['path']].append((status, latency))
+
+    def run(self, entries):
+        """Replay the entries, keeping their recorded spacing divided by speed (0: as fast as possible)"""
+        if not entries:
+            return self.results
+        first = entries[0]['ts']
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='replay') as pool:
+            start = time.perf_counter()
+            for entry in entries:
+                scheduled = None
+                if self.speed:
+                    scheduled = start + (entry['ts'] - first) / self.speed
+                    delay = scheduled - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                pool.submit(self._send, entry, scheduled)
+        return self.results
+
+
+def skip_reason(entry, with_session, with_writes):
+    """Why an entry cannot be replayed, or None if it can
+
+    Signed-in requests need a session cookie. POSTs need writes to be
+    allowed and only fields that FORM_PLACEHOLDERS can fill.
+    """
+    method = entry['method']
+    if method == 'POST':
+        if not with_writes:
+            return 'POST'
+        if any(field not in FORM_PLACEHOLDERS and field != 'idempotency_key' for field in entry['form']):
+            return 'POST with other fields'
+    elif method not in REPLAYED_METHODS:
+        return method
+    if entry['user'] != 'anon' and not with_session:
+        return 'signed in'
+    return None
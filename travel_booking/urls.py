@@ -5,9 +5,13 @@ urlpatterns = [
     path('', views.home, name='home'),
     path('travel/<int:travel_id>/', views.travel_detail, name='travel_detail'),
     path('book/<int:travel_id>/', views.book_travel, name='book_travel'),
+    path('travel/<int:travel_id>/waitlist/', views.join_waitlist, name='join_waitlist'),
+    path('api/bookings/batch/', views.book_batch, name='book_batch'),
     path('bookings/', views.my_bookings, name='my_bookings'),
     path('booking/<int:booking_id>/', views.booking_detail, name='booking_detail'),
+    path('booking/<int:booking_id>/ticket.<str:fmt>', views.booking_ticket, name='booking_ticket'),
     path('cancel/<int:booking_id>/', views.cancel_booking, name='cancel_booking'),
     path('profile/', views.profile, name='profile'),
+    path('reports/operators/', views.operator_report, name='operator_report'),
     path('ajax/search-cities/', views.search_cities, name='search_cities'),
 ]
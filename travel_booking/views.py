@@ -2,18 +2,45 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth import login, authenticate, logout
 from django.contrib.auth.models import User
 from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib import messages
-from django.db import transaction
+from django.db import transaction, IntegrityError
+from django.db.models import Q
 from django.core.paginator import Paginator
 from django.utils import timezone
-from django.http import JsonResponse
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse, Http404
+from django.views.decorators.http import condition
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.template.loader import render_to_string
+from django.utils.text import slugify
+from functools import wraps
 from django.core.validators import validate_email
 from django.core.exceptions import ValidationError
 from datetime import datetime, timedelta
+from decimal import Decimal
+import itertools
 import json
 import re
+import uuid
 
-from .models import TravelOption, Booking, UserProfile
+from .models import (
+    TravelOption, Booking, UserProfile, ArchivedBooking, BookingRequest, BookingEvent, WaitlistEntry,
+    TrendingRoute,
+)
+from .search import (
+    SORT_OPTIONS, search_travel_options, search_connections, parse_price, parse_time, format_durations,
+    local_day_range,
+)
+from .pricing import with_current_fare
+from .events import record_booking_event, build_booking_event
+from .waitlist import promote_waitlist
+from .timezones import time_zone_names, remember_time_zone
+from .tickets import TICKET_FORMATS, build_ticket, ticket_response, schedule_tickets, invalidate_tickets
+from .popularity import record_search, rank_cities
+from .caching import (
+    TRAVEL_DETAIL_PUBLIC_MAX_AGE, get_cached_travel_detail,
+    set_cached_travel_detail, invalidate_travel_detail,
+)
 
 def home(request):
     """Home page with search functionality"""
@@ -22,44 +49,50 @@ def home(request):
     destination = request.GET.get('destination', '').strip()
     travel_type = request.GET.get('travel_type', '').strip()
     departure_date = request.GET.get('departure_date', '').strip()
+    sort = request.GET.get('sort', '').strip()
+    sort = sort if sort in SORT_OPTIONS else 'departure'
+    min_price = parse_price(request.GET.get('min_price', '').strip())
+    max_price = parse_price(request.GET.get('max_price', '').strip())
+    depart_after = parse_time(request.GET.get('depart_after', '').strip())
+    depart_before = parse_time(request.GET.get('depart_before', '').strip())
     
-    # Start with available travel options
-    travel_options = TravelOption.objects.filter(
-        departure_datetime__gt=timezone.now(),
-        available_seats__gt=0
+    travel_options = search_travel_options(
+        source, destination, travel_type, departure_date, sort=sort,
+        min_price=min_price, max_price=max_price, depart_after=depart_after, depart_before=depart_before,
     )
     
-    # Apply filters if provided
-    if source:
-        travel_options = travel_options.filter(source__icontains=source)
-    
-    if destination:
-        travel_options = travel_options.filter(destination__icontains=destination)
-    
-    if travel_type and travel_type in ['flight', 'train', 'bus']:
-        travel_options = travel_options.filter(travel_type=travel_type)
-    
-    if departure_date:
-        try:
-            date_obj = datetime.strptime(departure_date, '%Y-%m-%d').date()
-            travel_options = travel_options.filter(departure_datetime__date=date_obj)
-        except ValueError:
-            pass  # Invalid date format, ignore filter
-    
     # Pagination
     paginator = Paginator(travel_options, 10)
     page_number = request.GET.get('page')
     page_obj = paginator.get_page(page_number)
     
+    # Count each search once, not once per page
+    if (source or destination) and page_obj.number == 1:
+        record_search(source, destination)
+    
+    # No direct service: offer connecting journeys instead
+    connections = []
+    if source and destination and not paginator.count:
+        connections = search_connections(source, destination, departure_date)
+    
     context = {
         'page_obj': page_obj,
         'travel_options': page_obj,
-        'today': timezone.now().date(),
+        'result_rows': format_durations(page_obj),
+        'connections': connections,
+        'trending_routes': list(TrendingRoute.objects.all()),
+        'sort_options': SORT_OPTIONS,
+        'today': timezone.localdate(),
         'search_data': {
             'source': source,
             'destination': destination,
             'travel_type': travel_type,
             'departure_date': departure_date,
+            'sort': sort,
+            'min_price': min_price if min_price is not None else '',
+            'max_price': max_price if max_price is not None else '',
+            'depart_after': depart_after.strftime('%H:%M') if depart_after else '',
+            'depart_before': depart_before.strftime('%H:%M') if depart_before else '',
         }
     }
     
@@ -181,6 +214,7 @@ def profile(request):
         phone_number = request.POST.get('phone_number', '').strip()
         address = request.POST.get('address', '').strip()
         date_of_birth = request.POST.get('date_of_birth', '').strip()
+        time_zone = request.POST.get('time_zone', '').strip()
         
         errors = {}
         
@@ -219,6 +253,9 @@ def profile(request):
             except ValueError:
                 errors['date_of_birth'] = 'Enter a valid date.'
         
+        if time_zone and time_zone not in time_zone_names():
+            errors['time_zone'] = 'Choose a valid time zone.'
+        
         if not errors:
             try:
                 # Update user
@@ -234,7 +271,9 @@ def profile(request):
                     profile.date_of_birth = datetime.strptime(date_of_birth, '%Y-%m-%d').date()
                 else:
                     profile.date_of_birth = None
+                profile.time_zone = time_zone
                 profile.save()
+                remember_time_zone(request, time_zone)
                 
                 messages.success(request, 'Profile updated successfully!')
                 return redirect('home')
@@ -252,7 +291,9 @@ def profile(request):
                 'phone_number': phone_number,
                 'address': address,
                 'date_of_birth': date_of_birth,
-            }
+                'time_zone': time_zone,
+            },
+            'time_zones': time_zone_names(),
         })
     
     # GET request - populate form with current data
@@ -263,21 +304,86 @@ def profile(request):
         'phone_number': profile.phone_number or '',
         'address': profile.address or '',
         'date_of_birth': profile.date_of_birth.strftime('%Y-%m-%d') if profile.date_of_birth else '',
+        'time_zone': profile.time_zone,
     }
     
-    return render(request, 'travel_booking/profile.html', {'form_data': form_data})
+    return render(request, 'travel_booking/profile.html', {'form_data': form_data, 'time_zones': time_zone_names()})
+
+def _travel_detail_stamp(request, travel_id):
+    """Cheap (updated_at, departure_datetime) lookup, done once per request"""
+    if not hasattr(request, '_travel_detail_stamp'):
+        request._travel_detail_stamp = TravelOption.objects.filter(
+            travel_id=travel_id
+        ).values_list('updated_at', 'departure_datetime').first()
+    return request._travel_detail_stamp
+
+def _travel_detail_etag(request, travel_id):
+    stamp = _travel_detail_stamp(request, travel_id)
+    if stamp is None:
+        return None
+    updated_at, departure_datetime = stamp
+    # The page also depends on who is looking, the time zone its times are
+    # shown in and whether the departure has already left, none of which
+    # touches updated_at.
+    departed = int(departure_datetime <= timezone.now())
+    zone = timezone.get_current_timezone_name()
+    return f'"{travel_id}-{updated_at.timestamp():.6f}-{request.user.pk or 0}-{zone}-{departed}"'
 
+def _travel_detail_last_modified(request, travel_id):
+    stamp = _travel_detail_stamp(request, travel_id)
+    if stamp is None:
+        return None
+    updated_at, departure_datetime = stamp
+    if updated_at < departure_datetime <= timezone.now():
+        return departure_datetime
+    return updated_at
+
+def _travel_detail_cache_control(view_func):
+    """Public caching for anonymous users, revalidation for logged-in users"""
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        response = view_func(request, *args, **kwargs)
+        if response.status_code in (200, 304):
+            if request.user.is_authenticated:
+                patch_cache_control(response, private=True, no_cache=True)
+            else:
+                patch_cache_control(response, public=True, max_age=TRAVEL_DETAIL_PUBLIC_MAX_AGE)
+        patch_vary_headers(response, ['Cookie'])
+        return response
+    return wrapper
+
+@_travel_detail_cache_control
+@condition(etag_func=_travel_detail_etag, last_modified_func=_travel_detail_last_modified)
 def travel_detail(request, travel_id):
     """Travel option detail view"""
-    travel_option = get_object_or_404(TravelOption, travel_id=travel_id)
-    return render(request, 'travel_booking/travel_detail.html', {
-        'travel_option': travel_option
-    })
+    etag = _travel_detail_etag(request, travel_id)
+    # Only anonymous pages without pending flash messages are shareable
+    cacheable = etag and not request.user.is_authenticated and not len(messages.get_messages(request))
+    if cacheable:
+        content = get_cached_travel_detail(travel_id, etag)
+        if content is not None:
+            return HttpResponse(content)
+
+    travel_option = get_object_or_404(with_current_fare(TravelOption.objects.all()), travel_id=travel_id)
+    content = render_to_string('travel_booking/travel_detail.html', {
+        'travel_option': travel_option,
+        'now': timezone.now(),
+    }, request=request)
+    if cacheable:
+        set_cached_travel_detail(travel_id, etag, content)
+    return HttpResponse(content)
 
 @login_required
 def book_travel(request, travel_id):
     """Book a travel option"""
-    travel_option = get_object_or_404(TravelOption, travel_id=travel_id)
+    idempotency_key = _idempotency_key(request)
+    if request.method == 'POST' and idempotency_key:
+        # A retried submission goes straight to the booking it already made
+        replay = _replayed_booking_redirect(request, idempotency_key, travel_id)
+        if replay:
+            return replay
+    
+    travel_option = get_object_or_404(with_current_fare(TravelOption.objects.all()), travel_id=travel_id)
     
     if not travel_option.is_available:
         messages.error(request, 'This travel option is no longer available.')
@@ -313,19 +419,9 @@ def book_travel(request, travel_id):
                 errors['passenger_names'] = f'Number of passenger names ({len(passenger_list)}) must match number of seats ({seats}).'
             
             # Validate individual names
-            for i, name in enumerate(passenger_list):
-                if not name:
-                    errors['passenger_names'] = f'Passenger name on line {i+1} is empty.'
-                    break
-                elif len(name) < 2:
-                    errors['passenger_names'] = f'Passenger name on line {i+1} is too short.'
-                    break
-                elif len(name) > 100:
-                    errors['passenger_names'] = f'Passenger name on line {i+1} is too long.'
-                    break
-                elif not re.match(r'^[a-zA-Z\s\.]+$', name):
-                    errors['passenger_names'] = f'Passenger name on line {i+1} contains invalid characters.'
-                    break
+            name_error = _passenger_names_error(passenger_list, 'line')
+            if name_error:
+                errors['passenger_names'] = name_error
         
         if not terms_accepted:
             errors['terms'] = 'You must accept the terms and conditions.'
@@ -333,6 +429,14 @@ def book_travel(request, travel_id):
         if not errors:
             try:
                 with transaction.atomic():
+                    # Claim the key first: a concurrent submission with the same
+                    # key waits on the unique index and fails once this commits
+                    booking_request = None
+                    if idempotency_key:
+                        booking_request = BookingRequest.objects.create(
+                            user=request.user, key=idempotency_key, travel_id=travel_id
+                        )
+                    
                     # Lock the travel option to prevent race conditions
                     travel_option = TravelOption.objects.select_for_update().get(
                         travel_id=travel_id
@@ -341,23 +445,38 @@ def book_travel(request, travel_id):
                     # Check availability again
                     if travel_option.available_seats < seats:
                         errors['number_of_seats'] = 'Not enough seats available.'
+                        # Release the key so the user can retry with fewer seats
+                        transaction.set_rollback(True)
                     else:
-                        # Create booking
+                        # Lock in the fare for the load seen under the row lock
+                        fare = travel_option.current_fare()
                         booking = Booking.objects.create(
                             user=request.user,
                             travel_option=travel_option,
                             number_of_seats=seats,
-                            total_price=travel_option.price * seats,
+                            total_price=fare * seats,
                             passenger_details=passenger_list
                         )
                         
                         # Update available seats
                         travel_option.available_seats -= seats
                         travel_option.save()
+                        record_booking_event('booking_created', travel_option, booking, seats_delta=-seats)
+                        invalidate_travel_detail(travel_option.travel_id)
+                        schedule_tickets([booking])
+                        if booking_request:
+                            booking_request.booking_id = booking.booking_id
+                            booking_request.save(update_fields=['booking_id'])
                         
                         messages.success(request, f'Booking confirmed! Booking ID: #{booking.booking_id}')
                         return redirect('booking_detail', booking_id=booking.booking_id)
                         
+            except IntegrityError:
+                # Lost the race to an identical submission that has now committed
+                replay = _replayed_booking_redirect(request, idempotency_key, travel_id)
+                if replay:
+                    return replay
+                errors['general'] = 'An error occurred while processing your booking. Please try again.'
             except Exception as e:
                 errors['general'] = 'An error occurred while processing your booking. Please try again.'
         
@@ -369,17 +488,248 @@ def book_travel(request, travel_id):
                 'number_of_seats': number_of_seats,
                 'passenger_names': passenger_names,
                 'terms_accepted': terms_accepted,
-            }
+            },
+            'idempotency_key': idempotency_key or uuid.uuid4().hex,
         })
     
     return render(request, 'travel_booking/book_travel.html', {
-        'travel_option': travel_option
+        'travel_option': travel_option,
+        'idempotency_key': uuid.uuid4().hex,
+    })
+
+def _passenger_names_error(passenger_list, position='line'):
+    """First problem with a list of passenger names, or None"""
+    for i, name in enumerate(passenger_list):
+        if not isinstance(name, str) or not name.strip():
+            return f'Passenger name on {position} {i+1} is empty.'
+        name = name.strip()
+        if len(name) < 2:
+            return f'Passenger name on {position} {i+1} is too short.'
+        elif len(name) > 100:
+            return f'Passenger name on {position} {i+1} is too long.'
+        elif not re.match(r'^[a-zA-Z\s\.]+$', name):
+            return f'Passenger name on {position} {i+1} contains invalid characters.'
+    return None
+
+def _idempotency_key(request):
+    """Idempotency-Key header or the booking form's hidden token, if valid"""
+    key = request.headers.get('Idempotency-Key') or request.POST.get('idempotency_key', '')
+    key = key.strip()
+    return key if 0 < len(key) <= 64 else None
+
+def _replayed_booking_redirect(request, key, travel_id):
+    """Redirect to the booking an earlier submission with this key made, if any
+
+    A key already used to book a different travel option gets a 409: the
+    client reused a key, and replaying the other booking would hide that.
+    """
+    row = BookingRequest.objects.filter(
+        user=request.user, key=key, booking_id__isnull=False
+    ).values_list('booking_id', 'travel_id').first()
+    if row is None:
+        return None
+    booking_id, claimed_travel_id = row
+    if claimed_travel_id is not None and claimed_travel_id != travel_id:
+        return HttpResponse('This idempotency key was already used to book a different travel option.',
+                            status=409, content_type='text/plain')
+    messages.info(request, f'This booking was already submitted. Booking ID: #{booking_id}')
+    return redirect('booking_detail', booking_id=booking_id)
+
+CENTS = Decimal('0.01')
+
+# Limits for one batch booking request
+BATCH_MAX_ITEMS = 50
+BATCH_MAX_SEATS_PER_ITEM = 100
+
+def _batch_items_errors(items):
+    """Validate a batch payload's items; returns ({index: message}, [(travel_id, seats, names)])"""
+    if not isinstance(items, list) or not items:
+        return {'items': 'Provide a non-empty list of items.'}, []
+    if len(items) > BATCH_MAX_ITEMS:
+        return {'items': f'At most {BATCH_MAX_ITEMS} items can be booked at once.'}, []
+    errors, parsed, seen = {}, [], set()
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            errors[index] = 'Each item must be an object.'
+            continue
+        travel_id, seats, names = item.get('travel_id'), item.get('seats'), item.get('passenger_names')
+        if not isinstance(travel_id, int) or isinstance(travel_id, bool):
+            errors[index] = 'travel_id must be an integer.'
+        elif travel_id in seen:
+            errors[index] = f'Travel option {travel_id} appears more than once.'
+        elif not isinstance(seats, int) or isinstance(seats, bool) or not 1 <= seats <= BATCH_MAX_SEATS_PER_ITEM:
+            errors[index] = f'seats must be between 1 and {BATCH_MAX_SEATS_PER_ITEM}.'
+        elif not isinstance(names, list) or len(names) != seats:
+            errors[index] = f'Number of passenger names must match number of seats ({seats}).'
+        else:
+            errors[index] = _passenger_names_error(names, 'position')
+            if errors[index] is None:
+                del errors[index]
+                seen.add(travel_id)
+                parsed.append((travel_id, seats, [name.strip() for name in names]))
+    return errors, parsed
+
+def book_batch(request):
+    """JSON endpoint booking several departures in one transaction"""
+    if request.method != 'POST':
+        return JsonResponse({'error': 'POST required.'}, status=405)
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Authentication required.'}, status=401)
+    try:
+        payload = json.loads(request.body)
+    except (ValueError, UnicodeDecodeError):
+        return JsonResponse({'error': 'Invalid JSON.'}, status=400)
+    
+    # Validate everything before taking any lock
+    errors, items = _batch_items_errors(payload.get('items') if isinstance(payload, dict) else None)
+    if errors:
+        return JsonResponse({'errors': errors}, status=400)
+    requested = {travel_id: (seats, names) for travel_id, seats, names in items}
+    upcoming = set(TravelOption.objects.filter(
+        travel_id__in=requested, departure_datetime__gt=timezone.now()
+    ).values_list('travel_id', flat=True))
+    errors = {index: 'This travel option is not available.'
+              for index, (travel_id, _, _) in enumerate(items) if travel_id not in upcoming}
+    if errors:
+        return JsonResponse({'errors': errors}, status=400)
+    
+    with transaction.atomic():
+        # Lock in travel_id order so overlapping batches cannot deadlock
+        travel_options = list(with_current_fare(
+            TravelOption.objects.select_for_update().filter(travel_id__in=requested)
+        ).order_by('travel_id'))
+        short = {option.travel_id: option.available_seats for option in travel_options
+                 if option.available_seats < requested[option.travel_id][0]}
+        if short:
+            return JsonResponse({'errors': {
+                index: f'Only {short[travel_id]} seats available.'
+                for index, (travel_id, _, _) in enumerate(items) if travel_id in short
+            }}, status=409)
+        
+        now = timezone.now()
+        bookings = []
+        for option in travel_options:
+            seats, names = requested[option.travel_id]
+            # Fare for the load seen under the lock, as in book_travel
+            bookings.append(Booking(user=request.user, travel_option=option, number_of_seats=seats,
+                                    total_price=(option.current_fare() * seats).quantize(CENTS),
+                                    passenger_details=names))
+            option.available_seats -= seats
+            option.updated_at = now  # bulk_update skips auto_now
+        TravelOption.objects.bulk_update(travel_options, ['available_seats', 'updated_at'])
+        bookings = Booking.objects.bulk_create(bookings)
+        if bookings[0].pk is None:
+            # Backends without RETURNING (MySQL): the travel option locks keep
+            # other bookings off these rows, so the newest ones are ours
+            ids = dict(Booking.objects.filter(
+                user=request.user, travel_option__in=travel_options
+            ).order_by('booking_id').values_list('travel_option_id', 'booking_id'))
+            for booking in bookings:
+                booking.booking_id = ids[booking.travel_option_id]
+        BookingEvent.objects.bulk_create([
+            build_booking_event('booking_created', booking.travel_option, booking,
+                                seats_delta=-booking.number_of_seats, batch=True)
+            for booking in bookings
+        ])
+        invalidate_travel_detail(*requested)
+        schedule_tickets(bookings)
+    
+    position = {travel_id: index for index, (travel_id, _, _) in enumerate(items)}
+    bookings.sort(key=lambda booking: position[booking.travel_option_id])
+    return JsonResponse({
+        'bookings': [{
+            'booking_id': booking.booking_id,
+            'travel_id': booking.travel_option_id,
+            'seats': booking.number_of_seats,
+            'total_price': str(booking.total_price),
+        } for booking in bookings],
+        'total_price': str(sum(booking.total_price for booking in bookings)),
+    }, status=201)
+
+@login_required
+def join_waitlist(request, travel_id):
+    """Join the waitlist of a sold-out travel option"""
+    travel_option = get_object_or_404(TravelOption, travel_id=travel_id)
+    
+    if travel_option.departure_datetime <= timezone.now():
+        messages.error(request, 'This travel option has already departed.')
+        return redirect('travel_detail', travel_id=travel_id)
+    
+    entry = WaitlistEntry.objects.filter(travel_option=travel_option, user=request.user).first()
+    errors = {}
+    number_of_seats = passenger_names = ''
+    
+    if request.method == 'POST' and request.POST.get('leave') == 'yes':
+        if entry:
+            entry.delete()
+            messages.success(request, 'You have left the waitlist.')
+        return redirect('travel_detail', travel_id=travel_id)
+    
+    if request.method == 'POST' and not entry:
+        number_of_seats = request.POST.get('number_of_seats', '').strip()
+        passenger_names = request.POST.get('passenger_names', '').strip()
+        
+        try:
+            seats = int(number_of_seats)
+            if seats < 1:
+                errors['number_of_seats'] = 'Number of seats must be at least 1.'
+            elif seats > 10:
+                errors['number_of_seats'] = 'Maximum 10 seats can be booked at once.'
+            elif seats > travel_option.total_seats:
+                errors['number_of_seats'] = f'This departure only has {travel_option.total_seats} seats.'
+        except (ValueError, TypeError):
+            errors['number_of_seats'] = 'Enter a valid number of seats.'
+            seats = 0
+        
+        passenger_list = [name.strip() for name in passenger_names.split('\n') if name.strip()]
+        if not passenger_list:
+            errors['passenger_names'] = 'Passenger names are required.'
+        elif len(passenger_list) != seats:
+            errors['passenger_names'] = f'Number of passenger names ({len(passenger_list)}) must match number of seats ({seats}).'
+        else:
+            name_error = _passenger_names_error(passenger_list, 'line')
+            if name_error:
+                errors['passenger_names'] = name_error
+        
+        if not errors and travel_option.available_seats >= seats:
+            messages.info(request, 'Seats are available, you can book them now.')
+            return redirect('book_travel', travel_id=travel_id)
+        
+        if not errors:
+            try:
+                WaitlistEntry.objects.create(
+                    travel_option=travel_option,
+                    user=request.user,
+                    number_of_seats=seats,
+                    passenger_details=passenger_list,
+                )
+            except IntegrityError:
+                pass  # joined from another tab meanwhile
+            messages.success(request, "You're on the waitlist. We'll email you if seats open up.")
+            return redirect('join_waitlist', travel_id=travel_id)
+    
+    position = None
+    if entry:
+        position = WaitlistEntry.objects.filter(
+            Q(created_at__lt=entry.created_at) | Q(created_at=entry.created_at, id__lte=entry.id),
+            travel_option=travel_option,
+        ).count()
+    
+    return render(request, 'travel_booking/join_waitlist.html', {
+        'travel_option': travel_option,
+        'entry': entry,
+        'position': position,
+        'errors': errors,
+        'form_data': {
+            'number_of_seats': number_of_seats,
+            'passenger_names': passenger_names,
+        },
     })
 
 @login_required
 def my_bookings(request):
     """View user's bookings"""
-    bookings = Booking.objects.filter(user=request.user)
+    bookings = Booking.objects.filter(user=request.user).select_related('travel_option')
     
     # Filter by status
     status_filter = request.GET.get('status', '').strip()
@@ -400,11 +750,41 @@ def my_bookings(request):
 @login_required
 def booking_detail(request, booking_id):
     """Booking detail view"""
-    booking = get_object_or_404(Booking, booking_id=booking_id, user=request.user)
+    try:
+        booking = Booking.objects.select_related('travel_option').get(
+            booking_id=booking_id, user=request.user
+        )
+    except Booking.DoesNotExist:
+        # Bookings of long-departed travel options live in the archive tables
+        booking = get_object_or_404(
+            ArchivedBooking.objects.select_related('travel_option'),
+            booking_id=booking_id, user=request.user
+        )
     return render(request, 'travel_booking/booking_detail.html', {
         'booking': booking
     })
 
+@login_required
+def booking_ticket(request, booking_id, fmt):
+    """Download the e-ticket of a confirmed booking as PNG or PDF"""
+    if fmt not in TICKET_FORMATS:
+        raise Http404('Unknown ticket format.')
+    try:
+        booking = Booking.objects.select_related('travel_option').get(
+            booking_id=booking_id, user=request.user
+        )
+    except Booking.DoesNotExist:
+        booking = get_object_or_404(
+            ArchivedBooking.objects.select_related('travel_option'),
+            booking_id=booking_id, user=request.user
+        )
+    if booking.status != 'confirmed':
+        messages.error(request, 'Tickets are only available for confirmed bookings.')
+        return redirect('booking_detail', booking_id=booking_id)
+    
+    path = build_ticket(booking, fmt)
+    return ticket_response(path, fmt, f'ticket-{booking.booking_id}.{fmt}')
+
 @login_required
 def cancel_booking(request, booking_id):
     """Cancel a booking"""
@@ -423,14 +803,28 @@ def cancel_booking(request, booking_id):
         
         try:
             with transaction.atomic():
+                # Lock the booking and its travel option so a double submit
+                # cannot restore the seats twice
+                booking = Booking.objects.select_for_update().get(booking_id=booking_id, user=request.user)
+                if booking.status == 'cancelled':
+                    messages.error(request, 'This booking cannot be cancelled.')
+                    return redirect('booking_detail', booking_id=booking_id)
+                travel_option = TravelOption.objects.select_for_update().get(travel_id=booking.travel_option_id)
+                
                 # Update booking status
                 booking.status = 'cancelled'
                 booking.save()
                 
                 # Restore available seats
-                travel_option = booking.travel_option
                 travel_option.available_seats += booking.number_of_seats
+                record_booking_event('booking_cancelled', travel_option, booking,
+                                     seats_delta=booking.number_of_seats)
+                
+                # Hand the released seats to the waitlist before they go back on sale
+                promote_waitlist(travel_option)
                 travel_option.save()
+                invalidate_travel_detail(travel_option.travel_id)
+                transaction.on_commit(lambda: invalidate_tickets(booking_id))
                 
             messages.success(request, 'Booking cancelled successfully.')
             return redirect('my_bookings')
@@ -449,18 +843,65 @@ def search_cities(request):
     if len(query) < 2:
         return JsonResponse([], safe=False)
     
+    # Only loaded in processes that serve searches from the snapshot
+    from .snapshot import get_departure_snapshot
+    snapshot = get_departure_snapshot()
+    if snapshot is not None:
+        return JsonResponse(rank_cities(snapshot.search_cities(query, limit=None)), safe=False)
+    
     # Get unique cities from travel options
     sources = list(TravelOption.objects.filter(
         source__icontains=query
-    ).values_list('source', flat=True).distinct()[:5])
+    ).order_by().values_list('source', flat=True).distinct()[:50])
     
     destinations = list(TravelOption.objects.filter(
         destination__icontains=query
-    ).values_list('destination', flat=True).distinct()[:5])
+    ).order_by().values_list('destination', flat=True).distinct()[:50])
+    
+    # Combine and deduplicate, most popular first
+    return JsonResponse(rank_cities(set(sources + destinations)), safe=False)
+
+REPORT_PREVIEW_ROWS = 50
+
+@staff_member_required
+def operator_report(request):
+    """Occupancy and revenue per departure or per day, as a preview or a streamed CSV"""
+    # Staff-only page: keep it out of the start-up path of every worker
+    from .reports import GROUPINGS, COLUMNS, REPORTS, report_csv
+    
+    operator = request.GET.get('operator', '').strip()
+    grouping = request.GET.get('group', '').strip()
+    grouping = grouping if grouping in GROUPINGS else 'day'
+    start_date = request.GET.get('start', '').strip()
+    end_date = request.GET.get('end', '').strip()
+    start = local_day_range(start_date) if start_date else None
+    end = local_day_range(end_date) if end_date else None
     
-    # Combine and deduplicate
-    cities = list(set(sources + destinations))[:10]
-    return JsonResponse(sorted(cities), safe=False)
+    # The CSV is generated after UserTimezoneMiddleware has deactivated the
+    # user's zone, so the zone is resolved here and handed to the report
+    zone = timezone.get_current_timezone()
+    rows = REPORTS[grouping](operator, start[0] if start else None, end[1] if end else None, zone)
+    if request.GET.get('format') == 'csv':
+        filename = f"{grouping}-report{'-' + slugify(operator) if operator else ''}.csv"
+        response = StreamingHttpResponse(report_csv(rows, grouping, zone), content_type='text/csv')
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+    
+    columns = COLUMNS[grouping]
+    preview = [[row[key] for _, key in columns] for row in itertools.islice(rows, REPORT_PREVIEW_ROWS + 1)]
+    return render(request, 'travel_booking/operator_report.html', {
+        'headers': [header for header, _ in columns],
+        'rows': preview[:REPORT_PREVIEW_ROWS],
+        'truncated': len(preview) > REPORT_PREVIEW_ROWS,
+        'operators': TravelOption.objects.order_by('operator').values_list('operator', flat=True).distinct(),
+        'groupings': GROUPINGS,
+        'filters': {
+            'operator': operator,
+            'group': grouping,
+            'start': start_date if start else '',
+            'end': end_date if end else '',
+        },
+    })
 
 # Custom login view to handle form data manually
 def custom_login(request):
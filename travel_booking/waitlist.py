@@ -0,0 +1,90 @@
+"""
+Waitlist promotion.
+
+When seats come back to a departure (a cancellation, an admin edit or
+reconcile_seats), the oldest waitlist entries are turned into bookings
+inside the transaction that released the seats, while it still holds the
+TravelOption row lock. Entries are served in the order they joined, but one
+asking for more seats than are free does not block smaller entries behind
+it: it keeps its place and is booked once enough seats come back at once,
+instead of the freed seats going back on public sale. Only entries that fit
+are read, at most one per free seat, through the (travel_option,
+created_at) index.
+"""
+from django.core.mail import send_mail
+from django.db import transaction
+from django.urls import reverse
+from django.utils import timezone
+
+from .events import build_booking_event
+from .models import Booking, BookingEvent, WaitlistEntry
+from .pricing import lookup_fare
+from .tickets import schedule_tickets
+
+
+def promote_waitlist(travel_option):
+    """Book waitlisted entries for the locked travel_option's free seats; returns the new bookings
+
+    The caller must hold select_for_update() on travel_option and save it
+    afterwards; available_seats is decremented here.
+    """
+    if travel_option.available_seats < 1:
+        return []
+    # Every entry needs at least one seat, so no more than this can be promoted
+    head = list(WaitlistEntry.objects.filter(travel_option=travel_option,
+                                             number_of_seats__lte=travel_option.available_seats)
+                .select_related('user').order_by('created_at', 'id')[:travel_option.available_seats])
+
+    bookings, events, promoted = [], [], []
+    for entry in head:
+        if entry.number_of_seats > travel_option.available_seats:
+            continue  # fits no longer; a later, smaller entry still may
+        fare = lookup_fare(travel_option)
+        bookings.append(Booking(user=entry.user, travel_option=travel_option, number_of_seats=entry.number_of_seats,
+                                total_price=fare * entry.number_of_seats, passenger_details=entry.passenger_details))
+        travel_option.available_seats -= entry.number_of_seats
+        promoted.append(entry)
+    if not promoted:
+        return []
+
+    bookings = Booking.objects.bulk_create(bookings)
+    if bookings[0].pk is None:
+        # No RETURNING (MySQL): the row lock keeps other bookings off this departure
+        ids = dict(Booking.objects.filter(
+            travel_option=travel_option, user__in=[entry.user_id for entry in promoted],
+        ).order_by('booking_id').values_list('user_id', 'booking_id'))
+        for booking in bookings:
+            booking.booking_id = ids[booking.user_id]
+
+    # Each event carries the availability right after its own booking
+    available = travel_option.available_seats + sum(booking.number_of_seats for booking in bookings)
+    for booking in bookings:
+        available -= booking.number_of_seats
+        event = build_booking_event('booking_created', travel_option, booking,
+                                    seats_delta=-booking.number_of_seats, waitlist=True)
+        event.available_seats = available
+        events.append(event)
+    BookingEvent.objects.bulk_create(events)
+    WaitlistEntry.objects.filter(pk__in=[entry.pk for entry in promoted]).delete()
+
+    transaction.on_commit(lambda: notify_promoted(bookings))
+    schedule_tickets(bookings)
+    return bookings
+
+
+def notify_promoted(bookings):
+    """Email users whose waitlist entries became bookings"""
+    for booking in bookings:
+        if not booking.user.email:
+            continue
+        option = booking.travel_option
+        send_mail(
+            f'Booking #{booking.booking_id} confirmed from the waitlist',
+            f'Seats opened up on {option.source} to {option.destination} departing '
+            f'{timezone.localtime(option.departure_datetime):%b %d, %Y %H:%M}. Your booking #{booking.booking_id} for '
+            f'{booking.number_of_seats} seat(s) is confirmed.\n\n'
+            f'Details: {reverse("booking_detail", args=[booking.booking_id])}',
+            None,
+            [booking.user.email],
+            fail_silently=True,
+        )
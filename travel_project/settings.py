@@ -39,10 +39,12 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
+    'travel_booking.traffic.TrafficCaptureMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'travel_booking.timezones.UserTimezoneMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -119,6 +121,31 @@ STATICFILES_DIRS = [
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Load-based fares from precomputed price tiers (travel_booking.pricing)
+DYNAMIC_PRICING = config('DYNAMIC_PRICING', default=True, cast=bool)
+
+# Serve home page searches and city autocomplete from an in-memory snapshot (travel_booking.snapshot)
+DEPARTURE_SNAPSHOT = config('DEPARTURE_SNAPSHOT', default=False, cast=bool)
+
+# Suggest connecting journeys when a route has no direct service (travel_booking.routing).
+# The planner keeps every upcoming leg in memory in each worker.
+ROUTE_PLANNER = config('ROUTE_PLANNER', default=False, cast=bool)
+
+# Worker processes for home page searches (travel_booking.search_pool); 0 searches in the request thread
+SEARCH_WORKER_PROCESSES = config('SEARCH_WORKER_PROCESSES', default=0, cast=int)
+
+# Render e-tickets in the background after booking (travel_booking.tickets)
+TICKET_PREGENERATE = config('TICKET_PREGENERATE', default=True, cast=bool)
+
+# Let the proxy send ticket files: '' (serve with FileResponse), 'X-Sendfile' or 'X-Accel-Redirect'
+TICKET_SENDFILE = config('TICKET_SENDFILE', default='')
+
+# Append an anonymized JSONL trace of every request here for replay_traffic; '' disables capture
+TRAFFIC_CAPTURE_FILE = config('TRAFFIC_CAPTURE_FILE', default='')
+TRAFFIC_CAPTURE_USER_BUCKETS = config('TRAFFIC_CAPTURE_USER_BUCKETS', default=64, cast=int)
+# Requests with this value in their X-Traffic-Replay header are not captured; '' captures everything
+TRAFFIC_REPLAY_TOKEN = config('TRAFFIC_REPLAY_TOKEN', default='')
+
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
@@ -0,0 +1,40 @@
+"""
+Fast settings for running the test suite:
+
+    python manage.py test --settings=travel_project.test_settings --parallel
+
+Uses a file-backed SQLite database (each --parallel worker gets its own
+copy), a cheap password hasher and no migrations, and reports per-class
+test durations. An in-memory test database is shared between threads
+through SQLite's shared cache, where a conflicting write fails at once
+instead of waiting for the lock, so threaded tests such as
+ConcurrentBookingSubmissionTest need a file.
+"""
+
+from .settings import *  # noqa: F401,F403
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': ':memory:',
+        'TEST': {'NAME': str(BASE_DIR / 'test_travel_booking.sqlite3')},
+    }
+}
+
+# Real hashers are deliberately slow; every create_user/login pays for it.
+PASSWORD_HASHERS = [
+    'django.contrib.auth.hashers.MD5PasswordHasher',
+]
+
+# Build tables straight from the models instead of replaying migrations.
+MIGRATION_MODULES = {
+    app: None for app in ['admin', 'auth', 'contenttypes', 'sessions', 'messages', 'staticfiles', 'travel_booking']
+}
+
+TEST_RUNNER = 'travel_booking.test_runner.TimedTestRunner'
+
+SILENCED_SYSTEM_CHECKS = ['staticfiles.W004']
+
+# Background ticket rendering would query the database from another thread,
+# outside the test transaction; tests call travel_booking.tickets directly.
+TICKET_PREGENERATE = False